@@ -0,0 +1,217 @@
+"""
+Benchmark suite for the ScriptGenerator parsing pipeline
+
+Measures process_strings, process_file and process_line on single, double and
+fallback (no domain, parsed by splitting) lines, reports lines/sec and peak memory
+and compares them against a stored JSON baseline
+
+Usage:
+    python -m benchmarks.parser --save-baseline          # on the machine used for comparisons
+    python -m benchmarks.parser                          # exits with 1 on regressions
+    python -m benchmarks.parser --sizes 1000 1000000 --targets process_file
+"""
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import chain
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from core.pymap_core import ScriptGenerator
+from scripts.utils import generate_corpus
+
+BenchResults = Dict[str, Dict[str, float]]
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "parser.json"
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_THRESHOLD = 0.25
+# Peak memory differences below this are allocator noise on the small sizes
+MEMORY_SLACK = 64 * 1024
+
+
+def corpus(count: int, creds_type: str = "s") -> List[str]:
+    # Seeded so every run (and the baseline) parses the same lines
+    return list(chain.from_iterable(generate_corpus(count, creds_type, seed=0)))
+
+
+FORMATS: Dict[str, Callable[[int], List[str]]] = {
+    "single": lambda count: corpus(count),
+    "double": lambda count: corpus(count, "d"),
+    # Without "@" the tokenizer rejects the line and the split fallback is used
+    "fallback": lambda count: [line.replace("@", ".") for line in corpus(count, "d")],
+}
+
+
+def new_generator(workdir: Path) -> ScriptGenerator:
+    return ScriptGenerator(
+        "host1",
+        "host2",
+        destination=str(workdir / "sync"),
+        split=1000,
+        pymap_logdir=str(workdir),
+    )
+
+
+def run_process_strings(lines: List[str], path: Path, workdir: Path) -> None:
+    new_generator(workdir).process_strings(lines)
+
+
+def run_process_file(lines: List[str], path: Path, workdir: Path) -> None:
+    new_generator(workdir).process_file(str(path))
+
+
+def run_process_line(lines: List[str], path: Path, workdir: Path) -> None:
+    generator = new_generator(workdir)
+    for line in lines:
+        generator.process_line(line)
+
+
+TARGETS: Dict[str, Callable[[List[str], Path, Path], None]] = {
+    "process_strings": run_process_strings,
+    "process_file": run_process_file,
+    "process_line": run_process_line,
+}
+
+
+def measure(
+    target: Callable[[List[str], Path, Path], None],
+    lines: List[str],
+    path: Path,
+    repeat: int,
+) -> Dict[str, float]:
+    """
+    Best lines/sec out of <repeat> runs, peak memory is measured on a separate run
+    since tracemalloc slows everything down
+    """
+    best: Optional[float] = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as workdir:
+            start = time.perf_counter()
+            target(lines, path, Path(workdir))
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    with tempfile.TemporaryDirectory() as workdir:
+        tracemalloc.start()
+        target(lines, path, Path(workdir))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    seconds = best if best else 1e-9
+    return {
+        "lines_per_sec": len(lines) / seconds,
+        "peak_memory_bytes": float(peak),
+    }
+
+
+def run(
+    sizes: List[int], formats: List[str], targets: List[str], repeat: int
+) -> BenchResults:
+    results: BenchResults = {}
+    with tempfile.TemporaryDirectory() as inputdir:
+        for size in sizes:
+            for fmt in formats:
+                lines = FORMATS[fmt](size)
+                path = Path(inputdir, f"{fmt}_{size}.txt")
+                path.write_text("\n".join(lines) + "\n")
+                for target in targets:
+                    key = f"{target}/{fmt}/{size}"
+                    results[key] = measure(TARGETS[target], lines, path, repeat)
+                    print(
+                        f"{key:<36}{results[key]['lines_per_sec']:>14,.0f} lines/s"
+                        f"{results[key]['peak_memory_bytes'] / 1024 / 1024:>12.2f} MiB"
+                    )
+    return results
+
+
+def compare(
+    results: BenchResults, baseline: BenchResults, threshold: float
+) -> List[str]:
+    """
+    Returns a description of every measurement that regressed by more than <threshold>
+    """
+    regressions: List[str] = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        if current["lines_per_sec"] < previous["lines_per_sec"] * (1 - threshold):
+            regressions.append(
+                f"{key}: {current['lines_per_sec']:,.0f} lines/s, "
+                f"baseline {previous['lines_per_sec']:,.0f} lines/s"
+            )
+        if (
+            current["peak_memory_bytes"]
+            > previous["peak_memory_bytes"] * (1 + threshold) + MEMORY_SLACK
+        ):
+            regressions.append(
+                f"{key}: {current['peak_memory_bytes']:,.0f} bytes peak, "
+                f"baseline {previous['peak_memory_bytes']:,.0f} bytes"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the ScriptGenerator parsing pipeline",
+        prog="benchmarks.parser",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--formats", nargs="+", choices=list(FORMATS), default=list(FORMATS)
+    )
+    parser.add_argument(
+        "--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS)
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Keeps the best out of N runs"
+    )
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=DEFAULT_BASELINE,
+        help="Path of the JSON baseline",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        default=False,
+        help="Stores the results as the new baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Allowed regression as a fraction of the baseline (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+
+    # Fallback lines log a warning each, that would be measuring the log handler
+    logging.disable(logging.CRITICAL)
+    results = run(args.sizes, args.formats, args.targets, args.repeat)
+
+    if args.save_baseline:
+        baseline: BenchResults = {}
+        if args.baseline.is_file():
+            baseline = json.loads(args.baseline.read_text())
+        baseline.update(results)
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True))
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not args.baseline.is_file():
+        print(f"No baseline found in {args.baseline}, run with --save-baseline first")
+        return 0
+    regressions = compare(
+        results, json.loads(args.baseline.read_text()), args.threshold
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Benchmark of the supervision of call_system's children under the gevent pool
+
+Runs --tasks copies of run_jobs' supervision loop (spawn up to --concurrency children,
+wait, reap, save a checkpoint) as greenlets of a single process, the way a worker
+started with --pool=gevent --concurrency=500 runs its call_system tasks. Every task
+runs --jobs children of --duration seconds and saves a checkpoint per reap that blocks
+for --db-latency seconds, like a query of a synchronous database driver.
+Django, Redis and imapsync aren't needed, the children are "sleep"
+
+A heartbeat greenlet asks to be woken every HEARTBEAT seconds, how late it is woken
+is how long every other greenlet of the worker was starved
+
+Modes:
+    gevent     GeventSupervisor and checkpoints in the threadpool (SUPERVISION "gevent")
+    selectors  ProcessSupervisor and checkpoints in the greenlet (SUPERVISION "selectors")
+    blocking   ProcessSupervisor with the original, blocking, selectors, how a task that
+               never yields behaves. Runs its tasks one after the other, keep it small
+
+Usage:
+    python -m benchmarks.supervision
+    python -m benchmarks.supervision --tasks 500 --modes gevent
+    python -m benchmarks.supervision --tasks 20 --modes blocking
+"""
+# Patched before anything else, like the celery worker does with --pool=gevent
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import resource  # noqa: E402
+import time  # noqa: E402
+from statistics import quantiles  # noqa: E402
+from typing import Callable, Dict, List  # noqa: E402
+
+import gevent  # noqa: E402
+
+from migrator.utilites.cooperative import GeventSupervisor, run_blocking  # noqa: E402
+from migrator.utilites.supervisor import ProcessSupervisor  # noqa: E402
+
+HEARTBEAT = 0.01
+# Same role as tasks.PROGRESS_INTERVAL
+WAIT_TIMEOUT = 2.0
+original_sleep: Callable[[float], None] = monkey.get_original("time", "sleep")
+
+
+def blocking_supervisor() -> ProcessSupervisor:
+    supervisor = ProcessSupervisor()
+    supervisor.selector.close()
+    supervisor.selector = monkey.get_original("selectors", "DefaultSelector")()
+    return supervisor
+
+
+SUPERVISORS: Dict[str, Callable[[], ProcessSupervisor]] = {
+    "gevent": GeventSupervisor,
+    "selectors": ProcessSupervisor,
+    "blocking": blocking_supervisor,
+}
+
+
+def save_checkpoint(mode: str, latency: float) -> None:
+    if latency <= 0:
+        return
+    if mode == "gevent":
+        run_blocking(original_sleep, latency, cooperative=True)
+    else:
+        original_sleep(latency)
+
+
+def run_task(
+    mode: str, jobs: int, concurrency: int, duration: float, latency: float
+) -> float:
+    """
+    Supervision loop of a single task, returns the time it finished at
+    """
+    supervisor = SUPERVISORS[mode]()
+    pending = jobs
+    try:
+        while pending or supervisor:
+            while pending and len(supervisor) < concurrency:
+                pending -= 1
+                supervisor.spawn(str(pending), ["sleep", str(duration)])
+            if supervisor.wait(timeout=WAIT_TIMEOUT):
+                save_checkpoint(mode, latency)
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+    return time.monotonic()
+
+
+def heartbeat(lags: List[float]) -> None:
+    while True:
+        start = time.monotonic()
+        gevent.sleep(HEARTBEAT)
+        lags.append(time.monotonic() - start - HEARTBEAT)
+
+
+def run(
+    mode: str,
+    tasks: int,
+    jobs: int,
+    concurrency: int,
+    duration: float,
+    latency: float,
+) -> Dict[str, float]:
+    lags: List[float] = []
+    beat = gevent.spawn(heartbeat, lags)
+    start = time.monotonic()
+    greenlets = [
+        gevent.spawn(run_task, mode, jobs, concurrency, duration, latency)
+        for _ in range(tasks)
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+    elapsed = time.monotonic() - start
+    beat.kill()
+    finished = sorted(greenlet.value - start for greenlet in greenlets)
+    # Every task could finish in this time if none of them waited for the others
+    ideal = -(-jobs // concurrency) * duration
+    return {
+        "elapsed": elapsed,
+        "ideal": ideal,
+        "children_per_second": tasks * jobs / elapsed,
+        "first_task": finished[0],
+        "last_task": finished[-1],
+        "lag_p99": quantiles(lags, n=100)[98] if len(lags) > 1 else 0.0,
+        "lag_max": max(lags, default=0.0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks hundreds of call_system supervision loops on one process",
+        prog="benchmarks.supervision",
+    )
+    parser.add_argument("--tasks", type=int, default=300, help="Concurrent tasks")
+    parser.add_argument("--jobs", type=int, default=4, help="Children per task")
+    parser.add_argument(
+        "--concurrency", type=int, default=2, help="Children running per task"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=0.5, help="Seconds every child runs"
+    )
+    parser.add_argument(
+        "--db-latency",
+        type=float,
+        default=0.005,
+        help="Seconds a checkpoint blocks the thread that saves it",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=list(SUPERVISORS),
+        default=["gevent", "selectors"],
+    )
+    args = parser.parse_args()
+
+    # Every task holds a few descriptors per child
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(
+        f"{args.tasks} tasks x {args.jobs} children ({args.concurrency} at a time, "
+        f"{args.duration}s each), checkpoints block {args.db_latency * 1000:.1f}ms"
+    )
+    print(
+        f"{'mode':<12}{'elapsed (s)':>12}{'ideal (s)':>10}{'children/s':>12}"
+        f"{'last task (s)':>15}{'lag p99 (ms)':>14}{'lag max (ms)':>14}"
+    )
+    for mode in args.modes:
+        result = run(
+            mode,
+            args.tasks,
+            args.jobs,
+            args.concurrency,
+            args.duration,
+            args.db_latency,
+        )
+        print(
+            f"{mode:<12}{result['elapsed']:>12.2f}{result['ideal']:>10.2f}"
+            f"{result['children_per_second']:>12.1f}{result['last_task']:>15.2f}"
+            f"{result['lag_p99'] * 1000:>14.1f}{result['lag_max'] * 1000:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Latency benchmark for the credential tokenizer against adversarial input lines
+
+Usage: python -m benchmarks.tokenizer [--sizes 1000 2000 4000] [--legacy]
+"""
+import argparse
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from core.tokenizer import tokenize_line
+
+# Expression previously used by ScriptGenerator.process_line, kept here for comparison only
+LEGACY_WHOLE_STRING_ID = re.compile(
+    r"^(?P<user1>[\w.-]+)(?P<domain1>@[\w.-]+)[ |,|\||\t]+(?P<pword1>.*?)([ |,|\||\t]+(?P<user2>[\w.-]+?)(?P<domain2>@[\w.-]+)[ |,|\||\t]+(?P<pword2>.+))?$"
+)
+
+# Each case builds a line from a repetition count, the first ones made the legacy
+# expression backtrack quadratically, the rest target the tokenizer's own loops
+ADVERSARIAL_LINES: Dict[str, Callable[[int], str]] = {
+    "accounts_newline": lambda n: "user@example.com pass" + " u@d.com x" * n + "\nz",
+    "delimiters_newline": lambda n: "user@example.com pass" + " ," * n + "x\n!",
+    "spaces_newline": lambda n: "user@example.com pass" + " " * n + "\nz",
+    "accounts_no_separator": lambda n: "user@example.com pass" + " u@d.com!" * n,
+    "at_signs": lambda n: "user@example.com pass " + "a@" * n,
+    "delimiter_only": lambda n: "user@example.com" + " |,\t" * n,
+}
+
+
+def time_call(func: Callable[[str], object], line: str, repeat: int) -> float:
+    """
+    Returns the best time in seconds out of <repeat> calls
+    """
+    best: Optional[float] = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None or elapsed < best else best
+    return best if best is not None else 0.0
+
+
+def run(
+    sizes: List[int], legacy: bool, repeat: int
+) -> Dict[str, Dict[int, Dict[str, float]]]:
+    results: Dict[str, Dict[int, Dict[str, float]]] = {}
+    for name, build in ADVERSARIAL_LINES.items():
+        results[name] = {}
+        for size in sizes:
+            line = build(size)
+            timings = {
+                "length": float(len(line)),
+                "tokenizer": time_call(tokenize_line, line, repeat),
+            }
+            if legacy:
+                timings["legacy"] = time_call(LEGACY_WHOLE_STRING_ID.match, line, 1)
+            results[name][size] = timings
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the credential tokenizer on adversarial lines",
+        prog="benchmarks.tokenizer",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 2000, 4000, 8000],
+        help="Repetition counts used to build each adversarial line",
+    )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        default=False,
+        help="Also times the old WHOLE_STRING_ID expression (slow on big sizes)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Keeps the best out of N runs"
+    )
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.legacy, args.repeat)
+    print(
+        f"{'case':<24}{'size':>8}{'chars':>10}{'tokenizer (us)':>16}{'legacy (us)':>14}"
+    )
+    for name, by_size in results.items():
+        for size, timings in by_size.items():
+            legacy_us = (
+                f"{timings['legacy'] * 1e6:>14.1f}"
+                if "legacy" in timings
+                else f"{'-':>14}"
+            )
+            print(
+                f"{name:<24}{size:>8}{int(timings['length']):>10}"
+                f"{timings['tokenizer'] * 1e6:>16.1f}{legacy_us}"
+            )
+        # Per character cost should stay flat when the line grows
+        smallest, largest = by_size[min(by_size)], by_size[max(by_size)]
+        growth = (largest["tokenizer"] / largest["length"]) / max(
+            smallest["tokenizer"] / smallest["length"], 1e-12
+        )
+        print(f"{'':<24}per char cost growth x{growth:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import logging
+import sqlite3
+from typing import Optional, Set, Tuple
+
+logger = logging.getLogger("pymap_core")
+
+NEW = "new"
+DUPLICATE = "duplicate"
+
+
+class PairDeduplicator:
+    """
+    Remembers (user1, user2) account pairs to drop repeated ones
+
+    Pairs are kept in a set until <exact_limit> is reached, after that they are moved
+    to a temporary on-disk SQLite table so memory stays bounded on very large inputs,
+    both answers are exact
+    """
+
+    EXACT_LIMIT: int = 100_000
+
+    def __init__(self, exact_limit: Optional[int] = None) -> None:
+        self.exact_limit: int = exact_limit if exact_limit else self.EXACT_LIMIT
+        self.exact: Set[str] = set()
+        self.store: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def key(user1: str, user2: str) -> str:
+        # NUL can't be part of a parsed account so the key is unambiguous
+        return f"{user1}\0{user2}"
+
+    def check(self, user1: str, user2: str) -> str:
+        """
+        Returns DUPLICATE if the pair was already added, otherwise adds it and returns NEW
+        """
+        key = self.key(user1, user2)
+        store = self.store
+        if store is None:
+            if key in self.exact:
+                return DUPLICATE
+            self.exact.add(key)
+            if len(self.exact) >= self.exact_limit:
+                self._switch_to_store()
+            return NEW
+        cursor = store.execute("INSERT OR IGNORE INTO pairs (key) VALUES (?)", (key,))
+        return NEW if cursor.rowcount else DUPLICATE
+
+    def _switch_to_store(self) -> None:
+        logger.info(
+            "More than %s account pairs, moving them to a temporary table",
+            self.exact_limit,
+        )
+        # An empty filename is a private on-disk database deleted with the connection,
+        # the generators can be resumed from another thread (sync_to_async)
+        self.store = sqlite3.connect("", check_same_thread=False)
+        self.store.execute("CREATE TABLE pairs (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self.store.executemany(
+            "INSERT INTO pairs (key) VALUES (?)", ((key,) for key in self.exact)
+        )
+        self.exact = set()
+
+    def __reduce__(self) -> Tuple[type, Tuple[int]]:
+        # Copies sent to the parsing processes (core.parallel) never check pairs,
+        # deduplication runs in the parent, so the remembered pairs are left behind
+        return (PairDeduplicator, (self.exact_limit,))
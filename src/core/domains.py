@@ -0,0 +1,55 @@
+from typing import Dict, Iterator, List
+
+
+class DomainRegistry:
+    """
+    Insertion ordered set of domains that also keeps how many accounts were seen
+    for each one, adding a domain is O(1) unlike rebuilding a list from a set
+    """
+
+    def __init__(self) -> None:
+        # Dictionaries keep insertion order, so they work as an ordered set
+        self._counts: Dict[str, int] = {}
+
+    def add(self, domain: str, count: int = 1) -> None:
+        """
+        Registers <count> accounts for a domain
+        """
+        self._counts[domain] = self._counts.get(domain, 0) + count
+
+    def merge(self, other: "DomainRegistry") -> None:
+        """
+        Adds every domain and count from another registry, domains that are new to
+        this registry are kept in the order they were seen in the other one
+        """
+        for domain, count in other._counts.items():
+            self.add(domain, count)
+
+    def count(self, domain: str) -> int:
+        return self._counts.get(domain, 0)
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns a copy of the accounts per domain
+        """
+        return dict(self._counts)
+
+    def to_list(self) -> List[str]:
+        return list(self._counts)
+
+    def summary(self) -> str:
+        """
+        Human readable representation, ex: "example.com (12), example.org (3)"
+        """
+        return ", ".join(
+            f"{domain} ({count})" for domain, count in self._counts.items()
+        )
+
+    def __contains__(self, domain: object) -> bool:
+        return domain in self._counts
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._counts)
+
+    def __len__(self) -> int:
+        return len(self._counts)
@@ -0,0 +1,115 @@
+import re
+import logging
+from functools import lru_cache
+from typing import Any, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger("pymap_core")
+
+# ((pattern, append_str), ...) tuples so they can be used as cache keys
+HostPatterns = Tuple[Tuple[str, str], ...]
+
+# Patterns that can't be wrapped in a bigger alternation without changing their meaning,
+# numbered/named backreferences and conditional group references like (?(1)...) or
+# (?(name)...) would point to the wrong groups once combined
+BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def freeze_host_patterns(patterns: Any) -> HostPatterns:
+    """
+    Converts the lists loaded from json (config["HOSTS"] or UserPreferences.host_patterns)
+    to tuples, entries that aren't a pair of strings are discarded
+    """
+    frozen: List[Tuple[str, str]] = []
+    if not isinstance(patterns, (list, tuple)):
+        return ()
+    for entry in patterns:
+        if (
+            isinstance(entry, (list, tuple))
+            and len(entry) == 2
+            and isinstance(entry[0], str)
+            and isinstance(entry[1], str)
+        ):
+            frozen.append((entry[0], entry[1]))
+        else:
+            logger.warning("Ignoring malformed host pattern: %s", entry)
+    return tuple(frozen)
+
+
+def validate_host_patterns(patterns: Any) -> None:
+    """
+    Raises ValueError describing the first entry that is not a pair of strings
+    or has a pattern that fails to compile
+    """
+    if not isinstance(patterns, list):
+        raise ValueError("Host patterns must be a list of [pattern, append_str] pairs")
+    for entry in patterns:
+        if (
+            not isinstance(entry, list)
+            or len(entry) != 2
+            or not all(isinstance(value, str) for value in entry)
+        ):
+            raise ValueError(f"Expected a pair of strings, got: {entry}")
+        try:
+            re.compile(entry[0])
+        except re.error as e:
+            raise ValueError(f"Invalid pattern {entry[0]}: {e}")
+
+
+class HostMatcher:
+    """
+    Resolves a hostname against a list of (pattern, append_str) pairs, the first
+    pattern that matches (re.match semantics) decides the string to append
+
+    Patterns are compiled once into a single alternation with a named group per pattern
+    so resolving takes one scan, if they can't be safely combined each one is tried in order
+    """
+
+    def __init__(self, patterns: HostPatterns) -> None:
+        self.patterns: List[Tuple[Pattern[str], str]] = []
+        for pattern, append_str in patterns:
+            try:
+                self.patterns.append((re.compile(pattern), append_str))
+            except re.error as e:
+                logger.warning("Ignoring invalid host pattern %s: %s", pattern, e)
+        self.combined: Optional[Pattern[str]] = self._combine()
+
+    def _combine(self) -> Optional[Pattern[str]]:
+        if not self.patterns:
+            return None
+        for compiled, _ in self.patterns:
+            # Inline global flags like (?i) would apply to every alternative
+            if compiled.flags & ~re.UNICODE or BACKREFERENCE.search(compiled.pattern):
+                return None
+        alternatives = "|".join(
+            f"(?P<_host{index}>{compiled.pattern})"
+            for index, (compiled, _) in enumerate(self.patterns)
+        )
+        try:
+            return re.compile(alternatives)
+        except re.error:
+            # Name collisions with the patterns own groups
+            return None
+
+    def match(self, hostname: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns the (pattern, append_str) that matched or None
+        """
+        if self.combined is not None:
+            has_match = self.combined.match(hostname)
+            if has_match and has_match.lastgroup:
+                # The wrapping group is always the last one closed in a match
+                compiled, append_str = self.patterns[int(has_match.lastgroup[5:])]
+                return compiled.pattern, append_str
+            return None
+        for compiled, append_str in self.patterns:
+            if compiled.match(hostname):
+                return compiled.pattern, append_str
+        return None
+
+
+@lru_cache(maxsize=128)
+def get_host_matcher(patterns: HostPatterns) -> HostMatcher:
+    """
+    Compiled matchers are shared between ScriptGenerator instances, keyed by the pattern list
+    """
+    return HostMatcher(patterns)
@@ -0,0 +1,80 @@
+import shlex
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# What gets sent to celery, the json serializer would turn a NamedTuple into a plain list
+JobDict = Dict[str, Any]
+
+# Options ScriptGenerator.build_job emits before --logdir= that take the next element as value
+VALUE_OPTIONS = frozenset(
+    ("--host1", "--user1", "--password1", "--host2", "--user2", "--password2")
+)
+
+
+class Job(NamedTuple):
+    """
+    A single imapsync run, the argv is executed as is (no shell involved)
+    """
+
+    argv: List[str]
+    logfile: str
+    user1: str
+    user2: str
+    # Size hint of the source mailbox in bytes, used to run the largest ones first
+    size: Optional[int] = None
+
+    @property
+    def accounts(self) -> str:
+        return f"{self.user1}--{self.user2}"
+
+    def with_logdir(self, logdir: str) -> "Job":
+        """
+        Returns a copy of the job writing its log to <logdir>
+
+        Only the --logdir= option is rewritten, values of the options before it
+        (a password can start with the same text) are left untouched
+        """
+        argv = list(self.argv)
+        index = 1
+        while index < len(argv):
+            if argv[index] in VALUE_OPTIONS:
+                index += 2
+                continue
+            if argv[index].startswith("--logdir="):
+                argv[index] = f"--logdir={logdir}"
+                break
+            index += 1
+        return self._replace(argv=argv)
+
+    def to_shell(self) -> str:
+        """
+        Properly quoted command line, only meant for displaying or writing scripts
+        """
+        return shlex.join(self.argv)
+
+    def to_dict(self) -> JobDict:
+        data: JobDict = {
+            "argv": list(self.argv),
+            "logfile": self.logfile,
+            "user1": self.user1,
+            "user2": self.user2,
+        }
+        if self.size is not None:
+            data["size"] = self.size
+        return data
+
+    @classmethod
+    def from_dict(cls, data: JobDict) -> "Job":
+        """
+        Raises KeyError/TypeError on malformed data
+        """
+        argv = data["argv"]
+        if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+            raise TypeError(f"Expected argv to be a list of strings, got {argv}")
+        size = data.get("size")
+        return cls(
+            argv,
+            str(data["logfile"]),
+            str(data["user1"]),
+            str(data["user2"]),
+            int(size) if size is not None else None,
+        )
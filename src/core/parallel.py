@@ -0,0 +1,90 @@
+import io
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import TYPE_CHECKING, List, Tuple
+
+from core.sharding import make_shard_writer
+
+if TYPE_CHECKING:
+    from core.pymap_core import ParsedLine, ScriptGenerator
+
+logger = logging.getLogger("pymap_core")
+
+# Ranges smaller than this are not worth the cost of shipping them to another process
+MIN_RANGE_SIZE = 1024 * 1024
+# More ranges than workers so a slow range doesn't leave the other workers idle
+RANGES_PER_WORKER = 4
+
+
+def split_ranges(fpath: str, parts: int) -> List[Tuple[int, int]]:
+    """
+    Splits a file into at most <parts> (start, end) byte ranges,
+    every range starts at the beginning of a line and ends after a newline or at EOF
+    """
+    size = os.path.getsize(fpath)
+    boundaries = [0]
+    with open(fpath, "rb") as fh:
+        for index in range(1, parts):
+            offset = size * index // parts
+            if offset <= boundaries[-1]:
+                continue
+            fh.seek(offset - 1)
+            # Moves to the start of the next line unless offset already is one
+            fh.readline()
+            position = fh.tell()
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def process_range(
+    generator: "ScriptGenerator", fpath: str, start: int, end: int
+) -> List["ParsedLine"]:
+    """
+    Runs in a worker process, parses the lines in [start, end) and returns
+    the domain, accounts and size hint of each one
+    """
+    with open(fpath, "rb") as fh:
+        fh.seek(start)
+        data = fh.read(end - start)
+    # Same decoding and newline translation as open(fpath, "r") in the serial path
+    stream = io.TextIOWrapper(io.BytesIO(data))
+    return list(generator.input_generator(stream))
+
+
+def process_file_parallel(generator: "ScriptGenerator", fpath: str) -> None:
+    """
+    Parses a file in byte ranges across <generator.workers> processes, output files
+    are written in the input order and are identical to the ones from the serial path
+
+    Deduplication and domain counting need to see every line so they run here,
+    in the parent process, as the results arrive
+    """
+    size = os.path.getsize(fpath)
+    parts = max(1, min(generator.workers * RANGES_PER_WORKER, size // MIN_RANGE_SIZE))
+    ranges = split_ranges(fpath, parts)
+    logger.debug(
+        "Processing %s in %s ranges with %s workers",
+        fpath,
+        len(ranges),
+        generator.workers,
+    )
+    with ProcessPoolExecutor(max_workers=generator.workers) as pool, make_shard_writer(
+        generator
+    ) as shards:
+        # map yields in submission order, so shards are written in the input order
+        for parsed in pool.map(
+            process_range,
+            repeat(generator),
+            repeat(fpath),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+        ):
+            for domain, accounts, size in parsed:
+                if generator.accept(domain, accounts):
+                    shards.add(accounts, generator.render_line(accounts), size)
@@ -1,22 +1,49 @@
+import asyncio
 import re
 import os
-from typing import Any, Generator, Iterable, List, Optional
+import shlex
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Dict,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 import logging
 
+from core.dedup import DUPLICATE, PairDeduplicator
+from core.domains import DomainRegistry
+from core.hosts import freeze_host_patterns, get_host_matcher
+from core.jobs import Job
+from core.parallel import process_file_parallel
+from core.sharding import SHARD_STRATEGIES, make_shard_writer
+from core.tokenizer import split_size_hint, tokenize_line
+
 logger = logging.getLogger("pymap_core")
 
+# (user1, password1, user2, password2)
+Accounts = Tuple[str, str, str, str]
+# (domain, accounts, size hint in bytes)
+ParsedLine = Tuple[Optional[str], Accounts, Optional[int]]
+
 
 class ScriptGenerator:
     # STATIC CONSTANTS
     DOMAIN_IDENTIFIER = re.compile(r"^.+@(?P<domain>[\w-]+\.[\w]+) +")
     USER_IDENTIFIER = re.compile(r"^[\w.]+(?P<mail_provider>@[\w.]+)*")
     PASS_IDENTIFIER = re.compile(r".*[\s|,|.]+(?P<pword>.+)$")
-    # Finding a delimiter for the password can be difficult since passwords
-    # can be made up of almost any character
-    WHOLE_STRING_ID = re.compile(
-        r"^(?P<user1>[\w.-]+)(?P<domain1>@[\w.-]+)[ |,|\||\t]+(?P<pword1>.*?)([ |,|\||\t]+(?P<user2>[\w.-]+?)(?P<domain2>@[\w.-]+)[ |,|\||\t]+(?P<pword2>.+))?$"
-    )
     IP_ADDR_RE = re.compile(r"[0-9]{1,3}.[0-9]{1,3}.[0-9]{1,3}.[0-9]{1,3}")
+    # Only a sample of the dropped pairs is kept for reporting
+    MAX_REPORTED_DUPLICATES = 50
+    # Default number of jobs per batch yielded by abatches
+    JOB_BATCH_SIZE = 200
+    # Lines parsed from a synchronous input before yielding to the event loop
+    LINES_PER_YIELD = 1000
 
     def __init__(
         self,
@@ -30,11 +57,29 @@ class ScriptGenerator:
         self.host1 = self.verify_host(host1)
         self.host2 = self.verify_host(host2)
         self.extra_args: Optional[str] = extra_args
+        # Split once here so jobs don't need to be tokenized again before running
+        self.extra_argv: List[str] = shlex.split(extra_args) if extra_args else []
         self.dest: str = kwargs.get("destination", "sync")
         self.line_count: int = kwargs.get("split", 30)
         self.dry_run: bool = kwargs.get("dry_run", False)
+        self.workers: int = kwargs.get("workers", 1) or 1
+        # How process_file distributes the scripts between files, see core.sharding
+        self.shard_by: str = kwargs.get("shard_by", "lines") or "lines"
+        if self.shard_by not in SHARD_STRATEGIES:
+            raise ValueError(
+                f"Unknown shard strategy {self.shard_by}, expected one of {SHARD_STRATEGIES}"
+            )
+        self.shards: int = kwargs.get("shards", 4) or 4
+        # Lines end with a size column, used by the size strategy
+        self.size_hint: bool = kwargs.get("size_hint", False)
         self.file_count: int = 0
-        self.domains: List[str] = []
+        self.domain_registry: DomainRegistry = DomainRegistry()
+        # Optional, drops repeated (user1, user2) pairs
+        self.deduplicator: Optional[PairDeduplicator] = (
+            PairDeduplicator() if kwargs.get("deduplicate", False) else None
+        )
+        self.duplicate_count: int = 0
+        self.duplicates: List[str] = []
         # STATIC VARIABLES
         _logdir: Optional[str] = kwargs.get("pymap_logdir", None)
         self.LOGDIR: str = (
@@ -46,6 +91,20 @@ class ScriptGenerator:
             + " --logfile={} --addheader"
         )
 
+    @property
+    def domains(self) -> List[str]:
+        """
+        Domains found in the processed input, in the order they were first seen
+        """
+        return self.domain_registry.to_list()
+
+    @property
+    def domain_counts(self) -> Dict[str, int]:
+        """
+        Number of processed accounts for each domain
+        """
+        return self.domain_registry.counts()
+
     def match_domain(self, domain: str) -> Optional[str]:
         """
         Uses the regex DOMAIN_IDENTIFIER and tries to match it to the string
@@ -67,31 +126,23 @@ class ScriptGenerator:
             if len(part) > 4:
                 # Check for domains
                 domain = self.match_domain(part)
-                self.domains = (
-                    list(set(self.domains + [domain])) if domain else self.domains
-                )
+                if domain:
+                    self.domain_registry.add(domain)
 
     def verify_host(self, hostname: str) -> str:
+        """
+        Appends the string configured for the first matching host pattern,
+        user patterns (additional_known_hosts) take precedence over config.HOSTS
+        """
         logger.debug("Verifying hostname: %s", hostname)
-        if self.additional_known_hosts:
-            for pattern, append_str in self.additional_known_hosts:
-                try:
-                    has_match = re.match(pattern, hostname)
-                    if has_match:
-                        logger.debug(
-                            "Matched hostname from additional_known_hosts: %s", hostname
-                        )
-                        return f"{hostname}{append_str}"
-                except:
-                    continue
-        hosts = self.config.get("HOSTS", [])
-        if isinstance(hosts, list):
-            if len(hosts) >= 1:
-                for pattern, append_str in hosts:
-                    has_match = re.match(pattern, hostname)
-                    if has_match:
-                        logger.debug("Matched hostname from config.HOSTS: %s", hostname)
-                        return f"{hostname}{append_str}"
+        patterns = freeze_host_patterns(
+            self.additional_known_hosts or []
+        ) + freeze_host_patterns(self.config.get("HOSTS", []))
+        has_match = get_host_matcher(patterns).match(hostname)
+        if has_match:
+            pattern, append_str = has_match
+            logger.debug("Matched hostname %s with pattern %s", hostname, pattern)
+            return f"{hostname}{append_str}"
 
         logger.debug("No matches: %s", hostname)
         return hostname
@@ -99,19 +150,20 @@ class ScriptGenerator:
     def process_file(self, fpath: str) -> None:
         """
         Reads a file line by line, creates the script for each line and then outputs to a file,
-        creating a new file each time the counter is reached
+        creating a new file each time the counter is reached, or distributing the scripts
+        between files according to <self.shard_by> (core.sharding)
+
+        With more than one worker the file is parsed in parallel by core.parallel
         """
         if fpath != "" and os.path.isfile(fpath):
             try:
-                lines = []
-                with open(fpath, "r") as fh:
-                    for line in self.line_generator(fh):
-                        lines.append(line)
-                        if len(lines) >= self.line_count:
-                            self.write_output(lines)
-                            lines.clear()
-                    if len(lines) >= 1:
-                        self.write_output(lines)
+                if self.workers > 1:
+                    process_file_parallel(self, fpath)
+                    return
+                with open(fpath, "r") as fh, make_shard_writer(self) as shards:
+                    for domain, accounts, size in self.input_generator(fh):
+                        if self.accept(domain, accounts):
+                            shards.add(accounts, self.render_line(accounts), size)
             except Exception as e:
                 logger.critical("Unhandled exception: %s", e.__str__(), exc_info=True)
                 raise
@@ -127,69 +179,208 @@ class ScriptGenerator:
         scripts = [x for x in self.line_generator(strings) if len(x) > 0]
         return scripts
 
+    def process_jobs(self, strings: Iterable[str]) -> List[Job]:
+        """
+        Same as process_strings but returns structured jobs instead of shell strings
+        """
+        return list(self.job_generator(strings))
+
+    def input_generator(
+        self, uinput: Iterable[str]
+    ) -> Generator[ParsedLine, None, None]:
+        """
+        Filters out empty lines and yields the domain, accounts and size hint (None unless
+        <self.size_hint>) of every parsed line, nothing is registered here
+        so it can run on a copy of the generator (core.parallel)
+
+        Entrypoint for the data, line_generator and job_generator should always call this
+        """
+        for line in uinput:
+            parsed = self.parse_input_line(line)
+            if parsed:
+                yield parsed
+
+    def parse_input_line(self, line: str) -> Optional[ParsedLine]:
+        """
+        Parses a single line of input for input_generator and ajob_generator
+        """
+        if not line or len(line) <= 1:
+            return None
+        size: Optional[int] = None
+        if self.size_hint:
+            line, size = split_size_hint(line)
+        accounts = self.parse_line(line)
+        if accounts:
+            return self.match_domain(line), accounts, size
+        return None
+
+    def accept(self, domain: Optional[str], accounts: Accounts) -> bool:
+        """
+        Drops repeated account pairs when deduplication is enabled and
+        registers the domain of the accepted ones
+        """
+        if self.deduplicator is not None:
+            pair = f"{accounts[0]}--{accounts[2]}"
+            status = self.deduplicator.check(accounts[0], accounts[2])
+            if status == DUPLICATE:
+                logger.debug("Dropping duplicate pair %s", pair)
+                self.duplicate_count += 1
+                if len(self.duplicates) < self.MAX_REPORTED_DUPLICATES:
+                    self.duplicates.append(pair)
+                return False
+        # Check for domains
+        if domain:
+            self.domain_registry.add(domain)
+        return True
+
     # processes input -> yields str
     def line_generator(self, uinput: Iterable[str]) -> Generator[str, None, None]:
         """
-        Just a generator wrapper for the process_line function,
-        also appends <self.extra_args> if they exist
+        Just a generator wrapper for the render_line function
 
-        Entrypoint for the data, other functions like process_strings and process_file should always call this
+        Used by process_strings and process_file which output shell scripts
         """
-        new_line = ""
-        for line in uinput:
-            if line and len(line) > 1:
-                # Check for domains
-                domain = self.match_domain(line)
-                self.domains = (
-                    list(set(self.domains + [domain])) if domain else self.domains
-                )
-                # Process line
-                new_line = self.process_line(line)
-                if new_line:
-                    # if extra arguments append at end
-                    if self.extra_args:
-                        new_line = f"{new_line} {self.extra_args}"
-                    yield new_line
+        for domain, accounts, _ in self.input_generator(uinput):
+            if self.accept(domain, accounts):
+                yield self.render_line(accounts)
+
+    # processes input -> yields Job
+    def job_generator(self, uinput: Iterable[str]) -> Generator[Job, None, None]:
+        """
+        Generator wrapper for the build_job function, the extra arguments are
+        already part of each job's argv
+        """
+        for domain, accounts, size in self.input_generator(uinput):
+            if self.accept(domain, accounts):
+                yield self.build_job(accounts, size)
+
+    async def ajob_generator(
+        self, uinput: Union[Iterable[str], AsyncIterable[str]]
+    ) -> AsyncGenerator[Job, None]:
+        """
+        async for version of job_generator, lines can come from a synchronous or
+        an asynchronous iterable so jobs are available while the input is still being read
+        """
+        if isinstance(uinput, AsyncIterable):
+            async for line in uinput:
+                parsed = self.parse_input_line(line)
+                if parsed and self.accept(parsed[0], parsed[1]):
+                    yield self.build_job(parsed[1], parsed[2])
+            return
+        for index, line in enumerate(uinput, 1):
+            parsed = self.parse_input_line(line)
+            if parsed and self.accept(parsed[0], parsed[1]):
+                yield self.build_job(parsed[1], parsed[2])
+            # Parsing is CPU bound, let other tasks run on long inputs
+            if index % self.LINES_PER_YIELD == 0:
+                await asyncio.sleep(0)
+
+    async def abatches(
+        self,
+        uinput: Union[Iterable[str], AsyncIterable[str]],
+        size: Optional[int] = None,
+    ) -> AsyncGenerator[List[Job], None]:
+        """
+        Groups the jobs of ajob_generator in lists of at most <size> (JOB_BATCH_SIZE) jobs
+        """
+        batch_size = size if size else self.JOB_BATCH_SIZE
+        batch: List[Job] = []
+        async for job in self.ajob_generator(uinput):
+            batch.append(job)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def process_line(self, line: str) -> Optional[str]:
         """
         Processes individual Lines returns None or a formatted string
         """
-        has_match = re.match(self.WHOLE_STRING_ID, line)
-        # FIXME: Regex has catastrophic backtracing, should not be used for now...
-        # TODO: Maybe replace regex for the splitting logic
-        if has_match:
-            user1 = has_match.group("user1")
-            user2 = has_match.group("user2")
-            domain1 = has_match.group("domain1")
-            domain2 = has_match.group("domain2")
-            # Add domains to internal list
-            username1: str = f"{user1}{domain1}" if user1 and domain1 else ""
-            username2: str = f"{user2}{domain2}" if user2 and domain2 else ""
-            if len(username1) > 0 and len(username2) > 0:
-                return self.FORMAT_STRING.format(
-                    self.host1,
+        accounts = self.parse_line(line)
+        if accounts:
+            return self.format_line(accounts)
+        return None
+
+    def process_job(self, line: str) -> Optional[Job]:
+        """
+        Processes individual Lines returns None or a Job with the imapsync arguments
+        """
+        accounts = self.parse_line(line)
+        if accounts:
+            return self.build_job(accounts)
+        return None
+
+    def format_line(self, accounts: Accounts) -> str:
+        user1, pword1, user2, pword2 = accounts
+        return self.FORMAT_STRING.format(
+            self.host1,
+            user1,
+            pword1,
+            self.host2,
+            user2,
+            pword2,
+            self.logfile_name(user1, user2),
+        )
+
+    def render_line(self, accounts: Accounts) -> str:
+        """
+        format_line plus <self.extra_args> if they exist
+        """
+        new_line = self.format_line(accounts)
+        # if extra arguments append at end
+        if self.extra_args:
+            new_line = f"{new_line} {self.extra_args}"
+        return new_line
+
+    def build_job(self, accounts: Accounts, size: Optional[int] = None) -> Job:
+        user1, pword1, user2, pword2 = accounts
+        logfile = self.logfile_name(user1, user2)
+        argv = [
+            "imapsync",
+            "--host1",
+            self.host1,
+            "--user1",
+            user1,
+            "--password1",
+            pword1,
+            "--host2",
+            self.host2,
+            "--user2",
+            user2,
+            "--password2",
+            pword2,
+            "--log",
+            f"--logdir={self.LOGDIR}",
+            f"--logfile={logfile}",
+            "--addheader",
+        ] + self.extra_argv
+        return Job(argv, logfile, user1, user2, size)
+
+    def logfile_name(self, user1: str, user2: str) -> str:
+        return f"{self.host1}__{self.host2}__{user1}--{user2}.log"
+
+    def parse_line(self, line: str) -> Optional[Accounts]:
+        """
+        Extracts (user1, password1, user2, password2) from a line, when the line only
+        has one account it is used for both sides, returns None if nothing was found
+        """
+        # Finding a delimiter for the password can be difficult since passwords
+        # can be made up of almost any character, the tokenizer handles this in linear time
+        credentials = tokenize_line(line)
+        if credentials:
+            username1: str = f"{credentials.user1}{credentials.domain1}"
+            if credentials.user2 and credentials.domain2:
+                username2 = f"{credentials.user2}{credentials.domain2}"
+                return (
                     username1,
-                    has_match.group("pword1"),
-                    self.host2,
+                    credentials.pword1,
                     username2,
-                    has_match.group("pword2"),
-                    f"{self.host1}__{self.host2}__{username1}--{username2}.log",
-                )
-            elif len(username1) > 0:
-                return self.FORMAT_STRING.format(
-                    self.host1,
-                    username1,
-                    has_match.group("pword1"),
-                    self.host2,
-                    username1,
-                    has_match.group("pword1"),
-                    f"{self.host1}__{self.host2}__{username1}--{username1}.log",
+                    credentials.pword2 or "",
                 )
-            else:
-                logger.warning("User missing domain or provider")
+            return username1, credentials.pword1, username1, credentials.pword1
         else:
-            logger.warning("Line did not match regex %s....", line[0:5])
+            logger.warning("Line did not match tokenizer %s....", line[0:5])
             try:
                 new_line = re.sub(r"\t+", " ", line)
                 new_line = re.sub(r"\s+", " ", new_line)
@@ -203,15 +394,7 @@ class ScriptGenerator:
                         user2 = new_line_split[2]
                         pword2 = new_line_split[3]
                     logger.info("Line %s Matched trough fallback", line[0:5])
-                    return self.FORMAT_STRING.format(
-                        self.host1,
-                        user1,
-                        pword1,
-                        self.host2,
-                        user2,
-                        pword2,
-                        f"{self.host1}__{self.host2}__{user1}--{user2}.log",
-                    )
+                    return user1, pword1, user2, pword2
             except Exception as e:
                 logger.error("Line did not match split %s", line[0:5])
                 logger.error("Error: %s", e)
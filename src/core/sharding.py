@@ -0,0 +1,174 @@
+import abc
+import heapq
+import logging
+import re
+from types import TracebackType
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, TextIO, Tuple, Type
+
+if TYPE_CHECKING:
+    from core.pymap_core import Accounts, ScriptGenerator
+
+logger = logging.getLogger("pymap_core")
+
+SHARD_STRATEGIES = ["lines", "source", "destination", "size"]
+# Anything else in a domain is replaced so it can't escape the output directory
+UNSAFE_FILENAME = re.compile(r"[^\w.-]")
+
+
+class ShardWriter(abc.ABC):
+    """
+    Distributes the rendered lines of a run between output files (shards)
+
+    The base class keeps one open, buffered handle per shard so lines can be spread
+    over many files without reopening them, subclasses decide the shard of every line
+    """
+
+    BUFFER_SIZE: int = 1024 * 1024
+    # Bounds the open file descriptors, the oldest handle is closed past this
+    MAX_OPEN_HANDLES: int = 256
+
+    def __init__(self, generator: "ScriptGenerator") -> None:
+        self.generator = generator
+        self.handles: Dict[str, TextIO] = {}
+        self.created: List[str] = []
+        self._created: Set[str] = set()
+
+    def path(self, shard: str) -> str:
+        return f"{self.generator.dest}_{shard}.sh"
+
+    def write(self, shard: str, line: str) -> None:
+        handle = self.handles.get(shard)
+        if handle is None:
+            handle = self.open(shard)
+        handle.write(line + "\n")
+
+    def open(self, shard: str) -> TextIO:
+        if len(self.handles) >= self.MAX_OPEN_HANDLES:
+            oldest = next(iter(self.handles))
+            self.handles.pop(oldest).close()
+        path = self.path(shard)
+        # Shards closed to free a descriptor are appended to when they show up again
+        mode = "a" if path in self._created else "w"
+        if mode == "w":
+            logger.debug("Creating shard %s", path)
+            self.created.append(path)
+            self._created.add(path)
+            self.generator.file_count += 1
+        handle = open(path, mode, buffering=self.BUFFER_SIZE)
+        self.handles[shard] = handle
+        return handle
+
+    @abc.abstractmethod
+    def add(self, accounts: "Accounts", line: str, size: Optional[int]) -> None:
+        """
+        Routes a rendered line to its shard
+        """
+
+    def close(self) -> None:
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.close()
+
+
+class LineShardWriter(ShardWriter):
+    """
+    Default, a new file every <generator.line_count> lines through generator.write_output
+    """
+
+    def __init__(self, generator: "ScriptGenerator") -> None:
+        super().__init__(generator)
+        self.lines: List[str] = []
+
+    def add(self, accounts: "Accounts", line: str, size: Optional[int]) -> None:
+        self.lines.append(line)
+        if len(self.lines) >= self.generator.line_count:
+            self.generator.write_output(self.lines)
+            self.lines.clear()
+
+    def close(self) -> None:
+        if len(self.lines) >= 1:
+            self.generator.write_output(self.lines)
+            self.lines.clear()
+        super().close()
+
+
+class DomainShardWriter(ShardWriter):
+    """
+    One file per domain of the source (user1) or destination (user2) account
+    """
+
+    def __init__(self, generator: "ScriptGenerator", destination: bool) -> None:
+        super().__init__(generator)
+        # Position of the account in the Accounts tuple
+        self.side = 2 if destination else 0
+
+    @staticmethod
+    def domain_of(account: str) -> str:
+        _, at, domain = account.rpartition("@")
+        if not at or not domain:
+            return "unknown"
+        return UNSAFE_FILENAME.sub("_", domain.lower())
+
+    def add(self, accounts: "Accounts", line: str, size: Optional[int]) -> None:
+        self.write(self.domain_of(accounts[self.side]), line)
+
+
+class SizeShardWriter(ShardWriter):
+    """
+    Balances the size hints between <generator.shards> files
+
+    Every line is kept until close, then they are assigned largest first to the shard
+    with the least work so far (LPT), lines without a hint count as the average size,
+    inside each shard the largest jobs come first
+    """
+
+    def __init__(self, generator: "ScriptGenerator") -> None:
+        super().__init__(generator)
+        self.entries: List[Tuple[Optional[int], str]] = []
+
+    def add(self, accounts: "Accounts", line: str, size: Optional[int]) -> None:
+        self.entries.append((size, line))
+
+    def close(self) -> None:
+        known = [size for size, _ in self.entries if size is not None]
+        default = sum(known) // len(known) if known else 1
+        # Stable sort, equal sizes keep the input order
+        ordered = sorted(
+            self.entries,
+            key=lambda entry: entry[0] if entry[0] is not None else default,
+            reverse=True,
+        )
+        shards = max(1, self.generator.shards)
+        loads: List[Tuple[int, int]] = [(0, index) for index in range(shards)]
+        totals = [0] * shards
+        for size, line in ordered:
+            load, index = heapq.heappop(loads)
+            weight = size if size is not None else default
+            self.write(str(index), line)
+            totals[index] = load + weight
+            heapq.heappush(loads, (totals[index], index))
+        self.entries.clear()
+        logger.debug("Estimated work per shard: %s", totals)
+        super().close()
+
+
+def make_shard_writer(generator: "ScriptGenerator") -> ShardWriter:
+    strategy = generator.shard_by
+    if strategy == "source":
+        return DomainShardWriter(generator, destination=False)
+    if strategy == "destination":
+        return DomainShardWriter(generator, destination=True)
+    if strategy == "size":
+        return SizeShardWriter(generator)
+    return LineShardWriter(generator)
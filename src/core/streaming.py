@@ -0,0 +1,17 @@
+from typing import Generator
+
+
+def iter_lines(text: str) -> Generator[str, None, None]:
+    """
+    Yields the lines of <text> one at a time without building a list of all of them,
+    "\\r\\n" line endings (as sent by browsers in a textarea) are handled like "\\n"
+    """
+    start = 0
+    length = len(text)
+    while start < length:
+        end = text.find("\n", start)
+        if end < 0:
+            end = length
+        line = text[start:end]
+        yield line[:-1] if line.endswith("\r") else line
+        start = end + 1
@@ -0,0 +1,111 @@
+import re
+from typing import NamedTuple, Optional, Tuple
+
+
+class Credentials(NamedTuple):
+    """
+    Accounts and passwords extracted from a single input line,
+    user2/domain2/pword2 are None when the line only contains one account
+    """
+
+    user1: str
+    domain1: str
+    pword1: str
+    user2: Optional[str] = None
+    domain2: Optional[str] = None
+    pword2: Optional[str] = None
+
+
+# Same delimiters accepted by the old WHOLE_STRING_ID expression (space, comma, pipe, tab)
+DELIMITERS = " ,|\t"
+DELIMITER_RUN = re.compile(r"[ ,|\t]+")
+# [\w.-] can never match "@" or a delimiter so these can't backtrack over each other
+ACCOUNT = re.compile(r"(?P<user>[\w.-]+)(?P<domain>@[\w.-]+)")
+# Optional trailing column with the mailbox size, bytes or K/M/G/T (powers of 1024)
+SIZE_HINT = re.compile(
+    r"(?P<size>\d+(?:\.\d+)?)(?P<unit>[KMGT]?)(?:i?B)?", re.IGNORECASE
+)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def tokenize_line(line: str) -> Optional[Credentials]:
+    """
+    Splits a line in the formats:
+        USER1@DOMAIN1 PASSWORD1
+        USER1@DOMAIN1 PASSWORD1 USER2@DOMAIN2 PASSWORD2
+    in a single pass over the string, returns None if the line doesn't match
+
+    This gives the same results as the previous WHOLE_STRING_ID expression but
+    every character is visited a bounded number of times so the run time is O(n)
+    regardless of the contents of the passwords
+    """
+    # The old expression allowed a trailing newline before $ but "." never crosses one
+    body = line[:-1] if line.endswith("\n") else line
+    if "\n" in body:
+        return None
+
+    first = ACCOUNT.match(body)
+    if first is None:
+        return None
+    separator = DELIMITER_RUN.match(body, first.end())
+    if separator is None:
+        return None
+    pword1_start = separator.end()
+
+    # The first password is as short as possible, so it ends on the first delimiter
+    # run that is followed by a valid "USER2@DOMAIN2<delimiters>PASSWORD2" tail
+    position = pword1_start
+    while True:
+        candidate = DELIMITER_RUN.search(body, position)
+        if candidate is None:
+            break
+        second = ACCOUNT.match(body, candidate.end())
+        if second is not None:
+            pword2 = _second_password(body, second.end())
+            if pword2 is not None:
+                return Credentials(
+                    first.group("user"),
+                    first.group("domain"),
+                    body[pword1_start : candidate.start()],
+                    second.group("user"),
+                    second.group("domain"),
+                    pword2,
+                )
+        position = candidate.end()
+
+    return Credentials(first.group("user"), first.group("domain"), body[pword1_start:])
+
+
+def _second_password(body: str, position: int) -> Optional[str]:
+    """
+    Returns the password after the second account or None if there is no valid one
+    """
+    separator = DELIMITER_RUN.match(body, position)
+    if separator is None:
+        return None
+    if separator.end() < len(body):
+        return body[separator.end() :]
+    # Only delimiters left, the password takes the last one as long as
+    # at least one delimiter is still left to separate it from the account
+    if separator.end() - separator.start() >= 2:
+        return body[-1]
+    return None
+
+
+def split_size_hint(line: str) -> Tuple[str, Optional[int]]:
+    """
+    Removes a trailing size column from a line and returns the remaining line
+    and the size in bytes, the line is returned untouched when the last field isn't a size
+
+    Only used when size hints are enabled, otherwise a trailing number would be
+    taken as part of the last password
+    """
+    body = line.rstrip(DELIMITERS + "\r\n")
+    start = max(body.rfind(delimiter) for delimiter in DELIMITERS)
+    if start < 0:
+        return line, None
+    hint = SIZE_HINT.fullmatch(body, start + 1)
+    if hint is None:
+        return line, None
+    size = float(hint.group("size")) * SIZE_UNITS[hint.group("unit").upper()]
+    return body[:start].rstrip(DELIMITERS), int(size)
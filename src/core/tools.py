@@ -5,6 +5,8 @@ import json
 from argparse import Namespace
 from typing import Any
 
+from core.sharding import SHARD_STRATEGIES
+
 
 # Try to parse log level, default to 20/INFO
 def set_logging(log_level: str) -> None:
@@ -63,6 +65,42 @@ def setup_argparse() -> Namespace:
         default=10,
         help="Specifies how many entries should each output contain",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used to parse the file, output is the same as with 1",
+    )
+    parser.add_argument(
+        "-sb",
+        "--shard-by",
+        type=str,
+        choices=SHARD_STRATEGIES,
+        default="lines",
+        help="How scripts are split between files: every <split> lines, "
+        "per source/destination account domain, or balanced by the size hints",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=4,
+        help="Number of files for the size strategy",
+    )
+    parser.add_argument(
+        "-sh",
+        "--size-hint",
+        action="store_true",
+        default=False,
+        help="Lines end with the mailbox size (bytes or K/M/G/T), used by --shard-by size",
+    )
+    parser.add_argument(
+        "-dd",
+        "--deduplicate",
+        action="store_true",
+        default=False,
+        help="Drops lines repeating an already seen source/destination account pair",
+    )
     parser.add_argument(
         "-l",
         "--log-level",
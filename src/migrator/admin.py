@@ -35,6 +35,7 @@ from django_celery_beat.admin import (
 
 from .models import CeleryTask, UserPreferences
 from .tasks import (
+    discard_jobs,
     purge_results,
     validate_finished,
     get_running_tasks,
@@ -102,6 +103,7 @@ class TaskAdmin(ModelAdmin):
 
         # Update the queryset to mark tasks as archived
         updated = queryset.update(archived=True)
+        discard_jobs(queryset)
         self.message_user(
             request,
             ngettext(
@@ -1,10 +1,12 @@
 import json
 import logging
 import re
+import shlex
 from django import forms
 from django.contrib.auth.forms import UserChangeForm
 from django.contrib.auth.models import User
 
+from core.hosts import validate_host_patterns
 from .models import UserPreferences
 
 logger = logging.getLogger(__name__)
@@ -44,10 +46,15 @@ class PreferencesForm(forms.ModelForm):
                     for sublist in patterns_list
                 ]
 
+                # Reject invalid expressions once here instead of on every sync request
+                validate_host_patterns(cleaned_patterns)
+
                 # Return the cleaned list (not JSON string, just the Python object)
                 return cleaned_patterns
-        except (ValueError, TypeError):
+        except (json.JSONDecodeError, TypeError):
             raise forms.ValidationError("Invalid JSON format")
+        except ValueError as e:
+            raise forms.ValidationError(f"Invalid host patterns: {e}")
 
 
 class SyncForm(forms.Form):
@@ -92,3 +99,37 @@ class SyncForm(forms.Form):
         required=False,
         widget=forms.CheckboxInput(attrs={"class": "form-check-input mx-2 mt-2"}),
     )
+    deduplicate = forms.BooleanField(
+        label="deduplicate",
+        required=False,
+        widget=forms.CheckboxInput(attrs={"class": "form-check-input mx-2 mt-2"}),
+    )
+    # Splits the jobs into subtasks that run on every worker (tasks.call_system_batch)
+    distributed = forms.BooleanField(
+        label="distributed",
+        required=False,
+        widget=forms.CheckboxInput(attrs={"class": "form-check-input mx-2 mt-2"}),
+    )
+    # Lines end with the size of the mailbox ("... 2.5G"), used to start the
+    # largest accounts first when they have no history (migrator.utilites.scheduling)
+    size_hint = forms.BooleanField(
+        label="size_hint",
+        required=False,
+        widget=forms.CheckboxInput(attrs={"class": "form-check-input mx-2 mt-2"}),
+    )
+    # Tries the logins of every account before running them, the ones rejected by
+    # a server are reported without running (migrator.utilites.preflight)
+    preflight = forms.BooleanField(
+        label="preflight",
+        required=False,
+        widget=forms.CheckboxInput(attrs={"class": "form-check-input mx-2 mt-2"}),
+    )
+
+    def clean_additional_arguments(self) -> str:
+        additional_arguments: str = self.cleaned_data["additional_arguments"]
+        try:
+            # Arguments are split once here and passed to imapsync without a shell
+            shlex.split(additional_arguments)
+        except ValueError as e:
+            raise forms.ValidationError(f"Invalid arguments: {e}")
+        return additional_arguments
@@ -0,0 +1,47 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0007_remove_userpreferences_dark_mode_enabled_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccountCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("logfile", models.CharField(max_length=512)),
+                ("returncode", models.IntegerField()),
+                ("finished_at", models.DateTimeField()),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoints",
+                        to="migrator.celerytask",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["task", "logfile"],
+                        name="migrator_ac_task_id_cdb206_idx",
+                    )
+                ],
+            },
+        ),
+    ]
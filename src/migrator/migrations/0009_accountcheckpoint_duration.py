@@ -0,0 +1,38 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0008_accountcheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="domain",
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="duration",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="size",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="accountcheckpoint",
+            index=models.Index(
+                fields=["logfile"], name="migrator_ac_logfile_64fa51_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="accountcheckpoint",
+            index=models.Index(fields=["domain"], name="migrator_ac_domain_7f5b6d_idx"),
+        ),
+    ]
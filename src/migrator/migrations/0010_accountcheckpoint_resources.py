@@ -0,0 +1,28 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0009_accountcheckpoint_duration"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="max_rss",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="system_cpu",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="user_cpu",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
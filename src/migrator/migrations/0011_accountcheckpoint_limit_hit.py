@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0010_accountcheckpoint_resources"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="limit_hit",
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+    ]
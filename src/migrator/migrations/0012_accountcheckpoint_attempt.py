@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0011_accountcheckpoint_limit_hit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="accountcheckpoint",
+            name="attempt",
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
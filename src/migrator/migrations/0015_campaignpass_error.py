@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("migrator", "0014_taskjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="campaignpass",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -67,6 +67,119 @@ class CeleryTask(models.Model):
         )
 
 
+class AccountCheckpoint(models.Model):
+    """
+    Exit code of an account of a task, saved as soon as its imapsync exits so a
+    resumed or retried task can skip the accounts that already succeeded
+    """
+
+    task = models.ForeignKey(
+        CeleryTask, on_delete=models.CASCADE, related_name="checkpoints"
+    )
+    # Identifies the account pair, "{host1}__{host2}__{user1}--{user2}.log"
+    logfile = models.CharField(max_length=512)
+    returncode = models.IntegerField()
+    finished_at = models.DateTimeField()
+    # Used to estimate the duration of the next runs (migrator.utilites.scheduling)
+    duration = models.FloatField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
+    domain = models.CharField(max_length=255, null=True, blank=True)
+    # Seconds of CPU and peak memory in KiB (migrator.utilites.resources)
+    user_cpu = models.FloatField(null=True, blank=True)
+    system_cpu = models.FloatField(null=True, blank=True)
+    max_rss = models.BigIntegerField(null=True, blank=True)
+    # Limit that made the child exit (migrator.utilites.child_limits)
+    limit_hit = models.CharField(max_length=16, null=True, blank=True)
+    # Run of the account within the task, retried ones have one checkpoint per run
+    # (migrator.utilites.retries)
+    attempt = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["task", "logfile"]),
+            models.Index(fields=["logfile"]),
+            models.Index(fields=["domain"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"<{self.task.task_id} | {self.logfile} | {self.returncode}>"
+
+
+class TaskJob(models.Model):
+    """
+    A job a task was started with, kept so the task can be retried or resumed after
+    its result backend entry and job queue (both limited in size and time) are gone
+    """
+
+    task = models.ForeignKey(CeleryTask, on_delete=models.CASCADE, related_name="jobs")
+    position = models.PositiveIntegerField()
+    # JobDict, or the command line of jobs from older versions
+    job = models.JSONField()
+
+    class Meta:
+        ordering = ["position"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "position"], name="unique_task_job_position"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"<{self.task.task_id} | job {self.position}>"
+
+
+class Campaign(models.Model):
+    """
+    A migration done in passes: a bulk pass (an existing task) days before the
+    cutover, then delta passes that only copy what arrived since the previous pass
+    started (migrator.utilites.delta)
+    """
+
+    name = models.CharField(max_length=255)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f"<Campaign:{self.id} | {self.name}>"
+
+
+class CampaignPass(models.Model):
+    """
+    A pass of a campaign, its task is created when the pass starts
+    """
+
+    campaign = models.ForeignKey(
+        Campaign, on_delete=models.CASCADE, related_name="passes"
+    )
+    # 0 for the bulk pass
+    number = models.PositiveSmallIntegerField()
+    task = models.ForeignKey(
+        CeleryTask,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="campaign_passes",
+    )
+    scheduled_for = models.DateTimeField(null=True, blank=True)
+    # Days given to imapsync's --maxage, None for the bulk pass
+    maxage = models.PositiveIntegerField(null=True, blank=True)
+    # Seconds, set when the task of the pass finishes
+    duration = models.IntegerField(null=True, blank=True)
+    # Why the pass couldn't start, its task stays empty
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ["number"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["campaign", "number"], name="unique_campaign_pass"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"<Campaign:{self.campaign_id} | pass {self.number}>"
+
+
 @receiver(post_delete, sender=CeleryTask)
 def delete_related_files(
     sender: CeleryTask, instance: CeleryTask, **kwargs: Any
@@ -32,3 +32,14 @@ class CeleryTaskSerializer(serializers.ModelSerializer[CeleryTask]):
 
 class TaskIdListSerializer(serializers.Serializer):
     task_ids = serializers.ListField(child=serializers.CharField())
+
+
+class CampaignCreateSerializer(serializers.Serializer):
+    # Task of the bulk pass
+    task_id = serializers.CharField()
+    name = serializers.CharField(max_length=255, required=False, allow_blank=True)
+
+
+class CampaignDeltaSerializer(serializers.Serializer):
+    # Start of the delta pass, right away (once the previous pass finished) if omitted
+    at = serializers.DateTimeField(required=False)
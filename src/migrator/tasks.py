@@ -1,34 +1,345 @@
 # myapp/tasks.py
+import ast
+import re
 import shlex
-import subprocess
 import time
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import (
+    IO,
+    Any,
+    Callable,
+    List,
+    Dict,
+    Generator,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 from pathlib import Path
+from uuid import uuid4
 
-from celery import shared_task
+from celery import Task, chord, shared_task
 from celery.app.control import Inspect
+from celery.app.task import Context
 from celery.result import AsyncResult
-from celery.exceptions import TimeoutError
+from celery.exceptions import Ignore, TimeoutError
 from celery.utils.log import get_task_logger
+from celery.utils.saferepr import saferepr
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db import DatabaseError, connection
+from django.db.models import Avg, QuerySet
 from django.utils import timezone
 from django_celery_results.models import TaskResult
+from redis.exceptions import RedisError
 
-from migrator.models import CeleryTask
+from core.jobs import Job, JobDict
+from migrator.models import (
+    AccountCheckpoint,
+    Campaign,
+    CampaignPass,
+    CeleryTask,
+    TaskJob,
+)
+from migrator.utilites.cancellation import CancellationWatcher
+from migrator.utilites.child_limits import parse_child_limits, read_tail
+from migrator.utilites.concurrency import ConcurrencyController
+from migrator.utilites.cooperative import gevent_mode, make_supervisor, run_blocking
+from migrator.utilites.delta import delta_job, delta_maxage
+from migrator.utilites.host_limits import HostLimiter, HostScheduler, PendingJob
+from migrator.utilites.job_queue import (
+    delete_queued_jobs,
+    get_redis,
+    iter_queued_jobs,
+    queued_total,
+    read_queued_jobs,
+)
+from migrator.utilites.output import ImapsyncOutput
+from migrator.utilites.preflight import parse_preflight, rejected_code, verify_logins
+from migrator.utilites.progress import (
+    ProgressPublisher,
+    ProgressState,
+    read_progress,
+)
+from migrator.utilites.retries import AttemptHistory, parse_retry_policy
+from migrator.utilites.resources import ResourceTotals
+from migrator.utilites.scheduling import (
+    DurationEstimator,
+    logfile_domain,
+    longest_first,
+    makespan_report,
+    predict_makespan,
+    windows,
+)
+from migrator.utilites.supervisor import ChildExit
 from pymap import celery_app
 
 logger = get_task_logger("CeleryTask")
 
 FProc = Dict[str, (str | int)]
-RProc = Dict[str, Any]
 CALL_SYSTEM_TYPE = Dict[str, (str | FProc)]
+LOGFILE_ARG = re.compile(r"--logfile=(\S+)")
+T = TypeVar("T")
+# return_codes, exit_times and concurrency of a set of jobs
+JobResults = Dict[str, Any]
+
+# Longest a task waits for a child before publishing its progress,
+# cancellations wake it right away (migrator.utilites.cancellation)
+PROGRESS_INTERVAL = 10
+# Celery states of a task that is done running
+FINISHED_STATES = ["FAILURE", "SUCCESS"]
+# How often hosts at their limit are checked again
+HOST_RETRY_INTERVAL = 2
+# Queued jobs ordered longest first at once, the first ones wait for this many
+ORDER_WINDOW = 200
+# Rows inserted at once by save_jobs
+JOB_SAVE_BATCH_SIZE = 500
+# Seconds between checks of the previous pass of a campaign
+CAMPAIGN_RETRY_INTERVAL = 60
+# Jobs per subtask when a task is distributed across the workers
+DISTRIBUTED_BATCH_SIZE = 25
+# Reported for the jobs of a distributed subtask that failed before running them
+FAILED_JOB_CODE = -1
+# Previous runs used for the throughput and the average duration of an account
+HISTORY_SAMPLE = 1000
+# Log files per query when loading their history
+HISTORY_CHUNK = 500
+
+
+def build_argv(
+    cmd: (str | JobDict), root_directory: str, log_directory: Path
+) -> Optional[List[str]]:
+    """
+    Returns the arguments to run a job with its log inside the task's log directory,
+    jobs are dictionaries created by ScriptGenerator.process_jobs, strings are only
+    accepted for retrying tasks that were created before jobs existed
+    """
+    if isinstance(cmd, dict):
+        try:
+            return Job.from_dict(cmd).with_logdir(str(log_directory)).argv
+        except (KeyError, TypeError):
+            logger.critical("Received a malformed job")
+            return None
+    # Some complex passwords or our regex/custom logic might fail to create a viable
+    # "command" string, in this case let shlex fail to avoid shell escapes
+    try:
+        return shlex.split(
+            cmd.replace(
+                f"--logdir={root_directory}",
+                f"--logdir={log_directory}",
+            )
+        )
+    except (AttributeError, ValueError):
+        logger.critical("Failed to parse and split the string received")
+        return None
+
+
+def job_logfile(cmd: (str | JobDict)) -> Optional[str]:
+    """
+    Log file name of a job, identifies its account pair across runs of a task
+    """
+    if isinstance(cmd, dict):
+        logfile = cmd.get("logfile")
+        return str(logfile) if logfile else None
+    match = LOGFILE_ARG.search(cmd) if isinstance(cmd, str) else None
+    return match.group(1) if match else None
+
+
+def job_size(cmd: (str | JobDict)) -> Optional[int]:
+    """
+    Size hint of a job in bytes, only jobs created with ScriptGenerator(size_hint=True)
+    """
+    size = cmd.get("size") if isinstance(cmd, dict) else None
+    return int(size) if isinstance(size, int) else None
+
+
+def load_estimator(logfiles: Iterable[str]) -> DurationEstimator:
+    """
+    Durations of the previous successful runs of <logfiles> and of their source
+    domains, from the AccountCheckpoints of every task
+    """
+    runs = AccountCheckpoint.objects.filter(returncode=0, duration__isnull=False)
+    names = sorted(set(logfiles))
+    pairs: Dict[str, List[float]] = {}
+    for start in range(0, len(names), HISTORY_CHUNK):
+        for logfile, duration in runs.filter(
+            logfile__in=names[start : start + HISTORY_CHUNK]
+        ).values_list("logfile", "duration"):
+            pairs.setdefault(logfile, []).append(duration)
+    domains = {domain for domain in map(logfile_domain, names) if domain}
+    domain_averages: Dict[str, float] = {
+        row["domain"]: row["average"]
+        for row in runs.filter(domain__in=domains)
+        .values("domain")
+        .annotate(average=Avg("duration"))
+    }
+    recent = list(runs.order_by("-id").values_list("duration", "size")[:HISTORY_SAMPLE])
+    sized = [(duration, size) for duration, size in recent if size and duration > 0]
+    bytes_per_second = (
+        sum(size for _, size in sized) / sum(duration for duration, _ in sized)
+        if sized
+        else None
+    )
+    average = sum(duration for duration, _ in recent) / len(recent) if recent else None
+    return DurationEstimator(pairs, domain_averages, bytes_per_second, average)
+
+
+def order_jobs(
+    jobs: Iterable[Tuple[int, (str | JobDict)]]
+) -> Tuple[List[Tuple[int, (str | JobDict)]], Dict[str, float], Dict[str, str]]:
+    """
+    Sorts (index, job) pairs from the longest expected job to the shortest,
+    returns them with the estimate and its source per job key
+    """
+    indexed = list(jobs)
+    estimator = load_estimator(
+        logfile for logfile in (job_logfile(cmd) for _, cmd in indexed) if logfile
+    )
+    predicted: Dict[str, float] = {}
+    sources: Dict[str, str] = {}
+    for index, cmd in indexed:
+        predicted[str(index)], sources[str(index)] = estimator.estimate(
+            job_logfile(cmd), job_size(cmd)
+        )
+    ordered = longest_first(indexed, lambda item: predicted[str(item[0])])
+    return ordered, predicted, sources
+
+
+def succeeded_accounts(ctask: Optional[CeleryTask]) -> Dict[str, float]:
+    """
+    Log files of the accounts of <ctask> that already exited successfully,
+    with their epoch exit time
+    """
+    if ctask is None:
+        return {}
+    return {
+        logfile: finished_at.timestamp()
+        for logfile, finished_at in AccountCheckpoint.objects.filter(
+            task=ctask, returncode=0
+        ).values_list("logfile", "finished_at")
+    }
+
+
+def db_call(cooperative: bool, func: Callable[..., T], *args: Any) -> T:
+    """
+    Calls <func> (ORM queries) in gevent's threadpool when <cooperative> so the other
+    tasks of the worker keep running, the connection opened by the pool's thread is
+    closed after the call
+    """
+    if not cooperative:
+        return func(*args)
+
+    def call() -> T:
+        try:
+            return func(*args)
+        finally:
+            connection.close()
+
+    return run_blocking(call, cooperative=True)
+
+
+def preflight_logins(argvs: Dict[str, Optional[List[str]]]) -> Dict[str, int]:
+    """
+    Return code of the jobs whose login was rejected by one of their hosts
+    """
+    outcomes = verify_logins(
+        ((key, argv) for key, argv in argvs.items() if argv is not None),
+        parse_preflight(settings.PYMAP_SETTINGS.get("PREFLIGHT")),
+    )
+    rejected: Dict[str, int] = {}
+    for key, outcome in outcomes.items():
+        code = rejected_code(outcome)
+        if code is not None:
+            rejected[key] = code
+    return rejected
+
+
+def save_jobs(
+    ctask: CeleryTask, jobs: Iterable[(str | JobDict)], start: int = 0
+) -> int:
+    """
+    Keeps the jobs of a task in the database (TaskJob) starting at position <start>,
+    returns how many were saved
+    """
+    rows = [
+        TaskJob(task=ctask, position=position, job=job)
+        for position, job in enumerate(jobs, start=start)
+    ]
+    TaskJob.objects.bulk_create(rows, batch_size=JOB_SAVE_BATCH_SIZE)
+    return len(rows)
+
+
+def discard_jobs(tasks: "QuerySet[CeleryTask]") -> int:
+    """
+    Deletes the jobs saved with <tasks> once their results are purged or they are
+    archived, the jobs hold the passwords and are only needed to retry or resume.
+    Campaigns with passes left to start keep them, the next pass starts from them
+
+    Returns how many were deleted
+    """
+    pending = Campaign.objects.filter(passes__task__isnull=True, passes__error="")
+    deleted, _ = (
+        TaskJob.objects.filter(task__in=tasks)
+        .exclude(task__campaign_passes__campaign__in=pending)
+        .delete()
+    )
+    if deleted:
+        logger.info("Deleted %s saved jobs", deleted)
+    return deleted
+
+
+def stored_jobs(task_id: str) -> Tuple[List[(str | JobDict)], Dict[str, Any]]:
+    """
+    Jobs and keyword arguments a task was started with, the jobs come from the
+    database (save_jobs). Tasks from before TaskJob existed read them from the result
+    backend (or the job queue for streamed tasks), which only keep small or recent ones
+
+    Raises LookupError when the jobs are no longer available
+    """
+    # This is to avoid -> Caution: A complex expression can overflow the C stack and cause a crash.
+    MAX_LENGTH = 20000
+
+    def validate_and_evaluate(input_str: str, max_length=MAX_LENGTH) -> Any:
+        if len(input_str) > max_length:
+            raise ValueError(
+                f"Input string exceeds the maximum length of {max_length} characters."
+            )
+        return ast.literal_eval(input_str)
+
+    cmd_list: List[(str | JobDict)] = list(
+        TaskJob.objects.filter(task__task_id=task_id)
+        .order_by("position")
+        .values_list("job", flat=True)
+    )
+    kwargs: Dict[str, Any] = {}
+    try:
+        meta = celery_app.backend.get_task_meta(task_id)
+        # The options are lost once the results are purged, every job still runs
+        if meta.get("kwargs"):
+            kwargs = validate_and_evaluate(meta["kwargs"])
+        if not cmd_list:
+            # Convert the string to a Python tuple containing a list
+            content_tuple = validate_and_evaluate(meta["args"])
+            # Extract the list from the tuple
+            cmd_list = content_tuple[0]
+    except (KeyError, IndexError, TypeError, ValueError, SyntaxError) as e:
+        logger.warning("Can't read the stored arguments of %s: %s", task_id, e)
+    if not cmd_list:
+        # Streamed tasks are started with an empty list, their jobs are in the job queue
+        try:
+            cmd_list = read_queued_jobs(get_redis(), task_id)
+        except RedisError as e:
+            logger.warning("Can't read the job queue of %s: %s", task_id, e)
+    if not cmd_list:
+        raise LookupError(f"The jobs of task {task_id} are no longer available")
+    return cmd_list, kwargs
 
 
 def should_terminate_task(task_id: str) -> bool:
-    # Implement logic to check if the task should terminate
-    # For example, check a value in the database or cache
+    # Running tasks are notified through Redis (migrator.utilites.cancellation),
+    # this is only called when Redis can't be reached
     task = CeleryTask.objects.filter(task_id=task_id).first()
     if task:
         if task.terminated:
@@ -82,9 +393,629 @@ def long_running_test_task(timeout: int = 100, wait_timer: int = 5) -> None:
         ltime = ltime - wait_timer
 
 
+def run_jobs(
+    task: Task,
+    jobs: Iterable[(str | JobDict)],
+    log_directory: Path,
+    control_id: str,
+    total: Callable[[], int],
+    progress: ProgressPublisher,
+    offset: int = 0,
+    preflight: bool = False,
+    window: Optional[int] = None,
+) -> JobResults:
+    """
+    Runs <jobs> with imapsync, the jobs that start and finish are published to
+    <progress> and a summary to <task>'s meta every time a delta is published.
+    The stdout of every child is parsed as it runs (migrator.utilites.output) and
+    the progress of the running accounts is published along with the deltas
+
+    <control_id> is the task whose CeleryTask is checked for termination and whose
+    id prefixes the host leases, the task itself or the parent of a distributed subtask.
+    Jobs are keyed by their position plus <offset> so the keys of every subtask are unique
+
+    Every exit is saved as an AccountCheckpoint of <control_id> with the CPU and memory
+    the child used and the limit it hit if any (CHILD_LIMITS), accounts that already
+    have a successful one (the task is being resumed) are reported without running
+
+    Jobs start from the longest expected one (migrator.utilites.scheduling), with
+    <window> only within every <window> consecutive jobs so a queued task doesn't
+    wait for the view to be done parsing. The preflight needs every job up front
+
+    Under the gevent pool (SUPERVISION, migrator.utilites.cooperative) the children
+    are supervised with gevent's primitives and the ORM calls run in its threadpool
+
+    Accounts that exit with a transient error run again after a backoff
+    (RETRIES, migrator.utilites.retries), only their last run is in the results
+
+    With <preflight> the logins of every job are tried first (PREFLIGHT,
+    migrator.utilites.preflight), jobs with a rejected login are reported with
+    imapsync's code (161/162) without running
+    """
+    root_directory: str = settings.PYMAP_LOGDIR
+    # Number of processes, adjusted while the task runs (migrator.utilites.concurrency)
+    concurrency = ConcurrencyController(settings.PYMAP_SETTINGS.get("CONCURRENCY"))
+    finished_procs: Dict[str, int] = {}
+    # Epoch time at which each child exited, same keys as finished_procs
+    exit_times: Dict[str, float] = {}
+
+    # Only talks to Redis when HOST_LIMITS is configured (migrator.utilites.host_limits)
+    host_limits = settings.PYMAP_SETTINGS.get("HOST_LIMITS")
+    limiter = HostLimiter(get_redis() if host_limits else None, host_limits, control_id)
+    supervision = settings.PYMAP_SETTINGS.get("SUPERVISION")
+    cooperative = gevent_mode(supervision)
+    ctask = db_call(
+        cooperative, lambda: CeleryTask.objects.filter(task_id=control_id).first()
+    )
+    succeeded = db_call(cooperative, succeeded_accounts, ctask)
+    # Log file of every running job
+    logfiles: Dict[str, str] = {}
+    indexed = enumerate(jobs, start=offset)
+    ordered: Iterable[Tuple[int, (str | JobDict)]]
+    # Every job at once, only known for sorted lists
+    ordered_list: Optional[List[Tuple[int, (str | JobDict)]]] = None
+    predicted: Dict[str, float] = {}
+    sources: Dict[str, str] = {}
+    if window is None or preflight:
+        # Read here, queued jobs come from Redis through this greenlet's connection
+        ordered_list, predicted, sources = db_call(
+            cooperative, order_jobs, list(indexed)
+        )
+        ordered = ordered_list
+    else:
+
+        def ordered_windows() -> Generator[Tuple[int, (str | JobDict)], None, None]:
+            for jobs_window in windows(indexed, window):
+                window_order, window_predicted, window_sources = db_call(
+                    cooperative, order_jobs, jobs_window
+                )
+                predicted.update(window_predicted)
+                sources.update(window_sources)
+                yield from window_order
+
+        ordered = ordered_windows()
+    # Epoch time at which each child started, for the makespan report
+    start_times: Dict[str, float] = {}
+    sizes: Dict[str, Optional[int]] = {}
+    slots = concurrency.limit
+    # CPU and memory of the children, migrator.utilites.resources
+    resources = ResourceTotals()
+    # Applied to every child, migrator.utilites.child_limits
+    child_limits = parse_child_limits(settings.PYMAP_SETTINGS.get("CHILD_LIMITS"))
+    # Stderr of the running children, only when they are limited
+    stderr_files: Dict[str, IO[bytes]] = {}
+    limit_hits: Dict[str, str] = {}
+    # Live progress of the running children
+    outputs: Dict[str, ImapsyncOutput] = {}
+    # Arguments of the jobs built for the preflight, by key
+    argvs: Dict[str, Optional[List[str]]] = {}
+    rejected: Dict[str, int] = {}
+    if preflight:
+        for index, cmd in ordered:
+            logfile = job_logfile(cmd)
+            if logfile is None or logfile not in succeeded:
+                argvs[str(index)] = build_argv(cmd, root_directory, log_directory)
+        rejected = preflight_logins(argvs)
+        logger.info(
+            "Task %s preflight rejected %s of %s jobs",
+            task.request.id,
+            len(rejected),
+            len(argvs),
+        )
+        # Saved like any other exit, retrying the failed accounts tries them again
+        rejected_checkpoints: List[AccountCheckpoint] = []
+        for index, cmd in ordered:
+            logfile = job_logfile(cmd)
+            if ctask is None or logfile is None or str(index) not in rejected:
+                continue
+            rejected_checkpoints.append(
+                AccountCheckpoint(
+                    task=ctask,
+                    logfile=logfile,
+                    returncode=rejected[str(index)],
+                    finished_at=timezone.now(),
+                    domain=logfile_domain(logfile),
+                )
+            )
+        if rejected_checkpoints:
+            try:
+                db_call(
+                    cooperative,
+                    AccountCheckpoint.objects.bulk_create,
+                    rejected_checkpoints,
+                )
+            except DatabaseError as e:
+                logger.error("Failed to save checkpoints for %s: %s", control_id, e)
+    # Transient failures run again, migrator.utilites.retries
+    retry_policy = parse_retry_policy(settings.PYMAP_SETTINGS.get("RETRIES"))
+    attempts = AttemptHistory()
+    # Command of the running children, a retry runs it again
+    running: Dict[str, List[str]] = {}
+    # Also bounds how stale the progress of the accounts is
+    wait_timeout = min(PROGRESS_INTERVAL, max(1.0, progress.interval))
+    if ordered_list is not None:
+        logger.info(
+            "Task %s predicted makespan %.1fs for %s jobs on %s slots",
+            task.request.id,
+            predict_makespan(
+                (predicted[str(index)] for index, _ in ordered_list), slots
+            ),
+            len(ordered_list),
+            slots,
+        )
+
+    def record(exits: List[ChildExit]) -> None:
+        checkpoints: List[AccountCheckpoint] = []
+        for child in exits:
+            resources.add(child.key, child.usage, child.duration)
+            output = outputs.pop(child.key, None)
+            if output is not None:
+                progress.account(child.key, output.snapshot())
+            limiter.release(child.key)
+            argv = running.pop(child.key, None)
+            stderr = stderr_files.pop(child.key, None)
+            limit_hit = child_limits.exceeded(
+                child.returncode, child.usage, read_tail(stderr)
+            )
+            if stderr is not None:
+                stderr.close()
+            attempt = attempts.count(child.key) + 1
+            retry_in: Optional[float] = None
+            if (
+                not terminated
+                and argv is not None
+                and limit_hit is None
+                and retry_policy.should_retry(child.returncode, attempt)
+            ):
+                retry_in = retry_policy.delay(attempt)
+                logger.warning(
+                    "Job %s exited with %s, attempt %s of %s, retrying in %.1fs",
+                    child.key,
+                    child.returncode,
+                    attempt,
+                    retry_policy.max_attempts,
+                    retry_in,
+                )
+                # Waits without a slot, it's started again like a pending job
+                scheduler.defer((child.key, argv), child.exited_at + retry_in)
+                progress.started(-1)
+            attempts.add(
+                child.key,
+                child.returncode,
+                child.started_at,
+                child.exited_at,
+                retry_in,
+            )
+            if retry_in is None:
+                logger.info("Marked for removal: %s", child.key)
+                finished_procs[child.key] = child.returncode
+                exit_times[child.key] = round(child.exited_at, 3)
+                start_times[child.key] = child.started_at
+                progress.finished(child.key, child.returncode, child.exited_at)
+            if limit_hit is not None:
+                logger.warning("Job %s hit the %s limit", child.key, limit_hit)
+                limit_hits[child.key] = limit_hit
+            logfile = logfiles.get(child.key)
+            if retry_in is None:
+                logfiles.pop(child.key, None)
+            if ctask is not None and logfile is not None:
+                checkpoints.append(
+                    AccountCheckpoint(
+                        task=ctask,
+                        logfile=logfile,
+                        returncode=child.returncode,
+                        finished_at=datetime.fromtimestamp(
+                            child.exited_at, tz=dt_timezone.utc
+                        ),
+                        duration=round(child.duration, 3),
+                        size=sizes.get(child.key),
+                        domain=logfile_domain(logfile),
+                        user_cpu=child.usage.user_cpu if child.usage else None,
+                        system_cpu=child.usage.system_cpu if child.usage else None,
+                        max_rss=child.usage.max_rss if child.usage else None,
+                        limit_hit=limit_hit,
+                        attempt=attempt,
+                    )
+                )
+        if checkpoints:
+            # Saved right away, a crashed worker loses at most the running accounts
+            try:
+                db_call(cooperative, AccountCheckpoint.objects.bulk_create, checkpoints)
+            except DatabaseError as e:
+                logger.error("Failed to save checkpoints for %s: %s", control_id, e)
+        concurrency.record_exit(len(exits))
+        concurrency.update()
+
+    def pending_jobs() -> Generator[PendingJob, None, None]:
+        for index, cmd in ordered:
+            key = str(index)
+            logfile = job_logfile(cmd)
+            if logfile is not None and logfile in succeeded:
+                logger.info("Skipping %s, it already succeeded", logfile)
+                finished_procs[key] = 0
+                exit_times[key] = round(succeeded[logfile], 3)
+                progress.started()
+                progress.finished(key, 0, succeeded[logfile])
+                continue
+            if key in argvs:
+                argv = argvs.pop(key)
+            else:
+                argv = build_argv(cmd, root_directory, log_directory)
+            if argv is None:
+                # Continue to the next iteration of the loop
+                continue
+            if key in rejected:
+                logger.info("Skipping %s, its login was rejected", key)
+                exited_at = time.time()
+                finished_procs[key] = rejected[key]
+                exit_times[key] = round(exited_at, 3)
+                progress.started()
+                progress.finished(key, rejected[key], exited_at)
+                continue
+            if logfile is not None:
+                logfiles[key] = logfile
+                sizes[key] = job_size(cmd)
+            yield key, argv
+
+    # Children are reaped as soon as they exit (migrator.utilites.supervisor)
+    supervisor = make_supervisor(supervision)
+    # Skips jobs whose hosts are at their limit instead of waiting for them in order
+    scheduler = HostScheduler(pending_jobs(), limiter)
+    # Only falls back to the database when Redis can't be reached
+    cancellation = CancellationWatcher(
+        get_redis(),
+        control_id,
+        lambda: db_call(cooperative, should_terminate_task, control_id),
+    )
+    cancellation.attach(supervisor)
+    # Subtasks that start after a distributed task was cancelled don't run anything
+    terminated = cancellation.check()
+    try:
+        while True:
+            while not terminated and len(supervisor) < concurrency.limit:
+                picked = scheduler.next_runnable()
+                if picked is None:
+                    break
+                key, argv = picked
+                logger.info("Task %s Scheduling %s", task.request.id, key)
+                options = child_limits.popen_options()
+                if "stderr" in options:
+                    stderr_files[key] = options["stderr"]
+                outputs[key] = ImapsyncOutput(logfiles.get(key))
+                supervisor.spawn(key, argv, output=outputs[key].feed, **options)
+                running[key] = argv
+                progress.started()
+            if not supervisor and (terminated or scheduler.done):
+                break
+            # Hosts taken by other tasks are freed without an event here,
+            # so they are checked again sooner
+            timeout = HOST_RETRY_INTERVAL if scheduler.blocked else wait_timeout
+            retry_due = scheduler.next_due()
+            if retry_due is not None and len(supervisor) < concurrency.limit:
+                timeout = min(timeout, retry_due)
+            if supervisor:
+                if len(supervisor) >= concurrency.limit:
+                    logger.info("%s Waiting for Queue", task.request.id)
+                record(supervisor.wait(timeout=timeout))
+            elif scheduler.blocked:
+                logger.info("%s Waiting for host capacity", task.request.id)
+                supervisor.sleep(timeout)
+            else:
+                logger.info("%s Waiting for retries", task.request.id)
+                supervisor.sleep(timeout)
+            limiter.refresh()
+            if not terminated and cancellation.check():
+                logger.info("Task %s was cancelled", task.request.id)
+                terminated = True
+                supervisor.terminate_all()
+                # The last run of the accounts waiting for a retry is their result
+                for key, _ in scheduler.drop_deferred():
+                    last = attempts.last(key)
+                    if last is not None:
+                        finished_procs[key] = last.returncode
+                        exit_times[key] = last.exited_at
+                        start_times[key] = last.started_at
+                        progress.started()
+                        progress.finished(key, last.returncode, last.exited_at)
+                        logfiles.pop(key, None)
+            for key, output in outputs.items():
+                if output.changed:
+                    progress.account(key, output.snapshot())
+            # The return codes are only in the deltas, the meta stays small
+            if progress.flush():
+                task.update_state(
+                    state="PROGRESS",
+                    meta={
+                        "processing": len(supervisor),
+                        "finished": len(finished_procs),
+                        "total": total(),
+                        "concurrency": concurrency.meta(),
+                        "progress": progress.key,
+                        "status": "Processing...",
+                    },
+                )
+    finally:
+        progress.flush(force=True)
+        cancellation.close()
+        supervisor.close()
+        limiter.release_all()
+        for stderr in stderr_files.values():
+            stderr.close()
+
+    schedule = makespan_report(predicted, start_times, exit_times, slots, sources)
+    logger.info("Task %s schedule: %s", task.request.id, schedule)
+    logger.info("Task %s resources: %s", task.request.id, resources.to_dict())
+    return {
+        "total": total(),
+        "return_codes": finished_procs,
+        "exit_times": exit_times,
+        "concurrency": concurrency.meta(),
+        "schedule": schedule,
+        "resources": resources.to_dict(),
+        "limit_hits": limit_hits,
+        "attempts": attempts.retried(),
+    }
+
+
+def merge_job_results(results: Iterable[JobResults]) -> JobResults:
+    """
+    Combines the results of the subtasks of a distributed task, their resources
+    are added up while their concurrency and schedule are kept per subtask
+    """
+    resources = ResourceTotals()
+    merged: JobResults = {
+        "total": 0,
+        "return_codes": {},
+        "exit_times": {},
+        "concurrency": [],
+        "schedule": [],
+        "limit_hits": {},
+        "attempts": {},
+    }
+    for result in results:
+        merged["total"] += result.get("total", 0)
+        merged["return_codes"].update(result.get("return_codes", {}))
+        merged["exit_times"].update(result.get("exit_times", {}))
+        merged["limit_hits"].update(result.get("limit_hits", {}))
+        merged["attempts"].update(result.get("attempts", {}))
+        if "concurrency" in result:
+            merged["concurrency"].append(result["concurrency"])
+        if "schedule" in result:
+            merged["schedule"].append(result["schedule"])
+        resources.merge(result.get("resources", {}))
+    merged["resources"] = resources.to_dict()
+    return merged
+
+
+def split_jobs(
+    jobs: Iterable[(str | JobDict)], size: int
+) -> Generator[Tuple[int, List[(str | JobDict)]], None, None]:
+    """
+    Yields (offset, batch) for every <size> jobs
+    """
+    batch: List[(str | JobDict)] = []
+    offset = 0
+    for job in jobs:
+        batch.append(job)
+        if len(batch) >= size:
+            yield offset, batch
+            offset += len(batch)
+            batch = []
+    if batch:
+        yield offset, batch
+
+
+@shared_task(bind=True)
+def call_system_batch(
+    self,
+    parent_id: str,
+    offset: int,
+    cmd_list: List[(str | JobDict)],
+    preflight: bool = False,
+) -> JobResults:
+    """
+    Runs a slice of the jobs of a distributed task, the logs are written to the
+    parent's directory and cancelling the parent terminates the slice
+
+    A slice that raises reports its unfinished jobs with FAILED_JOB_CODE instead of
+    failing, a failed subtask would keep the chord from ever calling merge_batches
+    """
+    log_directory = Path(settings.PYMAP_LOGDIR, parent_id)
+    # The subtask might run on a different host than the parent
+    log_directory.mkdir(parents=True, exist_ok=True)
+    # Published with the parent's progress, which already counted these jobs
+    progress = ProgressPublisher(
+        get_redis(), parent_id, settings.PYMAP_SETTINGS.get("PROGRESS_INTERVAL")
+    )
+    try:
+        return run_jobs(
+            self,
+            cmd_list,
+            log_directory,
+            parent_id,
+            lambda: len(cmd_list),
+            progress,
+            offset,
+            preflight,
+        )
+    except Exception as e:
+        logger.error(
+            "Subtask %s of %s failed: %s", self.request.id, parent_id, e, exc_info=True
+        )
+        return failed_batch(progress, parent_id, offset, len(cmd_list))
+
+
+def failed_batch(
+    progress: ProgressPublisher, parent_id: str, offset: int, count: int
+) -> JobResults:
+    """
+    Results of a slice that raised, its jobs that were already published to the
+    parent's progress keep their code and the others finish with FAILED_JOB_CODE
+    """
+    state = ProgressState()
+    try:
+        read_progress(progress.client, parent_id, state)
+    except RedisError as e:
+        logger.warning("Failed to read the progress of %s: %s", parent_id, e)
+    now = time.time()
+    return_codes: Dict[str, int] = {}
+    exit_times: Dict[str, float] = {}
+    for index in range(offset, offset + count):
+        key = str(index)
+        if key in state.return_codes:
+            return_codes[key] = state.return_codes[key]
+            exit_times[key] = state.exit_times[key]
+        else:
+            return_codes[key] = FAILED_JOB_CODE
+            exit_times[key] = now
+            progress.finished(key, FAILED_JOB_CODE, now)
+    progress.flush(force=True)
+    return {"total": count, "return_codes": return_codes, "exit_times": exit_times}
+
+
+@shared_task
+def merge_batches(
+    results: List[JobResults],
+    parent_id: str,
+    run_start: float,
+    resume: bool,
+    parent_request: Dict[str, Any],
+) -> CALL_SYSTEM_TYPE:
+    """
+    Chord callback of the subtasks of a distributed task, finishes the parent
+    (call_system) with the merged results
+    """
+    merged = merge_job_results(results)
+    progress = ProgressPublisher(
+        get_redis(), parent_id, settings.PYMAP_SETTINGS.get("PROGRESS_INTERVAL")
+    )
+    result = finish_task(
+        parent_id,
+        merged,
+        progress,
+        datetime.fromtimestamp(run_start, tz=dt_timezone.utc),
+        resume,
+    )
+    # Stored with the parent's arguments, stored_jobs reads them back to retry or resume
+    celery_app.backend.store_result(
+        parent_id, result, "SUCCESS", request=Context(parent_request)
+    )
+    return result
+
+
+def run_distributed(
+    task: Task,
+    jobs: Iterable[(str | JobDict)],
+    batch_size: int,
+    progress: ProgressPublisher,
+    run_start: datetime,
+    resume: bool = False,
+    preflight: bool = False,
+) -> int:
+    """
+    Splits <jobs> into call_system_batch subtasks that any worker can pick up, the
+    subtasks publish to <progress> (the task's own deltas) and merge_batches finishes
+    <task> once all of them are done. Returns the number of subtasks
+
+    The jobs are sorted longest first before splitting so the long ones are
+    picked up by the first subtasks
+    """
+    task_id = task.request.id
+    ordered, _, _ = order_jobs(enumerate(jobs))
+    header = [
+        call_system_batch.s(task_id, offset, batch, preflight)
+        for offset, batch in split_jobs((cmd for _, cmd in ordered), batch_size)
+    ]
+    if not header:
+        return 0
+    # The total was counted while splitting
+    progress.flush(force=True)
+    logger.info("Task %s distributed into %s subtasks", task_id, len(header))
+    request = task.request
+    # What the result backend keeps of the task's arguments, the jobs themselves are
+    # saved with the task (save_jobs) so only their shortened repr is passed along
+    parent_request = {
+        "id": task_id,
+        "task": task.name,
+        "hostname": request.hostname,
+        "kwargs": request.kwargs,
+        "argsrepr": (
+            request.argsrepr if request.argsrepr is not None else saferepr(request.args)
+        ),
+        "kwargsrepr": (
+            request.kwargsrepr
+            if request.kwargsrepr is not None
+            else saferepr(request.kwargs)
+        ),
+    }
+    chord(header)(
+        merge_batches.s(task_id, run_start.timestamp(), resume, parent_request)
+    )
+    return len(header)
+
+
+def finish_task(
+    task_id: str,
+    results: JobResults,
+    progress: ProgressPublisher,
+    run_start: datetime,
+    resume: bool,
+) -> CALL_SYSTEM_TYPE:
+    """
+    Publishes the final status of a task and saves its run time, returns its result
+    """
+    finished_procs = results["return_codes"]
+    progress.flush(status="SUCCESS")
+
+    logger.info("Finished Task: %s , calculating run time...", task_id)
+    ctask = CeleryTask.objects.get(task_id=task_id)
+
+    # Calculate run time in seconds
+    # TODO: Investigate celery's builtin runtime calculation
+    # https://stackoverflow.com/questions/33860242/extract-runtime-and-time-of-completion-from-celery-task
+
+    start_time = ctask.start_time
+    end_time = timezone.now()
+    run_time_seconds = int((end_time - start_time).total_seconds())
+    if resume:
+        # The time between the previous run and this one isn't counted
+        run_time_seconds = ctask.run_time + int((end_time - run_start).total_seconds())
+
+    logger.debug("START TIME: %s", ctask.start_time)
+    logger.debug("RUN TIME: %s", run_time_seconds)
+
+    # Update the run_time field in the database
+    ctask.run_time = run_time_seconds
+    # Make sure to mark the task as finished
+    # We can probably hook onto task's failure/success status and mark the task
+    # as finished there to avoid tasks never being finished when they crash
+    ctask.finished = True
+    ctask.save()
+    # Passes of a campaign (migrator.utilites.delta) keep their own duration
+    CampaignPass.objects.filter(task=ctask).update(duration=run_time_seconds)
+
+    return {"status": "SUCCESS", "return_codes": finished_procs}
+
+
 @shared_task(bind=True)
-def call_system(self, cmd_list: Optional[List[str]]) -> CALL_SYSTEM_TYPE:
-    # cmd_list is not optional and should always be a list of strings
+def call_system(
+    self,
+    cmd_list: Optional[List[(str | JobDict)]],
+    queued: bool = False,
+    distributed: bool = False,
+    resume: bool = False,
+    preflight: bool = False,
+) -> CALL_SYSTEM_TYPE:
+    # When queued is set the jobs are read from the task's job queue as the view
+    # pushes them (migrator.utilites.job_queue) and cmd_list is empty
+    # When distributed is set the jobs are run by call_system_batch subtasks of
+    # DISTRIBUTED_BATCH_SIZE jobs, this task only splits them and merge_batches
+    # finishes it once they are done, so it doesn't hold a worker slot meanwhile
+    # When resume is set the task is running again under the same id (views.resume_task),
+    # its accounts with a successful checkpoint are skipped by run_jobs
+    # When preflight is set the logins are verified before any imapsync runs
+    # (migrator.utilites.preflight), the rejected ones are reported without running
+    # cmd_list is not optional and should always be a list of jobs
     # however this is a failsafe to avoid parsing invalid data
     # It also is Optional to avoid type errors on the next statement
     # Was implemented due to retry task since the stored data is a string
@@ -99,140 +1030,178 @@ def call_system(self, cmd_list: Optional[List[str]]) -> CALL_SYSTEM_TYPE:
         )
         return {"status": "FAILURE"}
     root_directory: str = settings.PYMAP_LOGDIR
-    total_cmds: int = len(cmd_list)
-    max_procs: int = 5
-    finished_procs: Dict[str, (str | int)] = {}
-    running_procs: RProc = {}
     task_id = self.request.id
     log_directory = Path(root_directory, task_id)
-
-    for i, cmd in enumerate(cmd_list):
-        cmd_list[i] = cmd.replace(
-            f"--logdir={root_directory}",
-            f"--logdir={log_directory}",
-        )
+    run_start = timezone.now()
 
     # Just to ensure if the task is the one creating the path
     if not log_directory.exists():
         log_directory.mkdir()
+    client = get_redis()
+    # Deltas of the task's progress (migrator.utilites.progress)
+    progress = ProgressPublisher(
+        client, task_id, settings.PYMAP_SETTINGS.get("PROGRESS_INTERVAL")
+    )
+    jobs: Iterable[(str | JobDict)] = cmd_list
+    total: Callable[[], int] = lambda: len(cmd_list)
+
+    def counted(jobs: Iterable[(str | JobDict)]) -> Iterator[(str | JobDict)]:
+        for job in jobs:
+            progress.add_jobs()
+            yield job
+
+    def drained(jobs: Iterable[JobDict]) -> Iterator[JobDict]:
+        yield from jobs
+        # The jobs hold the passwords, they are kept with the task (TaskJob) instead
+        try:
+            delete_queued_jobs(client, task_id)
+        except RedisError as e:
+            logger.warning("Failed to delete the job queue of %s: %s", task_id, e)
+
+    if queued:
+        jobs = drained(iter_queued_jobs(client, task_id))
+        # Grows until the view is done parsing the input
+        total = lambda: queued_total(client, task_id)
+
     # Moved the check to the task itself to verify for cases of overwritting contents,
     # this will be slow if the directory has a lot of contents
-    if len(sorted(log_directory.rglob("*.*"))) > 0:
+    if not resume and len(sorted(log_directory.rglob("*.*"))) > 0:
         logger.warning(
             "Directory: %s seems to already exist and isn't completely empty, we might be overwritting files",
             log_directory,
         )
 
-    def check_running(procs: RProc) -> RProc:
-        for key in list(procs):
-            proc = procs[key]
-            if isinstance(proc, subprocess.Popen):
-                status = proc.poll()
-                if status is None:
-                    continue
-                else:
-                    logger.info("Marked for removal: %s", key)
-                    finished_procs[key] = status
-                    procs.pop(key, None)
-        return procs
-
-    def terminate_all(procs: RProc) -> None:
-        for key in list(procs):
-            proc = procs[key]
-            if isinstance(proc, subprocess.Popen):
-                logger.info(f"Terminating {proc.pid}")
-                proc.terminate()
-
-    for index, cmd in enumerate(cmd_list):
-        logger.info("Task %s Scheduling %s", task_id, index)
-        # Some complex passwords or our regex/custom logic might fail to create a viable
-        # "command" string, in this case let shlex fail to avoid shell escapes
-        try:
-            shlex.split(cmd)
-        except ValueError:
-            logger.critical("Failed to parse and split the string received")
-            # logger.debug(
-            #     "Received the following command string: %s", cmd, exc_info=True
-            # )
-            # Continue to the next iteration of the loop
-            continue
-        n_cmd = subprocess.Popen(
-            shlex.split(cmd),
-            stdin=None,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            shell=False,
+    if distributed:
+        subtasks = run_distributed(
+            self,
+            counted(jobs),
+            DISTRIBUTED_BATCH_SIZE,
+            progress,
+            run_start,
+            resume,
+            preflight,
         )
-        running_procs[str(index)] = n_cmd
-        while len(running_procs) >= max_procs:
-            logger.info("%s Waiting for Queue", task_id)
-            running_procs = check_running(running_procs)
-            time.sleep(4)
-
-        self.update_state(
-            state="PROGRESS",
-            meta={
-                "processing": len(running_procs),
-                "pending": len(cmd_list),
-                "total": total_cmds,
-                "return_codes": finished_procs,
-                "status": "Processing...",
-            },
-        )
-        if should_terminate_task(task_id):
-            terminate_all(running_procs)
-
-    while running_procs:
-        running_procs = check_running(running_procs)
-        nrp = len(running_procs)
-        if should_terminate_task(task_id):
-            terminate_all(running_procs)
-        self.update_state(
-            state="PROGRESS",
-            meta={
-                "processing": nrp,
-                "pending": nrp,
-                "total": total_cmds,
-                "return_codes": finished_procs,
-                "status": "Processing...",
-            },
+        if subtasks:
+            self.update_state(
+                state="PROGRESS",
+                meta={
+                    "subtasks": subtasks,
+                    "progress": progress.key,
+                    "status": "Processing...",
+                },
+            )
+            # Finished by merge_batches once every subtask is done, the progress
+            # of the subtasks is read from <progress>
+            raise Ignore()
+        results = merge_job_results([])
+    else:
+        results = run_jobs(
+            self,
+            counted(jobs),
+            log_directory,
+            task_id,
+            total,
+            progress,
+            preflight=preflight,
+            window=ORDER_WINDOW if queued else None,
         )
-        time.sleep(10)
 
     self.update_state(
         state="SUCCESS",
         meta={
             "processing": 0,
             "pending": 0,
-            "total": total_cmds,
-            "return_codes": finished_procs,
+            **results,
             "status": "SUCCESS",
         },
     )
+    return finish_task(task_id, results, progress, run_start, resume)
 
-    logger.info("Finished Task: %s , calculating run time...", task_id)
-    ctask = CeleryTask.objects.get(task_id=task_id)
-
-    # Calculate run time in seconds
-    # TODO: Investigate celery's builtin runtime calculation
-    # https://stackoverflow.com/questions/33860242/extract-runtime-and-time-of-completion-from-celery-task
-
-    start_time = ctask.start_time
-    end_time = timezone.now()
-    run_time_seconds = int((end_time - start_time).total_seconds())
 
-    logger.debug("START TIME: %s", ctask.start_time)
-    logger.debug("RUN TIME: %s", run_time_seconds)
+@shared_task(bind=True, max_retries=None)
+def run_campaign_pass(self: Task, pass_id: int) -> Optional[str]:
+    """
+    Starts a delta pass of a campaign: a new task with the jobs of the previous pass
+    and a --maxage that covers the time since that pass started. Waits for the
+    previous pass to start and finish first (passes that failed to start are skipped),
+    returns the id of the new task. Passes that can't start keep the reason in <error>
+    """
+    campaign_pass = (
+        CampaignPass.objects.select_related("campaign").filter(id=pass_id).first()
+    )
+    if campaign_pass is None or campaign_pass.task is not None:
+        logger.warning("Campaign pass %s is gone or already started", pass_id)
+        return None
+    campaign = campaign_pass.campaign
 
-    # Update the run_time field in the database
-    ctask.run_time = run_time_seconds
-    # Make sure to mark the task as finished
-    # We can probably hook onto task's failure/success status and mark the task
-    # as finished there to avoid tasks never being finished when they crash
-    ctask.finished = True
-    ctask.save()
+    def fail(error: str) -> None:
+        logger.error(
+            "Campaign %s pass %s can't start: %s",
+            campaign.id,
+            campaign_pass.number,
+            error,
+        )
+        campaign_pass.error = error
+        campaign_pass.save(update_fields=["error"])
 
-    return {"status": "SUCCESS", "return_codes": finished_procs}
+    previous = (
+        campaign.passes.filter(number__lt=campaign_pass.number, error="")
+        .select_related("task")
+        .order_by("-number")
+        .first()
+    )
+    if previous is None:
+        fail("There is no previous pass to follow")
+        return None
+    previous_task = previous.task
+    if previous_task is None or not previous_task.finished:
+        logger.info(
+            "Campaign %s pass %s waits for pass %s",
+            campaign.id,
+            campaign_pass.number,
+            previous.number,
+        )
+        raise self.retry(countdown=CAMPAIGN_RETRY_INTERVAL)
+    days = delta_maxage(previous_task.start_time, timezone.now())
+    try:
+        cmd_list, kwargs = stored_jobs(previous_task.task_id)
+    except LookupError as e:
+        fail(str(e))
+        return None
+    jobs = [delta_job(cmd, days) for cmd in cmd_list]
+    task_id = str(uuid4())
+    log_directory = Path(settings.PYMAP_LOGDIR, task_id)
+    log_directory.mkdir(parents=True, exist_ok=True)
+    ctask = CeleryTask.objects.create(
+        task_id=task_id,
+        source=previous_task.source,
+        destination=previous_task.destination,
+        log_path=str(log_directory),
+        n_accounts=len(jobs),
+        domains=previous_task.domains or "",
+        owner=campaign.owner,
+    )
+    # Read by the next pass
+    save_jobs(ctask, jobs)
+    campaign_pass.task = ctask
+    campaign_pass.maxage = days
+    campaign_pass.save(update_fields=["task", "maxage"])
+    logger.info(
+        "Campaign %s pass %s started as %s with --maxage %s",
+        campaign.id,
+        campaign_pass.number,
+        task_id,
+        days,
+    )
+    call_system.apply_async(  # type: ignore
+        (jobs,),
+        {
+            "distributed": bool(kwargs.get("distributed")),
+            "preflight": bool(kwargs.get("preflight")),
+        },
+        task_id=task_id,
+    )
+    return task_id
 
 
 # I'm not sure how the django admin scheduler passes the arguments, assuming as string
@@ -270,6 +1239,10 @@ def purge_results(
 
     # Filter the queryset to get tasks older than the cutoff date
     # Avoid Purging results from running tasks, don't purge results from tasks that have already been purged
+    # Also the tasks purged earlier, campaigns may have kept their jobs until now
+    discard_jobs(
+        CeleryTask.objects.filter(start_time__lt=cutoff_date, finished=finished)
+    )
     tasks = CeleryTask.objects.filter(
         start_time__lt=cutoff_date, finished=finished, results_purged=False
     )
@@ -303,45 +1276,49 @@ def purge_results(
             task.save()
 
 
+def task_in_workers(task_id: str) -> bool:
+    """
+    Whether a worker runs, holds or scheduled <task_id> or one of its distributed
+    subtasks (call_system_batch), only the workers that reply in time are checked
+    """
+    inspector = Inspect(app=celery_app)
+    # Scheduled tasks wrap their request
+    replies = [
+        (inspector.active(), False),
+        (inspector.reserved(), False),
+        (inspector.scheduled(), True),
+    ]
+    for reply, wrapped in replies:
+        logger.debug("Inspected tasks: %s", reply)
+        for _, tasks in (reply or {}).items():
+            for task in tasks:
+                request = task["request"] if wrapped else task
+                if request["id"] == task_id:
+                    return True
+                args = request.get("args") or []
+                if request.get("name") == call_system_batch.name and (
+                    args and args[0] == task_id
+                ):
+                    return True
+    return False
+
+
+def task_stopped(task: CeleryTask) -> bool:
+    """
+    Whether <task> is no longer running: it finished, failed, or no worker has it
+    (the worker running it crashed or its result was deleted)
+    """
+    if task.finished or task.results_purged:
+        return True
+    if AsyncResult(task.task_id, app=celery_app).status in FINISHED_STATES:
+        return True
+    return not task_in_workers(task.task_id)
+
+
 # Some tasks where not being set as finished, can also be run periodically
 # for tasks that may have crashed
 @shared_task
 def validate_finished() -> None:
-    FINISHED_STATES = ["FAILURE", "SUCCESS"]
-
-    def _task_exists(task_id: str) -> bool:
-        inspector = Inspect(app=celery_app)
-
-        # Check active tasks
-        active_tasks = inspector.active()
-        logger.debug(f"ACTIVE TASKS: {active_tasks}")
-        if active_tasks:
-            for _, tasks in active_tasks.items():
-                for task in tasks:
-                    if task["id"] == task_id:
-                        return True
-
-        # Check reserved tasks
-        reserved_tasks = inspector.reserved()
-        logger.debug(f"RESERVED TASKS: {active_tasks}")
-        if reserved_tasks:
-            for _, tasks in reserved_tasks.items():
-                for task in tasks:
-                    if task["id"] == task_id:
-                        return True
-
-        # Check scheduled tasks
-        scheduled_tasks = inspector.scheduled()
-        logger.debug(f"SCHEDULED TASKS: {active_tasks}")
-        if scheduled_tasks:
-            for _, tasks in scheduled_tasks.items():
-                for task in tasks:
-                    if task["request"]["id"] == task_id:
-                        return True
-
-        # Task not found
-        return False
-
     def _is_finished(task: CeleryTask) -> bool:
         async_result = AsyncResult(task.task_id, app=celery_app)
         # The results have already been purged we can't check task state
@@ -378,8 +1355,8 @@ def validate_finished() -> None:
         # Status can be PENDING for unkown/deleted tasks
         elif async_result.status == "PENDING":
             try:
-                return _task_exists(task.task_id)
-            except AttributeError:
+                return not task_in_workers(task.task_id)
+            except (AttributeError, KeyError):
                 logger.error(
                     "We are trying to access task ID in queues, but the response structure seems to have changed"
                 )
@@ -424,3 +1401,4 @@ def archive_older_than(
     cutoff_date = datetime.now() - td
     tasks = CeleryTask.objects.filter(start_time__lt=cutoff_date, finished=True)
     tasks.update(archived=True)
+    discard_jobs(tasks)
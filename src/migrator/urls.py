@@ -29,6 +29,7 @@ urlpatterns = [
         name="api-tasks-list",
     ),
     path("api/tasks/retry/<str:task_id>", views.retry_task, name="api-retry-task"),
+    path("api/tasks/resume/<str:task_id>", views.resume_task, name="api-resume-task"),
     path(
         "api/tasks/archive/",
         views.ArchiveTask.as_view(),
@@ -49,11 +50,41 @@ urlpatterns = [
         views.CeleryTaskDetails.as_view(),
         name="api-tasks-details",
     ),
+    path(
+        "api/tasks/<str:task_id>/progress/",
+        views.CeleryTaskProgress.as_view(),
+        name="api-tasks-progress",
+    ),
+    path(
+        "api/tasks/<str:task_id>/accounts/",
+        views.CeleryTaskAccounts.as_view(),
+        name="api-tasks-accounts",
+    ),
+    path(
+        "api/tasks/<str:task_id>/resources/",
+        views.CeleryTaskResources.as_view(),
+        name="api-tasks-resources",
+    ),
     path(
         "api/tasks/<str:task_id>/<log:log_file>/",
         views.CeleryTaskLogDetails.as_view(),
         name="api-tasks-log-details",
     ),
+    path(
+        "api/campaigns/create/",
+        views.CampaignCreate.as_view(),
+        name="api-campaigns-create",
+    ),
+    path(
+        "api/campaigns/<int:campaign_id>/",
+        views.CampaignDetails.as_view(),
+        name="api-campaigns-details",
+    ),
+    path(
+        "api/campaigns/<int:campaign_id>/delta/",
+        views.CampaignDelta.as_view(),
+        name="api-campaigns-delta",
+    ),
     path("account/", views.user_account, name="user-account"),
     path("update-account/", views.update_account, name="update-account"),
     path("update-preferences/", views.update_preferences, name="update-preferences"),
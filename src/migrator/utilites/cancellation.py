@@ -0,0 +1,164 @@
+"""
+Cancellation of running tasks without polling the database
+
+CancelTask sets a key and publishes on a channel named after the task, every running
+call_system (and every subtask of a distributed one) is subscribed to that channel.
+The socket of the subscription is watched by the supervisor along with the children,
+so a cancellation wakes the task right away and its children are terminated within
+milliseconds instead of at the next check
+
+The key covers tasks that subscribe after the message was published (subtasks that
+were still queued), when Redis can't be reached the task falls back to calling
+<fallback> (the CeleryTask.terminated field) every FALLBACK_INTERVAL seconds
+"""
+import logging
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from migrator.utilites.supervisor import ProcessSupervisor
+
+logger = logging.getLogger(__name__)
+
+CANCEL_PREFIX = "pymap:cancel:"
+CANCEL_TTL = 7 * 24 * 60 * 60
+FALLBACK_INTERVAL = 10
+
+
+def cancel_key(task_id: str) -> str:
+    """
+    Name of both the key and the channel of the task
+    """
+    return f"{CANCEL_PREFIX}{task_id}"
+
+
+def request_cancel(client: Any, task_id: str) -> int:
+    """
+    Marks the task as cancelled and notifies it,
+    returns the number of subscribers that received the message
+    """
+    key = cancel_key(task_id)
+    pipe = client.pipeline()
+    pipe.set(key, 1, ex=CANCEL_TTL)
+    pipe.publish(key, "cancel")
+    _, receivers = pipe.execute()
+    logger.debug("Cancellation of %s sent to %s subscribers", task_id, receivers)
+    return int(receivers)
+
+
+def clear_cancel(client: Any, task_id: str) -> None:
+    """
+    Forgets a cancellation, for tasks that are resumed under the same id
+    """
+    client.delete(cancel_key(task_id))
+
+
+class CancellationWatcher:
+    """
+    Tells a running task if it was cancelled
+
+    Usage:
+        watcher = CancellationWatcher(client, task_id, fallback)
+        watcher.attach(supervisor)
+        ...
+        if watcher.check():
+            supervisor.terminate_all()
+        ...
+        watcher.close()
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        task_id: str,
+        fallback: Optional[Callable[[], bool]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        # Dropping the client closes its pool, the subscription's connection included
+        self.client = client
+        self.task_id = task_id
+        self.fallback = fallback
+        self.clock = clock
+        self.cancelled = False
+        self.pubsub: Any = None
+        self.last_fallback: Optional[float] = None
+        # Supervisor watching the socket of the subscription
+        self.watched: Optional[Tuple[ProcessSupervisor, int]] = None
+        if client is None:
+            return
+        key = cancel_key(task_id)
+        try:
+            self.pubsub = client.pubsub()
+            self.pubsub.subscribe(key)
+            # Read after subscribing so a cancellation sent in between isn't missed
+            self.cancelled = bool(client.exists(key))
+        except RedisError as e:
+            logger.warning(
+                "Can't subscribe to cancellations of %s, polling instead: %s",
+                task_id,
+                e,
+            )
+            self.close()
+
+    def fileno(self) -> Optional[int]:
+        """
+        Socket of the subscription, readable when a message arrives
+        """
+        if self.pubsub is None or self.pubsub.connection is None:
+            return None
+        sock = getattr(self.pubsub.connection, "_sock", None)
+        return None if sock is None else int(sock.fileno())
+
+    def attach(self, supervisor: ProcessSupervisor) -> None:
+        """
+        Wakes <supervisor> when a cancellation arrives, the socket is unwatched
+        when the subscription is closed
+        """
+        fileno = self.fileno()
+        if fileno is not None and supervisor.watch(fileno):
+            self.watched = (supervisor, fileno)
+
+    def check(self) -> bool:
+        """
+        Reads the pending messages without blocking, True once the task was cancelled
+        """
+        if self.cancelled:
+            return True
+        if self.pubsub is not None:
+            try:
+                # Subscribe confirmations are also messages, read until there are none
+                while True:
+                    message = self.pubsub.get_message(timeout=0.0)
+                    if message is None:
+                        break
+                    if message["type"] == "message":
+                        self.cancelled = True
+            except RedisError as e:
+                logger.warning(
+                    "Lost the cancellations of %s, polling instead: %s",
+                    self.task_id,
+                    e,
+                )
+                self.close()
+            else:
+                return self.cancelled
+        now = self.clock()
+        if self.fallback is not None and (
+            self.last_fallback is None or now - self.last_fallback >= FALLBACK_INTERVAL
+        ):
+            self.last_fallback = now
+            self.cancelled = self.fallback()
+        return self.cancelled
+
+    def close(self) -> None:
+        if self.watched is not None:
+            supervisor, fileno = self.watched
+            supervisor.unwatch(fileno)
+            self.watched = None
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except RedisError:
+                pass
+            self.pubsub = None
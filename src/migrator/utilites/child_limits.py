@@ -0,0 +1,245 @@
+"""
+Resource limits of the imapsync processes, so a single account can't take the
+whole worker down with it
+
+Configured by the "CHILD_LIMITS" key of the config file, every key is optional:
+    "CHILD_LIMITS": {
+        "MEMORY": 2048,           address space of a child in MiB (RLIMIT_AS)
+        "CPU_TIME": 3600,         CPU seconds (RLIMIT_CPU), killed CPU_GRACE seconds later
+        "OPEN_FILES": 1024,       open file descriptors (RLIMIT_NOFILE)
+        "NICE": 10,               added to the priority of the child
+        "IONICE": "best-effort",  IO scheduling class: "best-effort" or "idle"
+        "IONICE_LEVEL": 7         priority inside the class, 0 (highest) to 7
+    }
+
+The limits are applied in the child between fork and exec (preexec_fn), or right after
+posix_spawn by the gevent supervision (apply, migrator.utilites.cooperative). A child
+that hits one is recorded with the limit instead of as an ordinary failure. The stderr of
+limited children goes to an unnamed temporary file whose tail tells the limits apart
+"""
+import ctypes
+import logging
+import os
+import platform
+import resource
+import signal
+import tempfile
+from typing import IO, Any, Dict, List, NamedTuple, Optional
+
+from migrator.utilites.resources import ResourceUsage
+
+logger = logging.getLogger(__name__)
+
+# Seconds of CPU between SIGXCPU and SIGKILL
+CPU_GRACE = 10
+# Bytes of stderr read when a limited child exits
+STDERR_TAIL = 4096
+
+IONICE_CLASSES = {"best-effort": 2, "idle": 3}
+# Default priority of the best-effort class
+DEFAULT_IONICE_LEVEL = 4
+# ioprio_set isn't exposed by the os module
+IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+
+# Outcomes of a child that hit a limit
+LIMIT_MEMORY = "memory"
+LIMIT_CPU = "cpu"
+LIMIT_OPEN_FILES = "open_files"
+
+MEMORY_ERRORS = (b"Out of memory", b"Cannot allocate memory")
+OPEN_FILES_ERRORS = (b"Too many open files",)
+
+
+class ChildLimits(NamedTuple):
+    # Bytes
+    memory: Optional[int] = None
+    cpu_time: Optional[int] = None
+    open_files: Optional[int] = None
+    nice: Optional[int] = None
+    ionice_class: Optional[int] = None
+    ionice_level: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(value is not None for value in self)
+
+    def preexec(self) -> None:
+        """
+        Runs in the child before exec, errors can't be reported from here so limits
+        that can't be applied are skipped (parse_child_limits warns about the
+        ones that are known to fail)
+        """
+        self._apply(0)
+
+    def apply(self, pid: int) -> None:
+        """
+        Applies the limits to the running process <pid>, for children that weren't
+        forked by us (posix_spawn). The child runs unlimited for the few microseconds
+        between its start and this call
+        """
+        for failed in self._apply(pid):
+            logger.warning("Can't apply CHILD_LIMITS %s to %s", failed, pid)
+
+    def _apply(self, pid: int) -> List[str]:
+        """
+        Applies the limits to <pid> (0 for the current process),
+        returns the ones that failed
+        """
+        failed: List[str] = []
+        if self.memory is not None:
+            if not _set_limit(pid, resource.RLIMIT_AS, self.memory, self.memory):
+                failed.append("MEMORY")
+        if self.cpu_time is not None:
+            if not _set_limit(
+                pid, resource.RLIMIT_CPU, self.cpu_time, self.cpu_time + CPU_GRACE
+            ):
+                failed.append("CPU_TIME")
+        if self.open_files is not None:
+            if not _set_limit(
+                pid, resource.RLIMIT_NOFILE, self.open_files, self.open_files
+            ):
+                failed.append("OPEN_FILES")
+        if self.nice is not None:
+            try:
+                # Relative to the worker, like os.nice
+                priority = os.getpriority(os.PRIO_PROCESS, 0) + self.nice
+                os.setpriority(os.PRIO_PROCESS, pid, min(priority, 19))
+            except OSError:
+                failed.append("NICE")
+        if self.ionice_class is not None:
+            if not _set_ionice(
+                pid,
+                self.ionice_class,
+                DEFAULT_IONICE_LEVEL
+                if self.ionice_level is None
+                else self.ionice_level,
+            ):
+                failed.append("IONICE")
+        return failed
+
+    def popen_options(self) -> Dict[str, Any]:
+        """
+        Keyword arguments for ProcessSupervisor.spawn, the caller closes the stderr file
+        """
+        if not self.enabled:
+            return {}
+        return {
+            "limits": self,
+            "stderr": tempfile.TemporaryFile(prefix="pymap-stderr-"),
+        }
+
+    def exceeded(
+        self, returncode: int, usage: Optional[ResourceUsage], stderr: bytes = b""
+    ) -> Optional[str]:
+        """
+        Limit that made a child exit, None if it exited for any other reason
+        """
+        if returncode == 0:
+            return None
+        if self.cpu_time is not None:
+            if returncode == -signal.SIGXCPU:
+                return LIMIT_CPU
+            if (
+                returncode == -signal.SIGKILL
+                and usage is not None
+                and usage.cpu >= self.cpu_time
+            ):
+                return LIMIT_CPU
+        if self.memory is not None and any(error in stderr for error in MEMORY_ERRORS):
+            return LIMIT_MEMORY
+        if self.open_files is not None and any(
+            error in stderr for error in OPEN_FILES_ERRORS
+        ):
+            return LIMIT_OPEN_FILES
+        return None
+
+
+def _set_limit(pid: int, limit: int, soft: int, hard: int) -> bool:
+    try:
+        _, current_hard = resource.prlimit(pid, limit)
+        if current_hard != resource.RLIM_INFINITY:
+            # Only root can raise a hard limit
+            soft, hard = min(soft, current_hard), min(hard, current_hard)
+        resource.prlimit(pid, limit, (soft, hard))
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _set_ionice(pid: int, ionice_class: int, level: int) -> bool:
+    syscall = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall is None:
+        return False
+    try:
+        return (
+            ctypes.CDLL(None, use_errno=True).syscall(
+                syscall,
+                IOPRIO_WHO_PROCESS,
+                pid,
+                (ionice_class << IOPRIO_CLASS_SHIFT) | level,
+            )
+            == 0
+        )
+    except (OSError, AttributeError):
+        return False
+
+
+def read_tail(file: Optional[IO[bytes]], size: int = STDERR_TAIL) -> bytes:
+    """
+    Last <size> bytes written to <file>
+    """
+    if file is None:
+        return b""
+    try:
+        end = file.seek(0, os.SEEK_END)
+        file.seek(max(0, end - size))
+        return file.read()
+    except (OSError, ValueError):
+        return b""
+
+
+def _positive(config: Dict[str, Any], key: str) -> Optional[int]:
+    value = config.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        logger.warning("Ignoring CHILD_LIMITS %s, expected a positive integer", key)
+        return None
+    return value
+
+
+def parse_child_limits(config: Any) -> ChildLimits:
+    """
+    Reads the CHILD_LIMITS config, malformed entries are discarded
+    """
+    if not isinstance(config, dict):
+        return ChildLimits()
+    memory = _positive(config, "MEMORY")
+    nice = config.get("NICE")
+    if nice is not None and (not isinstance(nice, int) or not 0 <= nice <= 19):
+        logger.warning("Ignoring CHILD_LIMITS NICE, expected an integer from 0 to 19")
+        nice = None
+    ionice = config.get("IONICE")
+    ionice_class = IONICE_CLASSES.get(ionice) if isinstance(ionice, str) else None
+    if ionice is not None and ionice_class is None:
+        logger.warning(
+            "Ignoring CHILD_LIMITS IONICE, expected one of %s", list(IONICE_CLASSES)
+        )
+    ionice_level = config.get("IONICE_LEVEL")
+    if ionice_level is not None and (
+        not isinstance(ionice_level, int) or not 0 <= ionice_level <= 7
+    ):
+        logger.warning("Ignoring CHILD_LIMITS IONICE_LEVEL, expected 0 to 7")
+        ionice_level = None
+    if ionice_class is not None and platform.machine() not in IOPRIO_SET_SYSCALLS:
+        logger.warning("IONICE isn't supported on %s", platform.machine())
+    return ChildLimits(
+        memory=memory * 1024 * 1024 if memory is not None else None,
+        cpu_time=_positive(config, "CPU_TIME"),
+        open_files=_positive(config, "OPEN_FILES"),
+        nice=nice,
+        ionice_class=ionice_class,
+        ionice_level=ionice_level,
+    )
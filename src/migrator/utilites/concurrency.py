@@ -0,0 +1,178 @@
+"""
+Adaptive number of imapsync processes per task
+
+Every INTERVAL seconds the controller looks at the host load (per CPU), the available
+memory and the jobs finished since the last decision and moves the limit between
+FLOOR and CEILING:
+    - shrinks by a quarter when the load or the memory are past their thresholds
+    - steps back one slot when growing made the throughput worse,
+      and doesn't grow again for the next COOLDOWN decisions
+    - grows one slot while there is headroom
+    - holds otherwise
+
+Configured by the "CONCURRENCY" key of the config file, every field is optional:
+    {"FLOOR": 2, "CEILING": 20, "INITIAL": 5, "INTERVAL": 30,
+     "MAX_LOAD": 1.0, "MIN_FREE_MEMORY": 0.15, "TOLERANCE": 0.1}
+"""
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+Decision = Dict[str, Any]
+
+DEFAULTS: Dict[str, float] = {
+    "FLOOR": 2,
+    "CEILING": 20,
+    # Same as the previous hardcoded max_procs
+    "INITIAL": 5,
+    "INTERVAL": 30,
+    # 1 minute load average divided by the number of CPUs
+    "MAX_LOAD": 1.0,
+    # Fraction of the total memory that has to stay available
+    "MIN_FREE_MEMORY": 0.15,
+    # Throughput drops smaller than this fraction are considered noise
+    "TOLERANCE": 0.1,
+}
+# Number of decisions kept for the progress meta
+HISTORY_SIZE = 10
+# Decisions without growing after stepping back because of the throughput
+COOLDOWN = 3
+
+
+def host_load() -> Optional[float]:
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+def free_memory(meminfo: str = "/proc/meminfo") -> Optional[float]:
+    """
+    MemAvailable / MemTotal, None when /proc/meminfo can't be read (non Linux)
+    """
+    values: Dict[str, int] = {}
+    try:
+        with open(meminfo, "r") as fh:
+            for line in fh:
+                name, _, value = line.partition(":")
+                if name in ("MemTotal", "MemAvailable"):
+                    values[name] = int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    if not values.get("MemTotal") or "MemAvailable" not in values:
+        return None
+    return values["MemAvailable"] / values["MemTotal"]
+
+
+class ConcurrencyController:
+    def __init__(
+        self,
+        config: Optional[Mapping[str, Any]] = None,
+        load: Callable[[], Optional[float]] = host_load,
+        memory: Callable[[], Optional[float]] = free_memory,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        options = dict(DEFAULTS)
+        if config:
+            options.update({k: v for k, v in config.items() if k in DEFAULTS})
+        self.floor = max(1, int(options["FLOOR"]))
+        self.ceiling = max(self.floor, int(options["CEILING"]))
+        self.limit = min(self.ceiling, max(self.floor, int(options["INITIAL"])))
+        self.interval = float(options["INTERVAL"])
+        self.max_load = float(options["MAX_LOAD"])
+        self.min_free_memory = float(options["MIN_FREE_MEMORY"])
+        self.tolerance = float(options["TOLERANCE"])
+        self.load = load
+        self.memory = memory
+        self.clock = clock
+        self.completed = 0
+        self.window_start = clock()
+        self.window_completed = 0
+        self.previous_rate: Optional[float] = None
+        self.last_action = "hold"
+        self.cooldown = 0
+        self.history: Deque[Decision] = deque(maxlen=HISTORY_SIZE)
+
+    def record_exit(self, count: int = 1) -> None:
+        self.completed += count
+
+    def update(self) -> Optional[Decision]:
+        """
+        Takes a decision if INTERVAL seconds passed since the last one,
+        returns it or None when it's not time yet
+        """
+        now = self.clock()
+        elapsed = now - self.window_start
+        if elapsed < self.interval:
+            return None
+        # Jobs finished per minute over the last window, for all slots and per slot
+        rate = (self.completed - self.window_completed) * 60 / elapsed
+        load = self.load()
+        memory = self.memory()
+
+        limit = self.limit
+        if load is not None and load > self.max_load:
+            action, reason = "shrink", "load"
+            limit = max(self.floor, limit - max(1, limit // 4))
+        elif memory is not None and memory < self.min_free_memory:
+            action, reason = "shrink", "memory"
+            limit = max(self.floor, limit - max(1, limit // 4))
+        elif (
+            self.last_action == "grow"
+            and self.previous_rate
+            and rate < self.previous_rate * (1 - self.tolerance)
+        ):
+            action, reason = "shrink", "throughput"
+            limit = max(self.floor, limit - 1)
+            self.cooldown = COOLDOWN
+        elif self.cooldown > 0:
+            action, reason = "hold", "cooldown"
+            self.cooldown -= 1
+        elif limit < self.ceiling:
+            action, reason = "grow", "headroom"
+            limit += 1
+        else:
+            action, reason = "hold", "ceiling"
+
+        decision: Decision = {
+            "limit": limit,
+            "previous_limit": self.limit,
+            "action": action if limit != self.limit else "hold",
+            "reason": reason,
+            "load": None if load is None else round(load, 2),
+            "free_memory": None if memory is None else round(memory, 3),
+            "throughput": round(rate, 2),
+            "per_child": round(rate / self.limit, 2),
+        }
+        if limit != self.limit:
+            logger.info(
+                "Concurrency %s -> %s (%s: load %s, free memory %s, %s jobs/min)",
+                self.limit,
+                limit,
+                reason,
+                decision["load"],
+                decision["free_memory"],
+                decision["throughput"],
+            )
+        self.last_action = decision["action"]
+        self.limit = limit
+        self.previous_rate = rate
+        self.window_start = now
+        self.window_completed = self.completed
+        self.history.append(decision)
+        return decision
+
+    def meta(self) -> Dict[str, Any]:
+        """
+        Current state for the task's progress meta
+        """
+        return {
+            "limit": self.limit,
+            "floor": self.floor,
+            "ceiling": self.ceiling,
+            "decisions": list(self.history),
+        }
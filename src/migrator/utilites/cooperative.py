@@ -0,0 +1,215 @@
+"""
+Supervision of the imapsync processes designed for the gevent worker pool
+
+The workers run with --pool=gevent and hundreds of tasks share a single thread, a task
+that blocks the thread (a fork, a database query) stops all the others.
+GeventSupervisor is a ProcessSupervisor that doesn't rely on monkey patching:
+    - children are started with os.posix_spawnp (vfork + exec), a fork of the worker
+      copies its page tables and blocks the thread for milliseconds per child
+    - CHILD_LIMITS are applied to the spawned child (ChildLimits.apply),
+      there is no preexec_fn without fork
+    - waiting is a gevent selector on the pidfds of the children, their stdout and the
+      watched descriptors
+    - children are reaped with os.wait4, the ones reaped first by gevent's SIGCHLD
+      handler (os monkey patched) get their status from gevent.os.waitpid and their
+      usage from the /proc samples
+
+run_blocking runs a call that would block the thread (the ORM) in gevent's threadpool,
+so only the calling greenlet waits for it
+
+Selected by the "SUPERVISION" key of the config file: "gevent", "selectors"
+(ProcessSupervisor) or "auto" (default), which picks gevent when os is monkey patched
+"""
+import logging
+import os
+import selectors
+import signal
+import subprocess
+from typing import IO, Any, Callable, List, Optional, Tuple, TypeVar
+
+import gevent
+import gevent.os
+from gevent.selectors import GeventSelector
+
+from migrator.utilites.child_limits import ChildLimits
+from migrator.utilites.resources import ResourceUsage, from_rusage
+from migrator.utilites.supervisor import (
+    Child,
+    OutputKey,
+    ProcessSupervisor,
+    children_reaped_elsewhere,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+SUPERVISION_MODES = ("auto", "gevent", "selectors")
+
+
+def gevent_mode(mode: Optional[str] = None) -> bool:
+    if mode not in SUPERVISION_MODES:
+        if mode is not None:
+            logger.warning(
+                "Unknown SUPERVISION %s, expected one of %s", mode, SUPERVISION_MODES
+            )
+        mode = "auto"
+    if mode == "auto":
+        return children_reaped_elsewhere()
+    return mode == "gevent"
+
+
+def make_supervisor(mode: Optional[str] = None) -> ProcessSupervisor:
+    """
+    Supervisor for the SUPERVISION mode
+    """
+    if gevent_mode(mode):
+        return GeventSupervisor()
+    return ProcessSupervisor()
+
+
+def run_blocking(
+    func: Callable[..., T], *args: Any, cooperative: Optional[bool] = None
+) -> T:
+    """
+    Calls <func> in gevent's threadpool when <cooperative> (by default when os is
+    monkey patched), other greenlets run while it blocks
+    """
+    if cooperative is None:
+        cooperative = children_reaped_elsewhere()
+    if not cooperative:
+        return func(*args)
+    return gevent.get_hub().threadpool.apply(func, args)
+
+
+class SpawnedProcess:
+    """
+    The parts of Popen used by the supervisor, for a child started with posix_spawn
+    """
+
+    def __init__(self, pid: int, stdout: Optional[IO[bytes]] = None) -> None:
+        self.pid = pid
+        self.stdout = stdout
+        self.returncode: Optional[int] = None
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            try:
+                # Knows the status of the children reaped by gevent
+                pid, status = gevent.os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                logger.warning("Lost the exit status of %s", self.pid)
+                self.returncode = -1
+            else:
+                if pid == self.pid:
+                    self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def send_signal(self, signum: int) -> None:
+        # Once reaped the pid can belong to another process
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+
+class GeventSupervisor(ProcessSupervisor):
+    """
+    Keeps track of the running children of a task without blocking other greenlets
+
+    Same usage as ProcessSupervisor
+    """
+
+    def __init__(
+        self, use_pidfd: Optional[bool] = None, sample_proc: Optional[bool] = None
+    ) -> None:
+        super().__init__(use_pidfd=use_pidfd, sample_proc=sample_proc)
+        self.selector.close()
+        self.selector = GeventSelector()
+
+    def spawn(
+        self,
+        key: str,
+        argv: List[str],
+        output: Optional[Callable[[bytes], None]] = None,
+        limits: Optional[ChildLimits] = None,
+        **kwargs: Any,
+    ) -> SpawnedProcess:  # type: ignore[override]
+        """
+        Same as ProcessSupervisor.spawn, <kwargs> only accepts a stderr
+        (DEVNULL or a file)
+        """
+        stderr = kwargs.pop("stderr", subprocess.DEVNULL)
+        if kwargs:
+            raise TypeError(f"Unsupported spawn options: {', '.join(kwargs)}")
+        file_actions: List[Tuple[Any, ...]] = [
+            (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0)
+        ]
+        if stderr == subprocess.DEVNULL:
+            file_actions.append((os.POSIX_SPAWN_OPEN, 2, os.devnull, os.O_WRONLY, 0))
+        else:
+            file_actions.append((os.POSIX_SPAWN_DUP2, stderr.fileno(), 2))
+        read_end: Optional[int] = None
+        write_end: Optional[int] = None
+        if output is not None:
+            # Both ends are close-on-exec, dup2 clears it on the child's stdout
+            read_end, write_end = os.pipe()
+            file_actions[0] = (os.POSIX_SPAWN_DUP2, write_end, 1)
+        try:
+            pid = os.posix_spawnp(
+                argv[0],
+                argv,
+                os.environ,
+                file_actions=file_actions,
+                # Python ignores SIGPIPE, Popen restores these too
+                setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+                setsigmask=(),
+            )
+        except OSError:
+            if read_end is not None:
+                os.close(read_end)
+            raise
+        finally:
+            if write_end is not None:
+                os.close(write_end)
+        if limits is not None and limits.enabled:
+            limits.apply(pid)
+        stdout = (
+            os.fdopen(read_end, "rb", buffering=0) if read_end is not None else None
+        )
+        proc = SpawnedProcess(pid, stdout)
+        self.add(key, proc)  # type: ignore[arg-type]
+        if output is not None and stdout is not None:
+            os.set_blocking(stdout.fileno(), False)
+            self.selector.register(stdout, selectors.EVENT_READ, OutputKey(key))
+            self.outputs[key] = output
+        return proc
+
+    def _collect(
+        self, key: str, child: Child
+    ) -> Optional[Tuple[int, Optional[ResourceUsage]]]:
+        """
+        Prefers wait4 for every child, gevent only reaps some of them first
+        """
+        proc = child.proc
+        try:
+            pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            returncode = proc.poll()
+            if returncode is None:
+                return None
+            return returncode, self.samples.get(key)
+        if pid == 0:
+            return None
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, from_rusage(rusage)
+
+    def sleep(self, seconds: float) -> None:
+        gevent.sleep(seconds)
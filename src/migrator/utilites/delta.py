@@ -0,0 +1,65 @@
+"""
+Delta passes of a migration campaign
+
+A cutover is a bulk pass days before the MX switch followed by quick passes that
+only copy what arrived since. A delta pass runs the jobs of the previous pass with
+imapsync's --maxage, the messages younger than the days since the previous pass
+started plus MAXAGE_MARGIN (clock skew between the servers and timezones), so the
+messages that arrived while the previous pass ran are copied too. imapsync still
+skips the ones that are already on host2
+"""
+import math
+import shlex
+from datetime import datetime
+from typing import List
+
+from core.jobs import Job, JobDict
+
+SECONDS_PER_DAY = 24 * 60 * 60
+MAXAGE_MARGIN = 1
+
+
+def delta_maxage(
+    previous_start: datetime, now: datetime, margin: int = MAXAGE_MARGIN
+) -> int:
+    """
+    Days given to --maxage for a pass starting at <now>
+    """
+    elapsed = max(0.0, (now - previous_start).total_seconds())
+    return max(1, math.ceil(elapsed / SECONDS_PER_DAY) + margin)
+
+
+def with_maxage(argv: List[str], days: int) -> List[str]:
+    """
+    Copy of <argv> with --maxage <days> instead of its own --maxage
+    """
+    result: List[str] = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+            continue
+        if arg == "--maxage":
+            skip = True
+            continue
+        if arg.startswith("--maxage="):
+            continue
+        result.append(arg)
+    return result + ["--maxage", str(days)]
+
+
+def delta_job(cmd: (str | JobDict), days: int) -> (str | JobDict):
+    """
+    A job of the previous pass limited to the messages of the last <days>, malformed
+    jobs are returned as they are (call_system reports them)
+    """
+    if isinstance(cmd, dict):
+        try:
+            job = Job.from_dict(cmd)
+        except (KeyError, TypeError):
+            return cmd
+        return job._replace(argv=with_maxage(job.argv, days)).to_dict()
+    try:
+        return shlex.join(with_maxage(shlex.split(cmd), days))
+    except (AttributeError, ValueError):
+        return cmd
@@ -0,0 +1,287 @@
+"""
+Cluster wide limits of simultaneous imapsync sessions per IMAP host
+
+Every host with a limit has a Redis sorted set of leases (member: task and job, score:
+expiry time), a job only starts when a lease can be taken on both its host1 and host2
+at once. Leases are refreshed while the job runs and expire on their own if the worker
+dies, so a crashed task can't hold a host forever. While Redis can't be reached the
+limits are not enforced, jobs start without a lease and Redis is tried again after
+REDIS_RETRY_INTERVAL
+
+Configured by the "HOST_LIMITS" key of the config file, a list of [pattern, limit]
+pairs matched against the hostnames (re.match, first match wins), hosts that don't
+match any pattern are not limited:
+    "HOST_LIMITS": [["^imap\\.example\\.com$", 10], [".*\\.example\\.org$", 4]]
+"""
+import heapq
+import logging
+import re
+import time
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+)
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+HOST_LEASE_PREFIX = "pymap:hosts:"
+# Seconds a lease is valid without being refreshed
+LEASE_TTL = 600
+# Jobs looked at when the first pending ones can't start
+LOOKAHEAD = 50
+# Seconds the limits are not enforced after a Redis error
+REDIS_RETRY_INTERVAL = 30
+
+# Takes a lease on every key or on none of them
+# KEYS: host sets, ARGV: member, expiry, now, limit for each key
+ACQUIRE_SCRIPT = """
+local member = ARGV[1]
+local expiry = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    if redis.call("ZSCORE", key, member) == false
+        and redis.call("ZCARD", key) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call("ZADD", key, expiry, member)
+    redis.call("EXPIRE", key, math.ceil(expiry - now))
+end
+return 1
+"""
+
+# (index, argv) of a job waiting to run
+PendingJob = Tuple[str, List[str]]
+
+
+def host_key(host: str) -> str:
+    return f"{HOST_LEASE_PREFIX}{host.lower()}"
+
+
+def job_hosts(argv: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    host1 and host2 of an imapsync command line
+    """
+    hosts: Dict[str, str] = {}
+    for index, arg in enumerate(argv[:-1]):
+        if arg in ("--host1", "--host2"):
+            hosts[arg] = argv[index + 1]
+    return hosts.get("--host1"), hosts.get("--host2")
+
+
+def parse_host_limits(config: Any) -> List[Tuple[Pattern[str], int]]:
+    """
+    Compiles the HOST_LIMITS config, malformed entries are discarded
+    """
+    limits: List[Tuple[Pattern[str], int]] = []
+    if not isinstance(config, list):
+        return limits
+    for entry in config:
+        try:
+            pattern, limit = entry
+            if not isinstance(limit, int) or limit < 1:
+                raise ValueError(f"Limit must be a positive integer, got {limit}")
+            limits.append((re.compile(pattern), limit))
+        except (TypeError, ValueError, re.error) as e:
+            logger.warning("Ignoring malformed host limit %s: %s", entry, e)
+    return limits
+
+
+class HostLimiter:
+    """
+    Takes and releases the leases of the jobs of a single task
+    """
+
+    def __init__(self, client: Any, config: Any, owner: str) -> None:
+        self.client = client
+        self.limits = parse_host_limits(config)
+        # Prefixes the lease of every job, the task id
+        self.owner = owner
+        self.held: Dict[str, List[str]] = {}
+        self.last_refresh = time.time()
+        # Redis isn't used until then after an error
+        self.unavailable_until = 0.0
+        self._acquire = (
+            client.register_script(ACQUIRE_SCRIPT) if self.limits and client else None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self._acquire is not None
+
+    def limit_for(self, host: str) -> Optional[int]:
+        for pattern, limit in self.limits:
+            if pattern.match(host):
+                return limit
+        return None
+
+    def acquire(self, key: str, argv: List[str]) -> bool:
+        """
+        Takes a lease on the limited hosts of the job, False if any of them is full
+        """
+        if self._acquire is None:
+            return True
+        keys: List[str] = []
+        limits: List[int] = []
+        for host in set(filter(None, job_hosts(argv))):
+            limit = self.limit_for(host)
+            if limit is not None:
+                keys.append(host_key(host))
+                limits.append(limit)
+        if not keys:
+            return True
+        now = time.time()
+        if now < self.unavailable_until:
+            return True
+        member = f"{self.owner}:{key}"
+        try:
+            acquired = self._acquire(
+                keys=keys, args=[member, now + LEASE_TTL, now, *limits]
+            )
+        except RedisError as e:
+            self._unavailable("take a lease for", e)
+            return True
+        if not acquired:
+            return False
+        self.held[key] = keys
+        return True
+
+    def _unavailable(self, action: str, error: RedisError) -> None:
+        logger.warning(
+            "Can't %s the hosts of %s, not enforcing the limits for %ss: %s",
+            action,
+            self.owner,
+            REDIS_RETRY_INTERVAL,
+            error,
+        )
+        self.unavailable_until = time.time() + REDIS_RETRY_INTERVAL
+
+    def release(self, key: str) -> None:
+        keys = self.held.pop(key, None)
+        if keys:
+            member = f"{self.owner}:{key}"
+            try:
+                pipe = self.client.pipeline()
+                for host in keys:
+                    pipe.zrem(host, member)
+                pipe.execute()
+            except RedisError as e:
+                # The lease expires on its own
+                self._unavailable("release", e)
+
+    def refresh(self) -> None:
+        """
+        Extends the leases of the running jobs, only talks to Redis once
+        every third of LEASE_TTL
+        """
+        now = time.time()
+        if not self.held or now - self.last_refresh < LEASE_TTL / 3:
+            return
+        self.last_refresh = now
+        try:
+            pipe = self.client.pipeline()
+            for key, hosts in self.held.items():
+                for host in hosts:
+                    pipe.zadd(host, {f"{self.owner}:{key}": now + LEASE_TTL}, xx=True)
+                    pipe.expire(host, LEASE_TTL)
+            pipe.execute()
+        except RedisError as e:
+            # Tried again on the next refresh, before the leases expire
+            self._unavailable("refresh", e)
+
+    def release_all(self) -> None:
+        for key in list(self.held):
+            self.release(key)
+
+
+class HostScheduler:
+    """
+    Hands out the next job that can start, jobs whose hosts are full are skipped
+    (up to LOOKAHEAD of them) so they don't hold back jobs for other hosts
+
+    Jobs can be deferred until a given time (retries, migrator.utilites.retries),
+    they go ahead of the pending ones once due
+    """
+
+    def __init__(
+        self,
+        jobs: Iterable[PendingJob],
+        limiter: HostLimiter,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.jobs: Iterator[PendingJob] = iter(jobs)
+        self.limiter = limiter
+        self.clock = clock
+        self.pending: Deque[PendingJob] = deque()
+        # (due time, order, job) heap
+        self.deferred: List[Tuple[float, int, PendingJob]] = []
+        self.deferrals = 0
+        self.exhausted = False
+        # Set when pending jobs exist but none of them could start
+        self.blocked = False
+
+    def _fill(self) -> None:
+        due: List[PendingJob] = []
+        now = self.clock()
+        while self.deferred and self.deferred[0][0] <= now:
+            due.append(heapq.heappop(self.deferred)[2])
+        self.pending.extendleft(reversed(due))
+        while not self.exhausted and len(self.pending) < LOOKAHEAD:
+            try:
+                self.pending.append(next(self.jobs))
+            except StopIteration:
+                self.exhausted = True
+            # Without limits there is no point in reading ahead
+            if not self.limiter.enabled:
+                break
+
+    def defer(self, job: PendingJob, due: float) -> None:
+        """
+        Hands out <job> again once the clock reaches <due>
+        """
+        self.deferrals += 1
+        heapq.heappush(self.deferred, (due, self.deferrals, job))
+
+    def next_due(self) -> Optional[float]:
+        """
+        Seconds until the first deferred job is due, None without deferred jobs
+        """
+        if not self.deferred:
+            return None
+        return max(0.0, self.deferred[0][0] - self.clock())
+
+    def drop_deferred(self) -> List[PendingJob]:
+        """
+        Removes the deferred jobs (the task is cancelled) and returns them
+        """
+        jobs = [job for _, _, job in sorted(self.deferred)]
+        self.deferred.clear()
+        return jobs
+
+    def next_runnable(self) -> Optional[PendingJob]:
+        self._fill()
+        for position, (key, argv) in enumerate(self.pending):
+            if self.limiter.acquire(key, argv):
+                del self.pending[position]
+                self.blocked = False
+                return key, argv
+        self.blocked = bool(self.pending)
+        return None
+
+    @property
+    def done(self) -> bool:
+        self._fill()
+        return self.exhausted and not self.pending and not self.deferred
@@ -0,0 +1,182 @@
+"""
+Redis list used to hand jobs from the sync view to call_system while the input is still
+being parsed, the view pushes batches to the list and the task reads them in order
+
+The jobs include the passwords so the list is deleted as soon as the task read all of it
+(delete_queued_jobs), JOB_QUEUE_TTL seconds after the last batch otherwise. The jobs are
+also saved with the task (migrator.tasks.save_jobs), requeue_jobs fills the list again
+to resume the task
+"""
+import json
+import logging
+import time
+from typing import Any, AsyncIterable, Callable, Generator, List, Optional
+
+import redis
+from redis import asyncio as aioredis
+from django.conf import settings
+
+from core.jobs import Job, JobDict
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_PREFIX = "pymap:jobs:"
+JOB_QUEUE_TTL = 7 * 24 * 60 * 60
+# Jobs read from the list at once by the task
+READ_BATCH_SIZE = 200
+POLL_INTERVAL = 0.5
+# Gives up on a queue that received nothing and was never closed (crashed producer)
+INGEST_TIMEOUT = 600
+
+
+def queue_key(task_id: str) -> str:
+    return f"{JOB_QUEUE_PREFIX}{task_id}"
+
+
+def done_key(task_id: str) -> str:
+    """
+    Set to the total number of jobs once the producer pushed the last batch
+    """
+    return f"{JOB_QUEUE_PREFIX}{task_id}:done"
+
+
+def get_redis(url: Optional[str] = None) -> Any:
+    return redis.Redis.from_url(url if url else settings.CELERY_BROKER_URL)
+
+
+def get_async_redis(url: Optional[str] = None) -> Any:
+    return aioredis.Redis.from_url(url if url else settings.CELERY_BROKER_URL)
+
+
+async def enqueue_jobs(
+    client: Any,
+    task_id: str,
+    batches: AsyncIterable[List[Job]],
+    on_first_batch: Optional[Callable[[], None]] = None,
+) -> int:
+    """
+    Pushes every batch to the task's list as soon as it is parsed, <on_first_batch>
+    is called after the first push (or at the end when there are no jobs) so the task
+    can be dispatched without waiting for the rest of the input
+
+    Returns the number of jobs pushed
+    """
+    key = queue_key(task_id)
+    total = 0
+    dispatched = False
+    try:
+        async for batch in batches:
+            await client.rpush(key, *[json.dumps(job.to_dict()) for job in batch])
+            total += len(batch)
+            if not dispatched and on_first_batch:
+                on_first_batch()
+                dispatched = True
+    finally:
+        # Also closed on errors so the task doesn't wait for jobs that will never come
+        await client.set(done_key(task_id), total, ex=JOB_QUEUE_TTL)
+        if total:
+            await client.expire(key, JOB_QUEUE_TTL)
+    if not dispatched and on_first_batch:
+        on_first_batch()
+    logger.debug("Queued %s jobs for %s", total, task_id)
+    return total
+
+
+async def stream_jobs(
+    task_id: str,
+    batches: AsyncIterable[List[Job]],
+    on_first_batch: Optional[Callable[[], None]] = None,
+    url: Optional[str] = None,
+) -> int:
+    """
+    enqueue_jobs with its own connection, meant to be called through async_to_sync
+    """
+    client = get_async_redis(url)
+    try:
+        return await enqueue_jobs(client, task_id, batches, on_first_batch)
+    finally:
+        await client.aclose()
+
+
+def queued_total(client: Any, task_id: str) -> int:
+    """
+    Number of jobs queued so far, final once the queue is closed
+    """
+    done = client.get(done_key(task_id))
+    if done is not None:
+        return int(done)
+    return int(client.llen(queue_key(task_id)))
+
+
+def iter_queued_jobs(
+    client: Any,
+    task_id: str,
+    batch_size: int = READ_BATCH_SIZE,
+    poll_interval: float = POLL_INTERVAL,
+    timeout: float = INGEST_TIMEOUT,
+) -> Generator[JobDict, None, None]:
+    """
+    Yields the queued jobs in order, waiting for new batches until the queue is closed
+    """
+    key = queue_key(task_id)
+    position = 0
+    last_read = time.monotonic()
+    while True:
+        items = client.lrange(key, position, position + batch_size - 1)
+        if items:
+            position += len(items)
+            for item in items:
+                try:
+                    yield json.loads(item)
+                except ValueError:
+                    logger.critical("Dropping a malformed job from %s", key)
+            # Measured from here, the caller may take a long time with each job
+            last_read = time.monotonic()
+            continue
+        done = client.get(done_key(task_id))
+        # A batch can be pushed between lrange and get, only stop when everything was read
+        if done is not None and position >= int(done):
+            return
+        if time.monotonic() - last_read > timeout:
+            logger.error(
+                "No jobs received for %s seconds, giving up on %s after %s jobs",
+                timeout,
+                key,
+                position,
+            )
+            return
+        time.sleep(poll_interval)
+
+
+def requeue_jobs(client: Any, task_id: str, jobs: List[(str | JobDict)]) -> int:
+    """
+    Replaces the task's list with <jobs> and closes it, for resuming streamed tasks
+    """
+    key = queue_key(task_id)
+    pipe = client.pipeline()
+    pipe.delete(key)
+    for start in range(0, len(jobs), READ_BATCH_SIZE):
+        pipe.rpush(
+            key, *[json.dumps(job) for job in jobs[start : start + READ_BATCH_SIZE]]
+        )
+    pipe.set(done_key(task_id), len(jobs), ex=JOB_QUEUE_TTL)
+    if jobs:
+        pipe.expire(key, JOB_QUEUE_TTL)
+    pipe.execute()
+    return len(jobs)
+
+
+def delete_queued_jobs(client: Any, task_id: str) -> None:
+    """
+    Deletes the task's list once it was read, the total (done_key) holds no jobs
+    and is kept until it expires
+    """
+    client.delete(queue_key(task_id))
+
+
+def read_queued_jobs(client: Any, task_id: str) -> List[JobDict]:
+    """
+    Every job that is still queued for the task, used to retry streamed tasks
+    saved before their jobs were kept with the task
+    """
+    return [json.loads(item) for item in client.lrange(queue_key(task_id), 0, -1)]
@@ -0,0 +1,165 @@
+"""
+Live progress of an account read from the stdout of its imapsync process
+
+The supervisor hands every chunk read from the child's pipe to an ImapsyncOutput,
+which splits it into lines with a bounded buffer and keeps only the counters it parses
+and the last TAIL_LINES lines, so a chatty child can't grow the worker's memory.
+Lines used, as printed by imapsync:
+    Host1 Nb messages:                    1234 messages
+    Host1 Total size:                123456789 bytes (117.738 MiB)
+    msg INBOX/12 {4567}        copied to INBOX/42     1.23 msgs/s  45.678 KiB/s ...
+        ... ETA: Mon Jun  3 14:02:18 2024  301 s  123/456 msgs left
+    Messages transferred           : 333
+    Total bytes transferred        : 1234567 (1.177 MiB)
+
+snapshot() is the compact form published per account (migrator.utilites.progress)
+"""
+import re
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# Longest line kept, the rest of a longer line is dropped
+MAX_LINE = 4096
+TAIL_LINES = 20
+# Characters of the last line in a snapshot
+LAST_LINE = 200
+
+HOST1_MESSAGES = re.compile(rb"^Host1 Nb messages:\s+(\d+)")
+HOST1_SIZE = re.compile(rb"^Host1 Total size:\s+(\d+) bytes")
+COPIED = re.compile(rb"^msg \S.*?\{(\d+)\}\s+copied to ")
+ETA = re.compile(rb"ETA: .*?\s(\d+) s\s+(\d+)/(\d+) msgs left")
+MESSAGES_TRANSFERRED = re.compile(rb"^Messages transferred\s*:\s*(\d+)")
+BYTES_TRANSFERRED = re.compile(rb"^Total bytes transferred\s*:\s*(\d+)")
+
+
+class LineBuffer:
+    """
+    Splits a stream of chunks into lines, holding at most MAX_LINE bytes
+    of the line that isn't complete yet
+    """
+
+    def __init__(self, max_line: int = MAX_LINE) -> None:
+        self.max_line = max_line
+        self.partial = bytearray()
+        # Set while dropping the rest of a line that was too long
+        self.truncated = False
+
+    def feed(self, data: bytes) -> List[bytes]:
+        lines: List[bytes] = []
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            self._append(data[start:end])
+            lines.append(bytes(self.partial).rstrip(b"\r"))
+            self.partial.clear()
+            self.truncated = False
+            start = end + 1
+        self._append(data[start:])
+        return lines
+
+    def _append(self, data: bytes) -> None:
+        if self.truncated:
+            return
+        room = self.max_line - len(self.partial)
+        if len(data) > room:
+            data = data[:room]
+            self.truncated = True
+        self.partial += data
+
+
+class ImapsyncOutput:
+    """
+    Counters of a single account, fed with the chunks of its stdout
+    """
+
+    def __init__(
+        self,
+        logfile: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+        tail_lines: int = TAIL_LINES,
+    ) -> None:
+        self.logfile = logfile
+        self.clock = clock
+        self.started_at = clock()
+        self.buffer = LineBuffer()
+        self.tail: Deque[str] = deque(maxlen=tail_lines)
+        self.messages = 0
+        self.bytes = 0
+        self.total_messages: Optional[int] = None
+        self.total_bytes: Optional[int] = None
+        # From the ETA of the last copied message
+        self.eta: Optional[int] = None
+        self.left: Optional[int] = None
+        self.to_copy: Optional[int] = None
+        # Set when new lines were parsed since the last snapshot
+        self.changed = False
+
+    def feed(self, data: bytes) -> None:
+        for line in self.buffer.feed(data):
+            self.parse_line(line)
+
+    def parse_line(self, line: bytes) -> None:
+        if not line:
+            return
+        self.tail.append(line.decode("utf-8", "replace"))
+        self.changed = True
+        copied = COPIED.match(line)
+        if copied:
+            self.messages += 1
+            self.bytes += int(copied.group(1))
+            eta = ETA.search(line)
+            if eta:
+                self.eta = int(eta.group(1))
+                self.left = int(eta.group(2))
+                self.to_copy = int(eta.group(3))
+            return
+        for pattern, field in (
+            (HOST1_MESSAGES, "total_messages"),
+            (HOST1_SIZE, "total_bytes"),
+        ):
+            match = pattern.match(line)
+            if match:
+                setattr(self, field, int(match.group(1)))
+                return
+        # The summary has the exact counts
+        transferred = MESSAGES_TRANSFERRED.match(line)
+        if transferred:
+            self.messages = int(transferred.group(1))
+            self.left = 0
+            self.eta = 0
+            return
+        transferred = BYTES_TRANSFERRED.match(line)
+        if transferred:
+            self.bytes = int(transferred.group(1))
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.to_copy:
+            return round(100 * (self.to_copy - (self.left or 0)) / self.to_copy, 1)
+        if self.left == 0:
+            return 100.0
+        if self.total_bytes:
+            return round(min(100.0, 100 * self.bytes / self.total_bytes), 1)
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Compact progress of the account, rates are averages since it started
+        """
+        self.changed = False
+        elapsed = max(self.clock() - self.started_at, 1e-3)
+        return {
+            "logfile": self.logfile,
+            "messages": self.messages,
+            "total_messages": self.total_messages,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "messages_per_second": round(self.messages / elapsed, 2),
+            "bytes_per_second": round(self.bytes / elapsed),
+            "percent": self.percent,
+            "eta": self.eta,
+            "last_line": self.tail[-1][:LAST_LINE] if self.tail else None,
+        }
@@ -0,0 +1,266 @@
+"""
+Verification of the IMAP logins of the jobs before their imapsync runs
+
+A wrong password is otherwise only found once imapsync started, connected and exited
+with 16/161/162, holding a slot for the whole time. The preflight logs in (and out)
+with the credentials of both sides of every job in parallel, at most PER_HOST logins
+per host at once so a stage with thousands of accounts doesn't look like an attack.
+Jobs with a login rejected by the server are reported with imapsync's code (161 for
+host1, 162 for host2) without running, servers that can't be reached don't filter
+anything out, imapsync gets to try (and fail with its own code). Logins that can't be
+tried (credentials LOGIN can't send, unexpected errors) are LOGIN_UNVERIFIED and run too
+
+Connections follow imapsync's defaults: SSL on port 993 unless --nossl1/--tls1 or a
+--port1 other than 993 is given (same for host2), certificates are not verified.
+Jobs with --passfile1/2 or --authmech1/2 can't be verified and always run
+
+Configured by the "PREFLIGHT" key of the config file, every key is optional:
+    "PREFLIGHT": {"WORKERS": 16, "PER_HOST": 4, "TIMEOUT": 15}
+"""
+import imaplib
+import logging
+import ssl
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+IMAP_PORT = 143
+IMAPS_PORT = 993
+
+LOGIN_OK = "ok"
+LOGIN_REJECTED = "rejected"
+LOGIN_UNREACHABLE = "unreachable"
+LOGIN_UNVERIFIED = "unverified"
+
+# imapsync's "Failed to authenticate user1/2" (migrator.utilites.strings.IMAPSYNC_CODES)
+REJECTED_CODES = (161, 162)
+
+# Options that make the login differ from a plain LOGIN with --passwordN
+UNVERIFIABLE_OPTIONS = ("--passfile", "--authmech", "--authuser", "--oauthaccesstoken")
+
+
+class Login(NamedTuple):
+    host: str
+    port: int
+    user: str
+    password: str
+    ssl: bool = True
+    starttls: bool = False
+
+
+class PreflightConfig(NamedTuple):
+    # Logins running at once
+    workers: int = 16
+    per_host: int = 4
+    # Seconds to connect and for every response
+    timeout: float = 15.0
+
+
+def _options(argv: List[str]) -> Dict[str, Optional[str]]:
+    """
+    "--name value" and "--name=value" options of an imapsync command, flags map to None
+    """
+    options: Dict[str, Optional[str]] = {}
+    position = 1
+    while position < len(argv):
+        arg = argv[position]
+        position += 1
+        if not arg.startswith("--"):
+            continue
+        name, equals, value = arg.partition("=")
+        if equals:
+            options[name] = value
+        elif position < len(argv) and not argv[position].startswith("--"):
+            options[name] = argv[position]
+            position += 1
+        else:
+            options[name] = None
+    return options
+
+
+def job_logins(argv: List[str]) -> Tuple[Optional[Login], Optional[Login]]:
+    """
+    Login of host1 and host2 of an imapsync command, None for a side
+    that can't be verified
+    """
+    options = _options(argv)
+
+    def side(number: int) -> Optional[Login]:
+        host = options.get(f"--host{number}")
+        user = options.get(f"--user{number}")
+        password = options.get(f"--password{number}")
+        if not host or not user or password is None:
+            return None
+        if any(f"{option}{number}" in options for option in UNVERIFIABLE_OPTIONS):
+            return None
+        starttls = f"--tls{number}" in options
+        plain = starttls or f"--nossl{number}" in options
+        port = options.get(f"--port{number}")
+        if port is not None:
+            try:
+                number_port = int(port)
+            except ValueError:
+                return None
+            plain = plain or (
+                number_port != IMAPS_PORT and f"--ssl{number}" not in options
+            )
+        else:
+            number_port = IMAP_PORT if plain else IMAPS_PORT
+        return Login(host, number_port, user, password, not plain, starttls)
+
+    return side(1), side(2)
+
+
+def _ssl_context() -> ssl.SSLContext:
+    # Same as imapsync, which doesn't verify certificates by default
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def check_login(login: Login, timeout: float) -> str:
+    """
+    Logs in and out, returns LOGIN_OK, LOGIN_REJECTED, LOGIN_UNREACHABLE or
+    LOGIN_UNVERIFIED
+    """
+    try:
+        if login.ssl:
+            connection: imaplib.IMAP4 = imaplib.IMAP4_SSL(
+                login.host, login.port, ssl_context=_ssl_context(), timeout=timeout
+            )
+        else:
+            connection = imaplib.IMAP4(login.host, login.port, timeout=timeout)
+    except (OSError, imaplib.IMAP4.error) as e:
+        logger.info("Can't connect to %s:%s: %s", login.host, login.port, e)
+        return LOGIN_UNREACHABLE
+    try:
+        if login.starttls:
+            try:
+                connection.starttls(_ssl_context())
+            except (OSError, imaplib.IMAP4.error) as e:
+                logger.info("Can't start TLS with %s:%s: %s", login.host, login.port, e)
+                return LOGIN_UNREACHABLE
+        connection.login(login.user, login.password)
+    except imaplib.IMAP4.abort as e:
+        logger.info("Lost the connection to %s: %s", login.host, e)
+        return LOGIN_UNREACHABLE
+    except imaplib.IMAP4.error as e:
+        logger.info("Login of %s rejected by %s: %s", login.user, login.host, e)
+        return LOGIN_REJECTED
+    except OSError as e:
+        logger.info("Lost the connection to %s: %s", login.host, e)
+        return LOGIN_UNREACHABLE
+    except UnicodeEncodeError:
+        # imaplib only sends ASCII arguments, imapsync can still log in
+        logger.info("Can't send the credentials of %s to %s", login.user, login.host)
+        return LOGIN_UNVERIFIED
+    finally:
+        try:
+            connection.logout()
+        except (OSError, imaplib.IMAP4.error):
+            pass
+    return LOGIN_OK
+
+
+def verify_logins(
+    jobs: Iterable[Tuple[str, List[str]]],
+    config: PreflightConfig = PreflightConfig(),
+    check: Callable[[Login, float], str] = check_login,
+) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Outcome of the login of both sides of every (key, argv) job, None for the sides
+    that can't be verified. Every distinct login is only tried once
+    """
+    logins: Dict[str, Tuple[Optional[Login], Optional[Login]]] = {
+        key: job_logins(argv) for key, argv in jobs
+    }
+    # Logins waiting to be tried, by host
+    by_host: Dict[str, Deque[Login]] = {}
+    seen = set()
+    for pair in logins.values():
+        for login in pair:
+            if login is None or login in seen:
+                continue
+            seen.add(login)
+            by_host.setdefault(login.host.lower(), deque()).append(login)
+    outcomes: Dict[Login, str] = {}
+
+    def lane(queue: Deque[Login]) -> None:
+        # A host has at most PER_HOST lanes, each tries its logins one at a time
+        while True:
+            try:
+                login = queue.popleft()
+            except IndexError:
+                return
+            try:
+                outcomes[login] = check(login, config.timeout)
+            except Exception:
+                # The job runs as if there were no preflight
+                logger.exception("Can't verify %s on %s", login.user, login.host)
+                outcomes[login] = LOGIN_UNVERIFIED
+
+    if by_host:
+        with ThreadPoolExecutor(
+            max_workers=config.workers, thread_name_prefix="preflight"
+        ) as pool:
+            futures = [
+                pool.submit(lane, queue)
+                for queue in by_host.values()
+                for _ in range(min(config.per_host, len(queue)))
+            ]
+            for future in futures:
+                future.result()
+    return {
+        key: (
+            None if host1 is None else outcomes[host1],
+            None if host2 is None else outcomes[host2],
+        )
+        for key, (host1, host2) in logins.items()
+    }
+
+
+def rejected_code(outcome: Tuple[Optional[str], Optional[str]]) -> Optional[int]:
+    """
+    Return code reported for a job whose login was rejected, None when it can run
+    """
+    for code, side in zip(REJECTED_CODES, outcome):
+        if side == LOGIN_REJECTED:
+            return code
+    return None
+
+
+def _positive(config: Dict[str, Any], key: str, default: float) -> float:
+    value = config.get(key, default)
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0:
+        logger.warning("Ignoring PREFLIGHT %s, expected a positive number", key)
+        return default
+    return value
+
+
+def parse_preflight(config: Any) -> PreflightConfig:
+    """
+    Reads the PREFLIGHT config, malformed entries are replaced by their default
+    """
+    if not isinstance(config, dict):
+        if config is not None:
+            logger.warning("Ignoring PREFLIGHT, expected an object")
+        return PreflightConfig()
+    defaults = PreflightConfig()
+    return PreflightConfig(
+        workers=int(_positive(config, "WORKERS", defaults.workers)),
+        per_host=int(_positive(config, "PER_HOST", defaults.per_host)),
+        timeout=float(_positive(config, "TIMEOUT", defaults.timeout)),
+    )
@@ -0,0 +1,225 @@
+"""
+Progress of call_system published as deltas
+
+Instead of rewriting the whole state on every change, the task collects what changed
+and pushes it to a Redis list at most once every INTERVAL seconds. Every delta is
+additive so a task and its distributed subtasks can publish to the same list:
+    {"total": 2, "started": 3, "finished": {"4": [0, 1717171717.1]}, "status": null}
+
+Readers fold the deltas into a ProgressState, a reader that keeps its state (or its
+position, "seq") only has to read the deltas published since the last time
+
+The live progress of every account (migrator.utilites.output) is not a delta, the last
+snapshot of the accounts that changed is written to a hash with the same interval
+
+Configured by the "PROGRESS_INTERVAL" key of the config file, in seconds
+"""
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_PREFIX = "pymap:progress:"
+ACCOUNTS_PREFIX = "pymap:accounts:"
+PROGRESS_TTL = 7 * 24 * 60 * 60
+DEFAULT_INTERVAL = 2.0
+
+Delta = Dict[str, Any]
+
+
+def progress_key(task_id: str) -> str:
+    return f"{PROGRESS_PREFIX}{task_id}"
+
+
+def accounts_key(task_id: str) -> str:
+    return f"{ACCOUNTS_PREFIX}{task_id}"
+
+
+def clear_progress(client: Any, task_id: str) -> None:
+    """
+    Drops the deltas of a task, for tasks that are resumed under the same id
+    """
+    client.delete(progress_key(task_id), accounts_key(task_id))
+
+
+class ProgressPublisher:
+    """
+    Collects the changes of a task and publishes them as a single delta per interval
+
+    Usage:
+        progress = ProgressPublisher(client, task_id, interval)
+        progress.add_jobs(1)
+        progress.started()
+        progress.finished("0", 0, time.time())
+        progress.account("0", {"messages": 10, "percent": 100.0})
+        if progress.flush():
+            ...  # a delta was published
+        progress.flush(status="SUCCESS")
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        task_id: str,
+        interval: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.client = client
+        self.key = progress_key(task_id)
+        self.accounts_key = accounts_key(task_id)
+        self.interval = DEFAULT_INTERVAL if interval is None else float(interval)
+        self.clock = clock
+        self.last_flush: Optional[float] = None
+        self.published = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self.total = 0
+        self.started_count = 0
+        self.finished_jobs: Dict[str, List[Any]] = {}
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+
+    def add_jobs(self, count: int = 1) -> None:
+        self.total += count
+
+    def started(self, count: int = 1) -> None:
+        self.started_count += count
+
+    def finished(self, key: str, returncode: int, exited_at: float) -> None:
+        self.finished_jobs[key] = [returncode, round(exited_at, 3)]
+
+    def account(self, key: str, snapshot: Dict[str, Any]) -> None:
+        """
+        Live progress of a job, replaces the previous one
+        """
+        self.accounts[key] = snapshot
+
+    @property
+    def dirty(self) -> bool:
+        return bool(
+            self.total or self.started_count or self.finished_jobs or self.accounts
+        )
+
+    def flush(self, status: Optional[str] = None, force: bool = False) -> bool:
+        """
+        Publishes the pending changes if INTERVAL seconds passed since the last delta
+        (right away with <force>), a status is always published.
+        Returns True when a delta was published
+        """
+        now = self.clock()
+        if status is None:
+            if not self.dirty:
+                return False
+            if (
+                not force
+                and self.last_flush is not None
+                and now - self.last_flush < self.interval
+            ):
+                return False
+        delta: Delta = {
+            "total": self.total,
+            "started": self.started_count,
+            "finished": self.finished_jobs,
+            "status": status,
+        }
+        # Only the accounts changed, readers of the deltas have nothing new
+        accounts_only = status is None and not (
+            self.total or self.started_count or self.finished_jobs
+        )
+        if self.client is not None:
+            try:
+                pipe = self.client.pipeline()
+                if not accounts_only:
+                    pipe.rpush(self.key, json.dumps(delta))
+                    pipe.expire(self.key, PROGRESS_TTL)
+                if self.accounts:
+                    pipe.hset(
+                        self.accounts_key,
+                        mapping={
+                            key: json.dumps(snapshot)
+                            for key, snapshot in self.accounts.items()
+                        },
+                    )
+                    pipe.expire(self.accounts_key, PROGRESS_TTL)
+                pipe.execute()
+            except RedisError as e:
+                # Kept for the next flush, deltas add up
+                logger.warning("Failed to publish the progress of %s: %s", self.key, e)
+                return False
+        if not accounts_only:
+            self.published += 1
+        self.last_flush = now
+        self._reset()
+        return True
+
+
+class ProgressState:
+    """
+    Current progress of a task, built from its deltas
+    """
+
+    def __init__(self) -> None:
+        # Number of deltas applied, the position of the next one in the list
+        self.seq = 0
+        self.total = 0
+        self.started = 0
+        self.return_codes: Dict[str, int] = {}
+        self.exit_times: Dict[str, float] = {}
+        self.status: Optional[str] = None
+
+    def apply(self, delta: Delta) -> None:
+        self.seq += 1
+        self.total += delta.get("total", 0)
+        self.started += delta.get("started", 0)
+        for key, (returncode, exited_at) in delta.get("finished", {}).items():
+            self.return_codes[key] = returncode
+            self.exit_times[key] = exited_at
+        if delta.get("status"):
+            self.status = delta["status"]
+
+    @property
+    def processing(self) -> int:
+        return max(0, self.started - len(self.return_codes))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Same fields as a delta, a state read from a later "seq" can be added
+        to an earlier one the same way
+        """
+        return {
+            "seq": self.seq,
+            "total": self.total,
+            "started": self.started,
+            "return_codes": self.return_codes,
+            "exit_times": self.exit_times,
+            "status": self.status,
+        }
+
+
+def read_progress(
+    client: Any, task_id: str, state: Optional[ProgressState] = None, since: int = 0
+) -> ProgressState:
+    """
+    Applies the deltas published after <state>, without it the deltas
+    from position <since> are combined into a new state
+    """
+    if state is None:
+        state = ProgressState()
+        state.seq = since
+    for delta in client.lrange(progress_key(task_id), state.seq, -1):
+        state.apply(json.loads(delta))
+    return state
+
+
+def read_accounts(client: Any, task_id: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Last snapshot of every account of a task that printed progress, by job key
+    """
+    return {
+        (key.decode() if isinstance(key, bytes) else key): json.loads(snapshot)
+        for key, snapshot in client.hgetall(accounts_key(task_id)).items()
+    }
@@ -0,0 +1,121 @@
+"""
+CPU and memory used by the imapsync processes of a task
+
+Children are reaped with os.wait4, which returns the rusage of the child along with
+its exit status. Under the gevent pool with os monkey patched, gevent reaps the
+children itself from its SIGCHLD handler and wait4 fails with ECHILD, the usage is
+then the last sample of /proc/<pid> taken while the child ran, which misses what it
+used after that sample (at most SAMPLE_INTERVAL seconds, migrator.utilites.supervisor)
+
+Times are in seconds and memory in KiB (ru_maxrss and VmHWM on Linux)
+"""
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+CLOCK_TICKS: int = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class ResourceUsage(NamedTuple):
+    user_cpu: float
+    system_cpu: float
+    # Peak resident set size
+    max_rss: int
+    # "wait4" or "proc"
+    source: str
+
+    @property
+    def cpu(self) -> float:
+        return self.user_cpu + self.system_cpu
+
+
+def from_rusage(rusage: Any) -> ResourceUsage:
+    return ResourceUsage(
+        round(rusage.ru_utime, 3), round(rusage.ru_stime, 3), rusage.ru_maxrss, "wait4"
+    )
+
+
+def read_proc_usage(pid: int, proc_root: str = "/proc") -> Optional[ResourceUsage]:
+    """
+    Current usage of a running process, None when it's gone or /proc isn't available
+    """
+    try:
+        stat = Path(proc_root, str(pid), "stat").read_text()
+        status = Path(proc_root, str(pid), "status").read_text()
+    except OSError:
+        return None
+    # The name can contain spaces and parentheses, the fields start after the last ")"
+    fields = stat.rsplit(")", 1)[-1].split()
+    try:
+        # utime and stime are the 14th and 15th fields, the 3rd one (state) is first here
+        user_ticks, system_ticks = int(fields[11]), int(fields[12])
+    except (IndexError, ValueError):
+        logger.debug("Unexpected contents in /proc/%s/stat", pid)
+        return None
+    max_rss = 0
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            max_rss = int(line.split()[1])
+            break
+    return ResourceUsage(
+        round(user_ticks / CLOCK_TICKS, 3),
+        round(system_ticks / CLOCK_TICKS, 3),
+        max_rss,
+        "proc",
+    )
+
+
+class ResourceTotals:
+    """
+    Usage of every account of a task added up, with the account that used the most
+    memory. Totals of distributed subtasks are combined with merge
+    """
+
+    def __init__(self) -> None:
+        self.accounts = 0
+        # Accounts without a usage (reaped before their first sample)
+        self.unmeasured = 0
+        self.user_cpu = 0.0
+        self.system_cpu = 0.0
+        self.wall_time = 0.0
+        self.max_rss = 0
+        self.max_rss_key: Optional[str] = None
+
+    def add(self, key: str, usage: Optional[ResourceUsage], wall_time: float) -> None:
+        self.accounts += 1
+        self.wall_time += wall_time
+        if usage is None:
+            self.unmeasured += 1
+            return
+        self.user_cpu += usage.user_cpu
+        self.system_cpu += usage.system_cpu
+        if usage.max_rss > self.max_rss:
+            self.max_rss = usage.max_rss
+            self.max_rss_key = key
+
+    def merge(self, totals: Dict[str, Any]) -> None:
+        """
+        Adds the to_dict of other totals
+        """
+        self.accounts += totals.get("accounts", 0)
+        self.unmeasured += totals.get("unmeasured", 0)
+        self.user_cpu += totals.get("user_cpu", 0.0)
+        self.system_cpu += totals.get("system_cpu", 0.0)
+        self.wall_time += totals.get("wall_time", 0.0)
+        if totals.get("max_rss", 0) > self.max_rss:
+            self.max_rss = totals["max_rss"]
+            self.max_rss_key = totals.get("max_rss_key")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "accounts": self.accounts,
+            "unmeasured": self.unmeasured,
+            "user_cpu": round(self.user_cpu, 3),
+            "system_cpu": round(self.system_cpu, 3),
+            "wall_time": round(self.wall_time, 3),
+            "max_rss": self.max_rss,
+            "max_rss_key": self.max_rss_key,
+        }
@@ -0,0 +1,158 @@
+"""
+Retries of the accounts whose imapsync exited with a transient error
+
+An account that exits with one of the retryable codes (connection failures by default)
+is started again by the same task instead of ending up in its results, up to
+MAX_ATTEMPTS runs in total. The n-th retry waits a random delay between half and all
+of min(MAX_DELAY, BASE_DELAY * 2 ** (n - 1)) seconds (exponential backoff with
+jitter, so the accounts of a host that went down don't all reconnect at once).
+While it waits the account doesn't hold a slot, it's deferred in the task's
+scheduler (migrator.utilites.host_limits.HostScheduler)
+
+Every run of an account is kept in its AttemptHistory and saved as a checkpoint
+
+Configured by the "RETRIES" key of the config file, every key is optional:
+    "RETRIES": {
+        "CODES": [6, 10, 101, 102],
+        "MAX_ATTEMPTS": 3,        1 disables the retries
+        "BASE_DELAY": 30,         seconds
+        "MAX_DELAY": 600
+    }
+"""
+import logging
+import random
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# Received exit signal, connection failure, failed to connect on host1/host2
+# (migrator.utilites.strings.IMAPSYNC_CODES)
+DEFAULT_CODES = frozenset({6, 10, 101, 102})
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BASE_DELAY = 30.0
+DEFAULT_MAX_DELAY = 600.0
+
+
+class RetryPolicy(NamedTuple):
+    codes: FrozenSet[int] = DEFAULT_CODES
+    # Runs of an account, counting the first one
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    base_delay: float = DEFAULT_BASE_DELAY
+    max_delay: float = DEFAULT_MAX_DELAY
+
+    def should_retry(self, returncode: int, attempt: int) -> bool:
+        """
+        Whether an account that exited with <returncode> on its <attempt>-th run
+        (starting at 1) runs again
+        """
+        return returncode in self.codes and attempt < self.max_attempts
+
+    def delay(
+        self, attempt: int, random_float: Callable[[], float] = random.random
+    ) -> float:
+        """
+        Seconds before the run that follows the <attempt>-th one
+        """
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return ceiling / 2 + random_float() * ceiling / 2
+
+
+class Attempt(NamedTuple):
+    returncode: int
+    # Epoch timestamps
+    started_at: float
+    exited_at: float
+    # Seconds waited before the next attempt, None for the last one
+    retry_in: Optional[float] = None
+
+
+class AttemptHistory:
+    """
+    Runs of every account of a task, by job key
+    """
+
+    def __init__(self) -> None:
+        self.attempts: Dict[str, List[Attempt]] = {}
+
+    def count(self, key: str) -> int:
+        return len(self.attempts.get(key, []))
+
+    def add(
+        self,
+        key: str,
+        returncode: int,
+        started_at: float,
+        exited_at: float,
+        retry_in: Optional[float] = None,
+    ) -> int:
+        """
+        Records a run of <key>, returns its attempt number
+        """
+        self.attempts.setdefault(key, []).append(
+            Attempt(
+                returncode,
+                round(started_at, 3),
+                round(exited_at, 3),
+                None if retry_in is None else round(retry_in, 3),
+            )
+        )
+        return len(self.attempts[key])
+
+    def last(self, key: str) -> Optional[Attempt]:
+        attempts = self.attempts.get(key)
+        return attempts[-1] if attempts else None
+
+    def retried(self) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        History of the accounts that ran more than once, for the task results
+        """
+        return {
+            key: [attempt._asdict() for attempt in attempts]
+            for key, attempts in self.attempts.items()
+            if len(attempts) > 1
+        }
+
+
+def _number(config: Dict[str, Any], key: str, default: float, minimum: float) -> float:
+    value = config.get(key, default)
+    if (
+        not isinstance(value, (int, float))
+        or isinstance(value, bool)
+        or value < minimum
+    ):
+        logger.warning("Ignoring RETRIES %s, expected a number from %s", key, minimum)
+        return default
+    return value
+
+
+def parse_retry_policy(config: Any) -> RetryPolicy:
+    """
+    Reads the RETRIES config, malformed entries are replaced by their default
+    """
+    if config is None:
+        return RetryPolicy()
+    if not isinstance(config, dict):
+        logger.warning("Ignoring RETRIES, expected an object")
+        return RetryPolicy()
+    codes = config.get("CODES", DEFAULT_CODES)
+    if not isinstance(codes, (list, frozenset)) or not all(
+        isinstance(code, int) and not isinstance(code, bool) for code in codes
+    ):
+        logger.warning("Ignoring RETRIES CODES, expected a list of exit codes")
+        codes = DEFAULT_CODES
+    max_attempts = config.get("MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    if (
+        not isinstance(max_attempts, int)
+        or isinstance(max_attempts, bool)
+        or max_attempts < 1
+    ):
+        logger.warning("Ignoring RETRIES MAX_ATTEMPTS, expected a positive integer")
+        max_attempts = DEFAULT_MAX_ATTEMPTS
+    base_delay = _number(config, "BASE_DELAY", DEFAULT_BASE_DELAY, 0)
+    max_delay = _number(config, "MAX_DELAY", DEFAULT_MAX_DELAY, 0)
+    return RetryPolicy(
+        frozenset(codes),
+        max_attempts,
+        float(base_delay),
+        float(max(base_delay, max_delay)),
+    )
@@ -0,0 +1,161 @@
+"""
+Longest job first ordering of the accounts of a task
+
+The duration of every account is estimated, in order of preference, from:
+    - previous runs of the same account pair (same log file name)
+    - its size hint, at the throughput measured on previous runs that had one
+    - previous runs of accounts of the same source domain
+    - the average of every previous run, DEFAULT_DURATION without any history
+and the accounts are started from the longest to the shortest, so a large mailbox
+doesn't start last and keep the task running alone (LPT scheduling). Jobs that are
+still being read (queued tasks) are only ordered within windows of consecutive jobs,
+so the first ones start without waiting for the rest
+
+The predicted makespan is a simulation of that order on the task's slots,
+makespan_report compares it with what actually happened
+"""
+import heapq
+import itertools
+import logging
+from statistics import median
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds assumed for an account when there is no history at all
+DEFAULT_DURATION = 60.0
+# Used for size hints until there is history with sizes, ~1MB/s
+DEFAULT_BYTES_PER_SECOND = 1024.0**2
+
+# Where an estimate came from
+SOURCES = ("history", "size", "domain", "average", "default")
+
+
+def logfile_domain(logfile: str) -> Optional[str]:
+    """
+    Domain of the source account of "{host1}__{host2}__{user1}--{user2}.log"
+    """
+    parts = logfile.split("__", 2)
+    if len(parts) != 3:
+        return None
+    user1 = parts[2].split("--", 1)[0]
+    _, at, domain = user1.rpartition("@")
+    return domain.lower() if at and domain else None
+
+
+class DurationEstimator:
+    def __init__(
+        self,
+        pairs: Optional[Mapping[str, Sequence[float]]] = None,
+        domains: Optional[Mapping[str, float]] = None,
+        bytes_per_second: Optional[float] = None,
+        average: Optional[float] = None,
+    ) -> None:
+        # Durations of previous runs per log file
+        self.pairs = pairs or {}
+        # Average duration per source domain
+        self.domains = domains or {}
+        self.bytes_per_second = bytes_per_second or DEFAULT_BYTES_PER_SECOND
+        # Average duration of every previous run
+        self.average = average
+
+    def estimate(
+        self, logfile: Optional[str], size: Optional[int]
+    ) -> Tuple[float, str]:
+        """
+        Expected seconds for an account and the source of the estimate
+        """
+        if logfile and self.pairs.get(logfile):
+            return float(median(self.pairs[logfile])), "history"
+        if size is not None:
+            return size / self.bytes_per_second, "size"
+        domain = logfile_domain(logfile) if logfile else None
+        if domain and domain in self.domains:
+            return self.domains[domain], "domain"
+        if self.average:
+            return self.average, "average"
+        return DEFAULT_DURATION, "default"
+
+
+def longest_first(jobs: Iterable[T], estimate: Callable[[T], float]) -> List[T]:
+    """
+    Jobs sorted by decreasing estimate, equal estimates keep their order
+    """
+    return sorted(jobs, key=estimate, reverse=True)
+
+
+def windows(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    Consecutive lists of up to <size> items, each one read when it's needed
+    """
+    iterator = iter(items)
+    while True:
+        window = list(itertools.islice(iterator, max(1, size)))
+        if not window:
+            return
+        yield window
+
+
+def predict_makespan(durations: Iterable[float], slots: int) -> float:
+    """
+    Time to run <durations> in order on <slots> parallel slots, each job starting
+    on the first slot that frees up
+    """
+    finish_times = [0.0] * max(1, slots)
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+def makespan_report(
+    predicted: Mapping[str, float],
+    started: Mapping[str, float],
+    exited: Mapping[str, float],
+    slots: int,
+    sources: Optional[Mapping[str, str]] = None,
+) -> Dict[str, object]:
+    """
+    Predicted and actual makespan of the jobs that ran, with the error of the
+    per job estimates. <started> and <exited> are epoch times per job key
+    """
+    # In the order they started, which is the order that is simulated
+    ran = sorted(
+        (key for key in exited if key in started and key in predicted),
+        key=lambda key: started[key],
+    )
+    report: Dict[str, object] = {
+        "jobs": len(ran),
+        "slots": slots,
+        "predicted_makespan": round(
+            predict_makespan((predicted[key] for key in ran), slots), 1
+        ),
+        "actual_makespan": None,
+        "mean_absolute_error": None,
+        "sources": {},
+    }
+    if not ran:
+        return report
+    report["actual_makespan"] = round(
+        max(exited[key] for key in ran) - min(started[key] for key in ran), 1
+    )
+    errors = [abs(exited[key] - started[key] - predicted[key]) for key in ran]
+    report["mean_absolute_error"] = round(sum(errors) / len(errors), 1)
+    counts: Dict[str, int] = {}
+    for key in ran:
+        source = (sources or {}).get(key, "default")
+        counts[source] = counts.get(source, 0) + 1
+    report["sources"] = counts
+    return report
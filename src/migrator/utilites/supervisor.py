@@ -0,0 +1,348 @@
+"""
+Runs the imapsync processes of a task and reaps them as soon as they exit
+
+On Linux every child gets a pidfd (os.pidfd_open) which becomes readable when the child
+exits, so waiting is a single selector call that returns the moment a slot is free.
+Where pidfds aren't available the children are polled every POLL_INTERVAL seconds instead
+
+Other file descriptors can be watched to wake the waiting task early,
+ex: the subscription to the task's cancellations (migrator.utilites.cancellation)
+
+The stdout of a child can be handed to a callback as it is written (spawn's <output>),
+its pipe is read in the same selector call without waking the caller
+
+Children are reaped with os.wait4 so their CPU and memory usage is known
+(migrator.utilites.resources), when something else reaps them first (gevent) the
+running children are sampled from /proc every SAMPLE_INTERVAL seconds instead
+
+Under the gevent worker pool the selectors module is monkey patched,
+so waiting only blocks the current greenlet
+"""
+import logging
+import os
+import selectors
+import subprocess
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from migrator.utilites.child_limits import ChildLimits
+from migrator.utilites.resources import ResourceUsage, from_rusage, read_proc_usage
+
+logger = logging.getLogger(__name__)
+
+
+class ChildExit(NamedTuple):
+    key: str
+    pid: int
+    returncode: int
+    # Epoch timestamps
+    started_at: float
+    exited_at: float
+    # None when the child couldn't be measured
+    usage: Optional[ResourceUsage] = None
+
+    @property
+    def duration(self) -> float:
+        return self.exited_at - self.started_at
+
+
+class Child(NamedTuple):
+    proc: "subprocess.Popen[bytes]"
+    started_at: float
+    # None when the child is polled
+    pidfd: Optional[int]
+
+
+class OutputKey(NamedTuple):
+    # Selector data of the stdout of a child
+    key: str
+
+
+def pidfd_supported() -> bool:
+    return hasattr(os, "pidfd_open")
+
+
+def children_reaped_elsewhere() -> bool:
+    """
+    True when gevent reaps the children (os monkey patched), wait4 can't see them
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return bool(monkey.is_module_patched("os"))
+
+
+class ProcessSupervisor:
+    """
+    Keeps track of the running children of a task
+
+    Usage:
+        supervisor = ProcessSupervisor()
+        supervisor.spawn("0", ["imapsync", ...])
+        for child_exit in supervisor.wait(timeout=10):
+            ...
+    """
+
+    # Only used for children without a pidfd
+    POLL_INTERVAL: float = 0.1
+    # Only used when the children can't be reaped with wait4
+    SAMPLE_INTERVAL: float = 5.0
+    # Bytes read from a child's stdout at once
+    READ_SIZE: int = 65536
+
+    def __init__(
+        self, use_pidfd: Optional[bool] = None, sample_proc: Optional[bool] = None
+    ) -> None:
+        self.use_pidfd = pidfd_supported() if use_pidfd is None else use_pidfd
+        self.sample_proc = (
+            children_reaped_elsewhere() if sample_proc is None else sample_proc
+        )
+        self.selector = selectors.DefaultSelector()
+        self.children: Dict[str, Child] = {}
+        # Last /proc sample of every running child
+        self.samples: Dict[str, ResourceUsage] = {}
+        self.last_sample: Optional[float] = None
+        # Callbacks of the children whose stdout is read
+        self.outputs: Dict[str, Callable[[bytes], None]] = {}
+
+    def __len__(self) -> int:
+        return len(self.children)
+
+    def __bool__(self) -> bool:
+        return bool(self.children)
+
+    def spawn(
+        self,
+        key: str,
+        argv: List[str],
+        output: Optional[Callable[[bytes], None]] = None,
+        limits: Optional[ChildLimits] = None,
+        **kwargs: Any,
+    ) -> "subprocess.Popen[bytes]":
+        """
+        Starts <argv> without a shell, the output is discarded unless stdout/stderr
+        are passed in <kwargs> or <output> is given, which is called with every
+        chunk the child writes to stdout. <limits> are applied before exec
+        """
+        options: Dict[str, Any] = {
+            "stdin": None,
+            "stdout": subprocess.DEVNULL,
+            "stderr": subprocess.DEVNULL,
+        }
+        options.update(kwargs)
+        if limits is not None and limits.enabled:
+            options["preexec_fn"] = limits.preexec
+        if output is not None:
+            options["stdout"] = subprocess.PIPE
+        proc = subprocess.Popen(argv, shell=False, **options)
+        self.add(key, proc)
+        if output is not None and proc.stdout is not None:
+            os.set_blocking(proc.stdout.fileno(), False)
+            self.selector.register(proc.stdout, selectors.EVENT_READ, OutputKey(key))
+            self.outputs[key] = output
+        return proc
+
+    def add(self, key: str, proc: "subprocess.Popen[bytes]") -> None:
+        pidfd: Optional[int] = None
+        if self.use_pidfd:
+            try:
+                pidfd = os.pidfd_open(proc.pid)
+                self.selector.register(pidfd, selectors.EVENT_READ, key)
+            except ProcessLookupError:
+                # Already exited and reaped elsewhere (gevent), the next poll sees it
+                pidfd = None
+            except OSError as e:
+                # Old kernels (ENOSYS) or restricted sandboxes, this child is polled
+                logger.warning("pidfd unavailable for %s, polling instead: %s", key, e)
+                if pidfd is not None:
+                    os.close(pidfd)
+                pidfd = None
+        self.children[key] = Child(proc, time.time(), pidfd)
+
+    def watch(self, fileno: int) -> bool:
+        """
+        Makes wait return as soon as <fileno> is readable, the caller has to
+        consume what was read or wait keeps returning right away
+
+        Returns False when <fileno> can't be watched (not a real descriptor)
+        """
+        try:
+            self.selector.register(fileno, selectors.EVENT_READ, None)
+        except (OSError, ValueError) as e:
+            logger.warning("Can't watch descriptor %s: %s", fileno, e)
+            return False
+        return True
+
+    def unwatch(self, fileno: int) -> None:
+        """
+        Stops watching <fileno>, has to be called before it's closed or the selector
+        keeps a descriptor number the kernel hands out again
+        """
+        try:
+            self.selector.unregister(fileno)
+        except (KeyError, ValueError):
+            pass
+
+    def wait(self, timeout: Optional[float] = None) -> List[ChildExit]:
+        """
+        Blocks until at least one child exits or <timeout> seconds pass,
+        returns the children that were reaped (empty on timeout, when woken by a
+        watched descriptor or without children)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.children:
+            if self.sample_proc:
+                self.sample()
+            polled = [
+                key for key, child in self.children.items() if child.pidfd is None
+            ]
+            remaining = (
+                None if deadline is None else max(0.0, deadline - time.monotonic())
+            )
+            interval = self.POLL_INTERVAL if polled else None
+            if self.sample_proc:
+                interval = min(interval or self.SAMPLE_INTERVAL, self.SAMPLE_INTERVAL)
+            if interval is not None:
+                remaining = interval if remaining is None else min(remaining, interval)
+            events = self.selector.select(remaining)
+            ready: List[str] = []
+            woken = False
+            for selected, _ in events:
+                if selected.data is None:
+                    woken = True
+                elif isinstance(selected.data, OutputKey):
+                    self.read_output(selected.data.key)
+                else:
+                    ready.append(str(selected.data))
+            exits = self.reap(ready + polled)
+            if exits or woken:
+                return exits
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        return []
+
+    def reap(self, keys: List[str]) -> List[ChildExit]:
+        exits: List[ChildExit] = []
+        for key in keys:
+            child = self.children.get(key)
+            if child is None:
+                continue
+            collected = self._collect(key, child)
+            if collected is None:
+                continue
+            returncode, usage = collected
+            exited_at = time.time()
+            # What the child wrote before exiting
+            self.read_output(key, drain=True)
+            self._forget(key)
+            exits.append(
+                ChildExit(
+                    key, child.proc.pid, returncode, child.started_at, exited_at, usage
+                )
+            )
+            logger.debug(
+                "Child %s (%s) exited with %s", key, child.proc.pid, returncode
+            )
+        return exits
+
+    def _collect(
+        self, key: str, child: Child
+    ) -> Optional[Tuple[int, Optional[ResourceUsage]]]:
+        """
+        Return code and usage of an exited child, None while it runs
+        """
+        proc = child.proc
+        if proc.returncode is None and not self.sample_proc:
+            try:
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            except ChildProcessError:
+                # Reaped by someone else, Popen knows its return code
+                logger.warning(
+                    "Child %s was reaped elsewhere, sampling /proc instead", key
+                )
+                self.sample_proc = True
+            else:
+                if pid == 0:
+                    return None
+                # Popen won't wait for it again
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                return proc.returncode, from_rusage(rusage)
+        returncode = proc.poll()
+        if returncode is None:
+            return None
+        return returncode, self.samples.get(key)
+
+    def read_output(self, key: str, drain: bool = False) -> None:
+        """
+        Passes what is available on the stdout of a child to its callback,
+        with <drain> until nothing is left
+        """
+        output = self.outputs.get(key)
+        child = self.children.get(key)
+        if output is None or child is None or child.proc.stdout is None:
+            return
+        while True:
+            try:
+                data = os.read(child.proc.stdout.fileno(), self.READ_SIZE)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                logger.warning("Can't read the output of %s: %s", key, e)
+                data = b""
+            if not data:
+                # Closed by the child
+                self._close_output(key)
+                return
+            output(data)
+            if not drain:
+                return
+
+    def _close_output(self, key: str) -> None:
+        if self.outputs.pop(key, None) is None:
+            return
+        stdout = self.children[key].proc.stdout
+        if stdout is not None:
+            self.selector.unregister(stdout)
+            stdout.close()
+
+    def sample(self, force: bool = False) -> None:
+        """
+        Reads the usage of the running children from /proc,
+        at most once every SAMPLE_INTERVAL seconds unless <force>
+        """
+        now = time.monotonic()
+        if (
+            not force
+            and self.last_sample is not None
+            and now - self.last_sample < self.SAMPLE_INTERVAL
+        ):
+            return
+        self.last_sample = now
+        for key, child in self.children.items():
+            usage = read_proc_usage(child.proc.pid)
+            # Zombies have no memory left, keep the previous peak
+            if usage is not None and usage.max_rss:
+                self.samples[key] = usage
+
+    def sleep(self, seconds: float) -> None:
+        # Cooperative under the gevent pool, time is monkey patched
+        time.sleep(seconds)
+
+    def terminate_all(self) -> None:
+        for child in self.children.values():
+            logger.info(f"Terminating {child.proc.pid}")
+            child.proc.terminate()
+
+    def close(self) -> None:
+        for key in list(self.children):
+            self._forget(key)
+        self.selector.close()
+
+    def _forget(self, key: str) -> None:
+        self._close_output(key)
+        child = self.children.pop(key)
+        self.samples.pop(key, None)
+        if child.pidfd is not None:
+            self.selector.unregister(child.pidfd)
+            os.close(child.pidfd)
@@ -1,16 +1,18 @@
 # mypy: disable-error-code="unused-ignore"
 # Create your views here.
 import logging
-import re
-import ast
 from subprocess import PIPE, Popen, TimeoutExpired
-from typing import List, Optional, Any
+from typing import Any, AsyncGenerator, Dict, List, Optional
 from os import listdir
 from os.path import join
 from pathlib import Path
+from uuid import uuid4
+from asgiref.sync import async_to_sync, sync_to_async
+from redis.exceptions import RedisError
 from django.shortcuts import redirect, render, get_object_or_404
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.functional import SimpleLazyObject
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import never_cache
@@ -21,9 +23,11 @@ from django.http import (
     HttpRequest,
     HttpResponseServerError,
 )
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.db.models import Sum, Q
+from django.db import IntegrityError
+from django.db.models import Count, F, Max, Q, Sum
 
 from rest_framework.views import APIView
 from rest_framework.request import Request as APIRequest
@@ -32,13 +36,30 @@ from rest_framework.response import Response as APIResponse
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListCreateAPIView
 
-from .models import CeleryTask, UserPreferences
-from .serializers import CeleryTaskSerializer, TaskIdListSerializer
+from .models import Campaign, CampaignPass, CeleryTask, UserPreferences
+from .serializers import (
+    CampaignCreateSerializer,
+    CampaignDeltaSerializer,
+    CeleryTaskSerializer,
+    TaskIdListSerializer,
+)
 from .forms import SyncForm, CustomUserChangeForm, PreferencesForm
-from .tasks import call_system
-from pymap import celery_app
+from .tasks import (
+    call_system,
+    discard_jobs,
+    job_logfile,
+    run_campaign_pass,
+    save_jobs,
+    stored_jobs,
+    task_stopped,
+)
+from .utilites.cancellation import clear_cancel, request_cancel
 from .utilites.helpers import get_logs_status
+from .utilites.job_queue import get_redis, requeue_jobs, stream_jobs
+from .utilites.progress import clear_progress, read_accounts, read_progress
+from core.jobs import Job
 from core.pymap_core import ScriptGenerator
+from core.streaming import iter_lines
 
 logger = logging.getLogger(__name__)
 
@@ -167,14 +188,15 @@ def sync(request: HttpRequest) -> (HttpResponse | HttpResponseRedirect):
             # Call Celery task here with the input data
             source: str = form.cleaned_data["source"]
             destination: str = form.cleaned_data["destination"]
-            # There area carriage returns being appended to the string probably due to the way
-            # form parses and cleans data, make sure to remove them!!
-            logger.debug("Input before split %s", form.cleaned_data["input_text"])
-            clean_input = re.sub(r"\r\n", "\n", form.cleaned_data["input_text"].strip())
-            input_text: List[str] = clean_input.split("\n")
-            logger.debug("Input after split %s", input_text)
+            # Lines are read one at a time by iter_lines, which also drops the
+            # carriage returns browsers send with the textarea contents
+            input_text: str = form.cleaned_data["input_text"].strip()
             additional_arguments: str = form.cleaned_data["additional_arguments"]
             dry_run: bool = form.cleaned_data["dry_run"]
+            deduplicate: bool = form.cleaned_data["deduplicate"]
+            distributed: bool = form.cleaned_data["distributed"]
+            size_hint: bool = form.cleaned_data["size_hint"]
+            preflight: bool = form.cleaned_data["preflight"]
             config = settings.PYMAP_SETTINGS
             user = request.user
             user_preferences, _ = UserPreferences.objects.get_or_create(user=user)
@@ -187,6 +209,10 @@ def sync(request: HttpRequest) -> (HttpResponse | HttpResponseRedirect):
                 Destination: {destination}
                 Additional arguments: {additional_arguments}
                 Dry run: {dry_run}
+                Deduplicate: {deduplicate}
+                Distributed: {distributed}
+                Size hint: {size_hint}
+                Preflight: {preflight}
                 """
             )
             # TODO: Strip out passwords before logging commands
@@ -199,39 +225,72 @@ def sync(request: HttpRequest) -> (HttpResponse | HttpResponseRedirect):
                 extra_args=additional_arguments,
                 config=config,
                 dry_run=dry_run,
+                deduplicate=deduplicate,
+                size_hint=size_hint,
                 pymap_logdir=settings.PYMAP_LOGDIR,
                 additional_known_hosts=additional_known_hosts,
             )
-            content = gen.process_strings(input_text)
-
-            # TODO: Strip out passwords before logging commands
-            # logger.debug(
-            #     "Received the following output from generator:\n %s", content
-            # )
-
-            task = call_system.apply_async((content,), countdown=5)  # type: ignore
-            logger.info(
-                f"Starting background task with ID: {task.id} from User: {user.username}"
-            )
-
-            # Don't forget to save the task id and respective inputs to the database
+            # The task id is generated here so the task can be saved and started
+            # with the first batch of jobs while the rest of the input is parsed
+            task_id = str(uuid4())
             root_log_directory: str = settings.PYMAP_LOGDIR
-            log_directory = Path(root_log_directory, task.id)
+            log_directory = Path(root_log_directory, task_id)
             if not log_directory.exists():
                 log_directory.mkdir()
-            domains = ", ".join(gen.domains)
             ctask = CeleryTask(
-                task_id=task.id,
+                task_id=task_id,
                 source=source,
                 destination=destination,
                 log_path=str(log_directory),
-                n_accounts=len(content),
-                domains=domains,
+                n_accounts=0,
+                domains="",
                 owner=user,
             )
             ctask.save()
 
-            target_url = reverse("migrator:tasks-details", args=(task.id,))
+            def dispatch() -> None:
+                call_system.apply_async(  # type: ignore
+                    ([],),
+                    {
+                        "queued": True,
+                        "distributed": distributed,
+                        "preflight": preflight,
+                    },
+                    task_id=task_id,
+                )
+                logger.info(
+                    f"Starting background task with ID: {task_id} from User: {user.username}"
+                )
+
+            async def saved_batches() -> AsyncGenerator[List[Job], None]:
+                # Also kept with the task, the job queue expires (stored_jobs)
+                position = 0
+                async for batch in gen.abatches(iter_lines(input_text)):
+                    # Saved once the batch was queued, the task can start meanwhile
+                    yield batch
+                    await sync_to_async(save_jobs)(
+                        ctask, [job.to_dict() for job in batch], position
+                    )
+                    position += len(batch)
+
+            n_accounts = async_to_sync(stream_jobs)(task_id, saved_batches(), dispatch)
+            if gen.duplicate_count > 0:
+                logger.info(
+                    f"Dropped {gen.duplicate_count} duplicate account pairs from the input"
+                )
+                sample = ", ".join(gen.duplicates[:5])
+                messages.warning(
+                    request,
+                    f"Skipped {gen.duplicate_count} duplicate account pairs: {sample}"
+                    + ("..." if gen.duplicate_count > 5 else ""),
+                )
+
+            # Stored with the number of accounts, ex: "example.com (12), example.org (3)"
+            ctask.n_accounts = n_accounts
+            ctask.domains = gen.domain_registry.summary()
+            ctask.save(update_fields=["n_accounts", "domains"])
+
+            target_url = reverse("migrator:tasks-details", args=(task_id,))
             logger.debug("Target redirect: %s", target_url)
             return redirect(target_url, permanent=False)
     else:
@@ -244,16 +303,10 @@ def sync(request: HttpRequest) -> (HttpResponse | HttpResponseRedirect):
 def retry_task(
     request: HttpRequest, task_id: str
 ) -> (HttpResponse | HttpResponseRedirect):
-    # This is to avoid -> Caution: A complex expression can overflow the C stack and cause a crash.
-    MAX_LENGTH = 20000
-
-    def validate_and_evaluate(input_str: str, max_length=MAX_LENGTH) -> Any:
-        if len(input_str) > max_length:
-            raise ValueError(
-                f"Input string exceeds the maximum length of {max_length} characters."
-            )
-        return ast.literal_eval(input_str)
-
+    """
+    Starts a new task with the jobs of a finished one, with ?failed_only=1 the
+    accounts that already succeeded (see AccountCheckpoint) are left out
+    """
     assert isinstance(request.user, User)
     user = request.user
     source = None
@@ -265,12 +318,20 @@ def retry_task(
             raise ValueError("Task has not finished yet")
         source = db_result.source
         destination = db_result.destination
-        meta = celery_app.backend.get_task_meta(task_id)
-        content_str = meta["args"]
-        # Convert the string to a Python tuple containing a list
-        content_tuple = validate_and_evaluate(content_str)
-        # Extract the list from the tuple
-        cmd_list = content_tuple[0]
+        cmd_list, _ = stored_jobs(task_id)
+        if request.GET.get("failed_only") == "1":
+            succeeded = set(
+                db_result.checkpoints.filter(returncode=0).values_list(
+                    "logfile", flat=True
+                )
+            )
+            cmd_list = [cmd for cmd in cmd_list if job_logfile(cmd) not in succeeded]
+            if not cmd_list:
+                messages.info(request, "Every account of this task already succeeded")
+                return redirect(
+                    reverse("migrator:tasks-details", args=(task_id,)),
+                    permanent=False,
+                )
         logger.info(
             f"USER: {user.username} requested a re-sync for {source} -> {destination}"
         )
@@ -294,6 +355,7 @@ def retry_task(
             owner=user,
         )
         ctask.save()
+        save_jobs(ctask, cmd_list)
 
         target_url = reverse("migrator:tasks-details", args=(task.id,))
         logger.debug("Target redirect: %s", target_url)
@@ -302,6 +364,65 @@ def retry_task(
         return HttpResponseServerError(
             "This task no longer has results on the database"
         )
+    except LookupError as e:
+        logger.error("Can't run task %s again: %s", task_id, e)
+        return HttpResponseServerError(str(e))
+    except Exception as e:
+        logger.critical("Unhandled exception: %s", str(e), exc_info=True)
+        return HttpResponseServerError("Internal error")
+
+
+@login_required
+def resume_task(
+    request: HttpRequest, task_id: str
+) -> (HttpResponse | HttpResponseRedirect):
+    """
+    Runs a task that stopped (finished, cancelled or crashed) again under the same ID
+    and log directory, accounts with a successful checkpoint are skipped
+    """
+    assert isinstance(request.user, User)
+    user = request.user
+    try:
+        ctask = CeleryTask.objects.get(task_id=task_id)
+        # Tasks left unfinished by a crashed worker can be resumed as well
+        if not task_stopped(ctask):
+            raise ValueError("Task is still running")
+        cmd_list, kwargs = stored_jobs(task_id)
+        queued = bool(kwargs.get("queued"))
+        client = get_redis()
+        if queued:
+            # The job queue is deleted once it was read, the jobs saved with the
+            # task are queued again
+            requeue_jobs(client, task_id, cmd_list)
+        # Otherwise the task would stop right away and its progress would count twice
+        clear_cancel(client, task_id)
+        clear_progress(client, task_id)
+        ctask.finished = False
+        ctask.terminated = False
+        ctask.save(update_fields=["finished", "terminated"])
+        # Streamed tasks keep reading the job queue so the stored arguments stay small
+        call_system.apply_async(  # type: ignore
+            ([] if queued else cmd_list,),
+            {
+                "queued": queued,
+                "distributed": bool(kwargs.get("distributed")),
+                "resume": True,
+                "preflight": bool(kwargs.get("preflight")),
+            },
+            task_id=task_id,
+            countdown=5,
+        )
+        logger.info(f"USER: {user.username} resumed task {task_id}")
+        return redirect(
+            reverse("migrator:tasks-details", args=(task_id,)), permanent=False
+        )
+    except CeleryTask.DoesNotExist:
+        return HttpResponseServerError(
+            "This task no longer has results on the database"
+        )
+    except (LookupError, ValueError) as e:
+        logger.error("Can't run task %s again: %s", task_id, e)
+        return HttpResponseServerError(str(e))
     except Exception as e:
         logger.critical("Unhandled exception: %s", str(e), exc_info=True)
         return HttpResponseServerError("Internal error")
@@ -477,6 +598,96 @@ class CeleryTaskDetails(APIView):
             )
 
 
+class CeleryTaskProgress(APIView):
+    """
+    API endpoint for the progress of a task, with ?since=<seq> only the changes
+    published after a previous response are returned
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: APIRequest, task_id: str) -> JsonResponse:
+        try:
+            since = max(0, int(request.GET.get("since", 0)))
+        except ValueError:
+            return JsonResponse({"error": "since must be an integer"}, status=400)
+        try:
+            state = read_progress(get_redis(), task_id, since=since)
+        except RedisError as e:
+            logger.error(f"Failed to read the progress of {task_id}: {e}")
+            return JsonResponse({"error": "Progress is not available"}, status=503)
+        return JsonResponse(state.to_dict(), status=200)
+
+
+class CeleryTaskAccounts(APIView):
+    """
+    API endpoint for the live progress of the accounts of a task, parsed by the worker
+    from the output of imapsync (messages, bytes, rates, percent done and ETA)
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: APIRequest, task_id: str) -> JsonResponse:
+        try:
+            accounts = read_accounts(get_redis(), task_id)
+        except RedisError as e:
+            logger.error(f"Failed to read the accounts of {task_id}: {e}")
+            return JsonResponse({"error": "Progress is not available"}, status=503)
+        return JsonResponse({"accounts": accounts}, status=200)
+
+
+class CeleryTaskResources(APIView):
+    """
+    API endpoint for the CPU and memory used by the accounts of a task, added up over
+    every run of the task, with the accounts that used the most CPU (?top=<count>)
+    and the number of accounts that hit each CHILD_LIMITS limit
+    """
+
+    permission_classes = [IsAuthenticated]
+    MAX_TOP = 100
+
+    def get(self, request: APIRequest, task_id: str) -> JsonResponse:
+        task = get_object_or_404(CeleryTask, task_id=task_id)
+        try:
+            top = min(self.MAX_TOP, max(0, int(request.GET.get("top", 10))))
+        except ValueError:
+            return JsonResponse({"error": "top must be an integer"}, status=400)
+        checkpoints = task.checkpoints.all()
+        totals = checkpoints.aggregate(
+            accounts=Count("id"),
+            measured=Count("user_cpu"),
+            user_cpu=Sum("user_cpu"),
+            system_cpu=Sum("system_cpu"),
+            wall_time=Sum("duration"),
+            max_rss=Max("max_rss"),
+        )
+        totals["limit_hits"] = dict(
+            checkpoints.filter(limit_hit__isnull=False)
+            .values_list("limit_hit")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        for field in ("user_cpu", "system_cpu", "wall_time"):
+            if totals[field] is not None:
+                totals[field] = round(totals[field], 3)
+        top_accounts = list(
+            checkpoints.filter(user_cpu__isnull=False)
+            .annotate(cpu=F("user_cpu") + F("system_cpu"))
+            .order_by("-cpu")
+            .values(
+                "logfile",
+                "returncode",
+                "duration",
+                "user_cpu",
+                "system_cpu",
+                "max_rss",
+                "limit_hit",
+                "attempt",
+            )[:top]
+        )
+        return JsonResponse({**totals, "top": top_accounts}, status=200)
+
+
 class CeleryTaskLogDetails(APIView):
     """
     API endpoint for accessing imapsync logfile contents
@@ -554,6 +765,7 @@ class ArchiveTask(APIView):
                 if user.is_staff or task.owner == user:
                     task.archived = True
                     task.save()
+                    discard_jobs(CeleryTask.objects.filter(id=task.id))
                     logger.info(
                         f"User {user.username} archived task with ID {task.task_id}"
                     )
@@ -601,7 +813,16 @@ class CancelTask(APIView):
                 if user.is_staff or user == task.owner:
                     task.terminated = True
                     task.save()
-                    changes[task.task_id] = "OK"
+                    # Running tasks are subscribed to the cancellation,
+                    # terminated is kept for the records and as a fallback
+                    try:
+                        request_cancel(get_redis(), task.task_id)
+                        changes[task.task_id] = "OK"
+                    except RedisError as e:
+                        logger.error(
+                            f"Failed to notify task {task.task_id} of its cancellation: {e}"
+                        )
+                        changes[task.task_id] = f"ERROR: Failed to notify task: {e}"
                 else:
                     logger.info(
                         f"User {user.username} does not own task with ID {task.task_id}"
@@ -660,3 +881,129 @@ class DeleteTask(APIView):
             serializer.errors,
         )
         return JsonResponse({"error": serializer.errors}, status=400)
+
+
+class CampaignCreate(APIView):
+    """
+    API endpoint for starting a campaign from a task, its bulk pass
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request: APIRequest) -> JsonResponse:
+        assert isinstance(request.user, SimpleLazyObject)
+        serializer = CampaignCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"error": serializer.errors}, status=400)
+        user = request.user
+        task_id = serializer.validated_data["task_id"]
+        task = CeleryTask.objects.filter(task_id=task_id).first()
+        if task is None:
+            return JsonResponse({"error": f"Task {task_id} does not exist"}, status=404)
+        if not (user.is_staff or user == task.owner):
+            return JsonResponse(
+                {"error": f"User {user.username} does not own task"}, status=403
+            )
+        campaign = Campaign.objects.create(
+            name=serializer.validated_data.get("name") or f"Migration of {task_id}",
+            owner=user,
+        )
+        CampaignPass.objects.create(
+            campaign=campaign,
+            number=0,
+            task=task,
+            scheduled_for=task.start_time,
+            duration=task.run_time if task.finished else None,
+        )
+        logger.info(
+            f"User {user.username} started campaign {campaign.id} from {task_id}"
+        )
+        return JsonResponse({"campaign_id": campaign.id}, status=201)
+
+
+class CampaignDelta(APIView):
+    """
+    API endpoint for scheduling the next delta pass of a campaign
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request: APIRequest, campaign_id: int) -> JsonResponse:
+        assert isinstance(request.user, SimpleLazyObject)
+        serializer = CampaignDeltaSerializer(data=request.data)
+        if not serializer.is_valid():
+            return JsonResponse({"error": serializer.errors}, status=400)
+        user = request.user
+        campaign = Campaign.objects.filter(id=campaign_id).first()
+        if campaign is None:
+            return JsonResponse(
+                {"error": f"Campaign {campaign_id} does not exist"}, status=404
+            )
+        if not (user.is_staff or user == campaign.owner):
+            return JsonResponse(
+                {"error": f"User {user.username} does not own campaign"}, status=403
+            )
+        at = serializer.validated_data.get("at")
+        last = campaign.passes.order_by("-number").first()
+        number = last.number + 1 if last is not None else 0
+        try:
+            campaign_pass = CampaignPass.objects.create(
+                campaign=campaign, number=number, scheduled_for=at or timezone.now()
+            )
+        except IntegrityError:
+            return JsonResponse(
+                {"error": "Another pass was scheduled at the same time"}, status=409
+            )
+        # Waits for the previous pass to finish before it starts
+        run_campaign_pass.apply_async((campaign_pass.id,), eta=at)  # type: ignore
+        logger.info(
+            f"User {user.username} scheduled pass {number} of campaign {campaign.id}"
+        )
+        return JsonResponse(
+            {
+                "campaign_id": campaign.id,
+                "pass": number,
+                "scheduled_for": campaign_pass.scheduled_for,
+            },
+            status=202,
+        )
+
+
+class CampaignDetails(APIView):
+    """
+    API endpoint for the passes of a campaign, their tasks and durations
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request: APIRequest, campaign_id: int) -> JsonResponse:
+        campaign = Campaign.objects.filter(id=campaign_id).first()
+        if campaign is None:
+            return JsonResponse(
+                {"error": f"Campaign {campaign_id} does not exist"}, status=404
+            )
+        passes = [
+            {
+                "number": campaign_pass.number,
+                "task_id": campaign_pass.task.task_id if campaign_pass.task else None,
+                "scheduled_for": campaign_pass.scheduled_for,
+                "start_time": (
+                    campaign_pass.task.start_time if campaign_pass.task else None
+                ),
+                "maxage": campaign_pass.maxage,
+                "duration": campaign_pass.duration,
+                "finished": bool(campaign_pass.task and campaign_pass.task.finished),
+                "error": campaign_pass.error or None,
+            }
+            for campaign_pass in campaign.passes.select_related("task")
+        ]
+        return JsonResponse(
+            {
+                "campaign_id": campaign.id,
+                "name": campaign.name,
+                "owner": campaign.owner.username,
+                "created_at": campaign.created_at,
+                "passes": passes,
+            },
+            status=200,
+        )
@@ -14,7 +14,7 @@ import os
 import errno
 from pathlib import Path
 import sys
-from typing import Dict, List
+from typing import Any, Dict, List
 from django.core.management.utils import get_random_secret_key
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -205,7 +205,7 @@ LOGGING = {
 PYMAP_LOGDIR = "pymap_logs"
 
 # Custom settings
-PYMAP_SETTINGS: Dict[str, str] = {}
+PYMAP_SETTINGS: Dict[str, Any] = {}
 
 
 def load_settings_file() -> None:
@@ -260,7 +260,22 @@ def load_settings_file() -> None:
     # I don't think anything besides django should access the database settings
     # we only include settings the app should access
     PYMAP_SETTINGS.update(
-        {k: v for k, v in custom_settings.items() if k in ["PYMAP_LOGDIR", "HOSTS"]}
+        {
+            k: v
+            for k, v in custom_settings.items()
+            if k
+            in [
+                "PYMAP_LOGDIR",
+                "HOSTS",
+                "CONCURRENCY",
+                "HOST_LIMITS",
+                "PROGRESS_INTERVAL",
+                "CHILD_LIMITS",
+                "SUPERVISION",
+                "RETRIES",
+                "PREFLIGHT",
+            ]
+        }
     )
 
 
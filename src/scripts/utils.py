@@ -1,6 +1,12 @@
-from typing import List
-from random import choice, choices, randint
+import argparse
+import hashlib
+import json
+import os
 import string
+import tempfile
+from pathlib import Path
+from random import Random, choice, choices, randint
+from typing import Generator, List, Optional, Sequence
 
 
 def generate_email(domain: str) -> str:
@@ -77,3 +83,244 @@ def generate_line_creds(
         )
         creds.append(new_string)
     return creds
+
+
+# Bumped whenever the corpus output changes, so stale cached files are not reused
+CORPUS_VERSION = 1
+CORPUS_BATCH_SIZE = 50_000
+CORPUS_CACHE_DIR = Path(
+    os.environ.get("PYMAP_CORPUS_CACHE", Path.home() / ".cache" / "pymap" / "corpus")
+)
+
+_USER_CHARS = string.ascii_lowercase + string.digits
+_PASSWORD_CHARS = string.ascii_letters + string.digits + "#()!"
+# Maps every byte to a character so random bytes can be turned into text in C,
+# the slight modulo bias doesn't matter for test data
+_USER_TABLE = bytes(ord(_USER_CHARS[i % len(_USER_CHARS)]) for i in range(256))
+_PASSWORD_TABLE = bytes(
+    ord(_PASSWORD_CHARS[i % len(_PASSWORD_CHARS)]) for i in range(256)
+)
+# Same bounds as generate_email/generate_password, length = MIN + byte % SPAN
+_USER_MIN, _USER_SPAN = 6, 5
+_PASSWORD_MIN, _PASSWORD_SPAN = 8, 13
+
+MALFORMED_TEMPLATES = [
+    "{user}",
+    "{user}@{domain}",
+    "@{domain} {password}",
+    "{user}@ {password}",
+    "{password}",
+    "{user}@{domain} {password} {user}@{domain}",
+    "# {user}@{domain} {password}",
+]
+# Long delimiter runs, many candidate accounts and repeated separators,
+# the kind of lines that used to make the old parser backtrack
+PATHOLOGICAL_TEMPLATES = [
+    "{user}@{domain}" + " |\t" * 2000 + "{password}",
+    "a@" * 5000,
+    "{user}@{domain} " * 1000,
+    "{user}" + "@" * 1000 + "{domain} {password}",
+    "{user}" + "." * 10000 + "@{domain} {password}",
+]
+
+
+def _random_strings(
+    rng: Random, count: int, table: bytes, minimum: int, span: int
+) -> List[str]:
+    lengths = [minimum + b % span for b in rng.randbytes(count)]
+    chars = rng.randbytes(sum(lengths)).translate(table).decode("ascii")
+    strings: List[str] = []
+    position = 0
+    for length in lengths:
+        strings.append(chars[position : position + length])
+        position += length
+    return strings
+
+
+def generate_corpus_batch(
+    rng: Random,
+    count: int,
+    creds_type: str = "s",
+    domains: Sequence[str] = ("example.com",),
+    malformed_rate: float = 0.0,
+    pathological_rate: float = 0.0,
+) -> List[str]:
+    """
+    Generate <count> credential lines in one go, same format as generate_line_creds
+    but built from a few bulk random calls instead of one per character
+
+    Args:
+        rng (Random): Source of randomness, seed it for a reproducible output.
+        count (int): The number of lines to generate.
+        creds_type (str, optional): 's' for single credentials, 'd' for double credentials.
+        domains (Sequence[str], optional): Domains used for the email addresses.
+        malformed_rate (float, optional): Fraction of lines replaced by a malformed line.
+        pathological_rate (float, optional): Fraction of lines replaced by a pathological line.
+
+    Returns:
+        List[str]: The generated lines, without newlines.
+    """
+    fields = 2 if creds_type == "d" else 1
+    users = _random_strings(rng, count * fields, _USER_TABLE, _USER_MIN, _USER_SPAN)
+    passwords = _random_strings(
+        rng, count * fields, _PASSWORD_TABLE, _PASSWORD_MIN, _PASSWORD_SPAN
+    )
+    picked = rng.choices(domains, k=count * fields)
+    if fields == 1:
+        lines = [
+            f"{user}@{domain} {password}"
+            for user, domain, password in zip(users, picked, passwords)
+        ]
+    else:
+        lines = [
+            f"{users[i]}@{picked[i]} {passwords[i]} "
+            f"{users[i + 1]}@{picked[i + 1]} {passwords[i + 1]}"
+            for i in range(0, count * 2, 2)
+        ]
+    for rate, templates in (
+        (malformed_rate, MALFORMED_TEMPLATES),
+        (pathological_rate, PATHOLOGICAL_TEMPLATES),
+    ):
+        if rate <= 0:
+            continue
+        replaced = rng.sample(range(count), min(count, round(count * rate)))
+        for index in replaced:
+            lines[index] = rng.choice(templates).format(
+                user=users[index * fields],
+                domain=picked[index * fields],
+                password=passwords[index * fields],
+            )
+    return lines
+
+
+def generate_corpus(
+    count: int,
+    creds_type: str = "s",
+    domains: Sequence[str] = ("example.com",),
+    malformed_rate: float = 0.0,
+    pathological_rate: float = 0.0,
+    seed: int = 0,
+    batch_size: int = CORPUS_BATCH_SIZE,
+) -> Generator[List[str], None, None]:
+    """
+    Yields batches of at most <batch_size> lines, the same arguments always
+    produce the same lines
+    """
+    rng = Random(seed)
+    remaining = count
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        yield generate_corpus_batch(
+            rng, size, creds_type, domains, malformed_rate, pathological_rate
+        )
+        remaining -= size
+
+
+def corpus_key(
+    count: int,
+    creds_type: str = "s",
+    domains: Sequence[str] = ("example.com",),
+    malformed_rate: float = 0.0,
+    pathological_rate: float = 0.0,
+    seed: int = 0,
+    batch_size: int = CORPUS_BATCH_SIZE,
+) -> str:
+    """
+    Hash of everything that affects the corpus content
+    """
+    params = {
+        "version": CORPUS_VERSION,
+        "count": count,
+        "creds_type": creds_type,
+        "domains": list(domains),
+        "malformed_rate": malformed_rate,
+        "pathological_rate": pathological_rate,
+        "seed": seed,
+        "batch_size": batch_size,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+def write_corpus(
+    count: int,
+    creds_type: str = "s",
+    domains: Sequence[str] = ("example.com",),
+    malformed_rate: float = 0.0,
+    pathological_rate: float = 0.0,
+    seed: int = 0,
+    batch_size: int = CORPUS_BATCH_SIZE,
+    cache_dir: Optional[Path] = None,
+) -> Path:
+    """
+    Streams a corpus to disk and returns its path, files are named after corpus_key
+    so a corpus already in <cache_dir> is returned without generating it again
+
+    Example:
+        >>> write_corpus(10_000_000, "d", malformed_rate=0.01, seed=42)
+        PosixPath('/home/user/.cache/pymap/corpus/corpus-3f1c...txt')
+    """
+    directory = cache_dir if cache_dir else CORPUS_CACHE_DIR
+    key = corpus_key(
+        count,
+        creds_type,
+        domains,
+        malformed_rate,
+        pathological_rate,
+        seed,
+        batch_size,
+    )
+    path = directory / f"corpus-{key}.txt"
+    if path.is_file():
+        return path
+    directory.mkdir(parents=True, exist_ok=True)
+    # Written next to the final file and renamed, an interrupted run never leaves
+    # a truncated corpus behind under the cached name
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".corpus-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            for batch in generate_corpus(
+                count,
+                creds_type,
+                domains,
+                malformed_rate,
+                pathological_rate,
+                seed,
+                batch_size,
+            ):
+                fh.write("\n".join(batch))
+                fh.write("\n")
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Writes a cached credentials corpus for load testing",
+        prog="scripts.utils",
+    )
+    parser.add_argument("count", type=int, help="Number of lines")
+    parser.add_argument("-t", "--type", choices=["s", "d"], default="s")
+    parser.add_argument("-d", "--domains", nargs="+", default=["example.com"])
+    parser.add_argument("-m", "--malformed-rate", type=float, default=0.0)
+    parser.add_argument("-p", "--pathological-rate", type=float, default=0.0)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+    parser.add_argument("-c", "--cache-dir", type=Path, default=None)
+    args = parser.parse_args()
+    print(
+        write_corpus(
+            args.count,
+            args.type,
+            args.domains,
+            args.malformed_rate,
+            args.pathological_rate,
+            args.seed,
+            cache_dir=args.cache_dir,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks.parser import FORMATS, TARGETS, compare, measure
+
+BASELINE = {
+    "process_line/single/1000": {
+        "lines_per_sec": 100000.0,
+        "peak_memory_bytes": 1000000.0,
+    }
+}
+
+
+@pytest.mark.parametrize(
+    "lines_per_sec,peak_memory_bytes,expected",
+    [
+        (100000.0, 1000000.0, 0),
+        (80000.0, 1200000.0, 0),
+        (70000.0, 1000000.0, 1),
+        (100000.0, 1400000.0, 1),
+        (50000.0, 2000000.0, 2),
+    ],
+)
+def test_compare(lines_per_sec: float, peak_memory_bytes: float, expected: int) -> None:
+    results = {
+        "process_line/single/1000": {
+            "lines_per_sec": lines_per_sec,
+            "peak_memory_bytes": peak_memory_bytes,
+        }
+    }
+    assert len(compare(results, BASELINE, 0.25)) == expected
+
+
+def test_compare_ignores_missing_keys() -> None:
+    results = {
+        "process_file/double/10": {"lines_per_sec": 1.0, "peak_memory_bytes": 1.0}
+    }
+    assert compare(results, BASELINE, 0.25) == []
+
+
+@pytest.mark.parametrize("target", list(TARGETS))
+@pytest.mark.parametrize("fmt", list(FORMATS))
+def test_measure(target: str, fmt: str, tmp_path: Path) -> None:
+    lines = FORMATS[fmt](20)
+    path = tmp_path / "input.txt"
+    path.write_text("\n".join(lines) + "\n")
+    result = measure(TARGETS[target], lines, path, 1)
+    assert result["lines_per_sec"] > 0
+    assert result["peak_memory_bytes"] >= 0
@@ -0,0 +1,64 @@
+from pathlib import Path
+from random import Random
+
+import pytest
+
+from core.tokenizer import tokenize_line
+from scripts import utils
+from scripts.utils import (
+    corpus_key,
+    generate_corpus,
+    generate_corpus_batch,
+    write_corpus,
+)
+
+
+@pytest.mark.parametrize("creds_type,fields", [("s", 2), ("d", 4)])
+def test_batch_format(creds_type: str, fields: int) -> None:
+    domains = ["example.com", "example.org"]
+    lines = generate_corpus_batch(Random(1), 500, creds_type, domains)
+    assert len(lines) == 500
+    for line in lines:
+        parts = line.split(" ")
+        assert len(parts) == fields
+        assert parts[0].split("@")[1] in domains
+        assert 6 <= len(parts[0].split("@")[0]) <= 10
+        assert 8 <= len(parts[1]) <= 20
+        assert tokenize_line(line) is not None
+
+
+def test_batch_rates() -> None:
+    lines = generate_corpus_batch(
+        Random(1), 1000, malformed_rate=0.1, pathological_rate=0.01
+    )
+    assert len(lines) == 1000
+    assert sum(len(line) > 1000 for line in lines) == 10
+    assert sum(tokenize_line(line) is None for line in lines) >= 10
+
+
+def test_corpus_is_reproducible() -> None:
+    first = list(generate_corpus(1200, "d", seed=7, batch_size=500))
+    assert [len(batch) for batch in first] == [500, 500, 200]
+    assert first == list(generate_corpus(1200, "d", seed=7, batch_size=500))
+    assert first != list(generate_corpus(1200, "d", seed=8, batch_size=500))
+
+
+def test_corpus_key() -> None:
+    assert corpus_key(10, seed=1) == corpus_key(10, seed=1)
+    assert corpus_key(10, seed=1) != corpus_key(10, seed=2)
+    assert corpus_key(10) != corpus_key(10, malformed_rate=0.1)
+
+
+def test_write_corpus_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = write_corpus(1000, "d", seed=3, cache_dir=tmp_path)
+    lines = path.read_text().splitlines()
+    assert lines == [
+        line for batch in generate_corpus(1000, "d", seed=3) for line in batch
+    ]
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise AssertionError("Cached corpus was generated again")
+
+    monkeypatch.setattr(utils, "generate_corpus", fail)
+    assert write_corpus(1000, "d", seed=3, cache_dir=tmp_path) == path
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,64 @@
+import pickle
+from core.dedup import DUPLICATE, NEW, PairDeduplicator
+from core.pymap_core import ScriptGenerator
+from scripts.utils import generate_line_creds
+
+
+def test_deduplicator_exact() -> None:
+    deduplicator = PairDeduplicator()
+    assert deduplicator.check("a@example.com", "b@example.com") == NEW
+    assert deduplicator.check("b@example.com", "a@example.com") == NEW
+    assert deduplicator.check("a@example.com", "b@example.com") == DUPLICATE
+    assert deduplicator.store is None
+
+
+def test_deduplicator_moves_pairs_to_disk() -> None:
+    deduplicator = PairDeduplicator(exact_limit=100)
+    pairs = [(f"user{i}@example.com", f"user{i}@example.org") for i in range(500)]
+    assert all(deduplicator.check(*pair) == NEW for pair in pairs)
+    assert deduplicator.store is not None
+    assert not deduplicator.exact
+    # Pairs from before and after the switch are still found exactly
+    assert all(deduplicator.check(*pair) == DUPLICATE for pair in pairs)
+    assert deduplicator.check("user0@example.org", "user0@example.com") == NEW
+
+
+def test_deduplicator_pickles_without_pairs() -> None:
+    deduplicator = PairDeduplicator(exact_limit=10)
+    for i in range(20):
+        deduplicator.check(f"user{i}@example.com", "b@example.org")
+    copy = pickle.loads(pickle.dumps(deduplicator))
+    assert copy.exact_limit == 10
+    assert copy.store is None
+    assert copy.check("user0@example.com", "b@example.org") == NEW
+
+
+def test_generator_drops_duplicates_past_exact_limit() -> None:
+    creds = generate_line_creds(30, "d")
+    x = ScriptGenerator("127.0.0.1", "127.0.0.2", deduplicate=True)
+    assert x.deduplicator is not None
+    x.deduplicator.exact_limit = 10
+    jobs = x.process_jobs(creds[:5] + creds + creds[:5])
+    # The first repetition is found in memory, the second one on disk
+    assert x.duplicate_count == 10
+    assert len(jobs) == 30
+    assert x.duplicates[0] == f"{jobs[0].user1}--{jobs[0].user2}"
+
+
+def test_generator_drops_duplicate_pairs() -> None:
+    creds = generate_line_creds(20, "d")
+    x = ScriptGenerator("127.0.0.1", "127.0.0.2", deduplicate=True)
+    # Same pair written with different delimiters and passwords is still a duplicate
+    duplicated = creds + creds[:5] + [creds[0].replace(" ", "\t")]
+    jobs = x.process_jobs(duplicated)
+    assert len(jobs) == 20
+    assert x.duplicate_count == 6
+    assert x.duplicates[0] == f"{jobs[0].user1}--{jobs[0].user2}"
+    assert sum(x.domain_counts.values()) == 20
+
+
+def test_generator_keeps_duplicates_by_default() -> None:
+    creds = generate_line_creds(5)
+    x = ScriptGenerator("127.0.0.1", "127.0.0.2")
+    assert len(x.process_strings(creds + creds)) == 10
+    assert x.duplicate_count == 0
@@ -0,0 +1,85 @@
+import shlex
+import pytest
+from core.jobs import Job
+from core.pymap_core import ScriptGenerator
+
+
+def test_process_jobs_keeps_tricky_passwords() -> None:
+    x = ScriptGenerator(
+        "127.0.0.1",
+        "127.0.0.2",
+        extra_args="--timeout 300 --regexflag 's/\\\\Answered//g'",
+        pymap_logdir="/var/log/test",
+    )
+    jobs = x.process_jobs(
+        [
+            "user1@example.com it's\"a pass user2@example.org $(rm -rf ~)",
+            "user3@example.com p`wd' x",
+            "",
+        ]
+    )
+    assert len(jobs) == 2
+    first, second = jobs
+    assert first.user1 == "user1@example.com"
+    assert first.user2 == "user2@example.org"
+    assert first.argv[first.argv.index("--password1") + 1] == "it's\"a pass"
+    assert first.argv[first.argv.index("--password2") + 1] == "$(rm -rf ~)"
+    # Extra arguments are split once, quotes are removed like a shell would
+    assert first.argv[-4:] == ["--timeout", "300", "--regexflag", "s/\\\\Answered//g"]
+    assert "--logdir=/var/log/test" in first.argv
+    assert f"--logfile={first.logfile}" in first.argv
+    assert first.logfile == (
+        "127.0.0.1__127.0.0.2__user1@example.com--user2@example.org.log"
+    )
+    assert second.user1 == second.user2 == "user3@example.com"
+    assert second.argv[second.argv.index("--password2") + 1] == "p`wd' x"
+    # The quoted representation goes back to the same arguments
+    assert shlex.split(first.to_shell()) == first.argv
+
+
+def test_job_with_logdir_and_dict_round_trip() -> None:
+    job = Job(
+        ["imapsync", "--log", "--logdir=/var/log/pymap", "--logfile=a.log"],
+        "a.log",
+        "a@example.com",
+        "b@example.com",
+    )
+    moved = job.with_logdir("/var/log/pymap/task-id")
+    assert moved.argv[2] == "--logdir=/var/log/pymap/task-id"
+    assert job.argv[2] == "--logdir=/var/log/pymap"
+    assert Job.from_dict(moved.to_dict()) == moved
+
+
+def test_job_with_logdir_keeps_passwords() -> None:
+    x = ScriptGenerator("127.0.0.1", "127.0.0.2", pymap_logdir="/var/log/pymap")
+    (job,) = x.process_jobs(["a@example.com --logdir=/tmp b@example.com --logdir=x"])
+    moved = job.with_logdir("/var/log/pymap/task-id")
+    assert moved.argv[moved.argv.index("--password1") + 1] == "--logdir=/tmp"
+    assert moved.argv[moved.argv.index("--password2") + 1] == "--logdir=x"
+    assert "--logdir=/var/log/pymap/task-id" in moved.argv
+    assert "--logdir=/var/log/pymap" not in moved.argv
+
+
+def test_jobs_keep_size_hints() -> None:
+    x = ScriptGenerator("127.0.0.1", "127.0.0.2", size_hint=True)
+    hinted, plain = x.process_jobs(
+        ["a@example.com pass b@example.com pass 2G", "c@example.com pass"]
+    )
+    assert hinted.size == 2 * 1024**3
+    assert hinted.argv[hinted.argv.index("--password2") + 1] == "pass"
+    assert plain.size is None
+    assert Job.from_dict(hinted.to_dict()) == hinted
+    assert "size" not in plain.to_dict()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"argv": "imapsync --help", "logfile": "", "user1": "", "user2": ""},
+        {"argv": ["imapsync", 1], "logfile": "", "user1": "", "user2": ""},
+        {"logfile": "", "user1": "", "user2": ""},
+    ],
+)
+def test_job_from_malformed_dict(data: dict) -> None:
+    with pytest.raises((KeyError, TypeError)):
+        Job.from_dict(data)
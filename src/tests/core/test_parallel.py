@@ -0,0 +1,71 @@
+from pathlib import Path
+from typing import List
+import pytest
+from core import parallel
+from core.parallel import split_ranges
+from core.pymap_core import ScriptGenerator
+from scripts.utils import generate_line_creds
+
+
+@pytest.fixture
+def creds_file(tmp_path: Path) -> Path:
+    lines: List[str] = (
+        generate_line_creds(40, domains=["example.com", "example.org"])
+        + ["", "invalid line", "user@example.net\tp|a,ss\r"]
+        + generate_line_creds(35, "d", domains=["example.net"])
+    )
+    path = tmp_path / "creds.txt"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.mark.parametrize("parts", [1, 2, 3, 7, 500])
+def test_split_ranges_cover_whole_lines(creds_file: Path, parts: int) -> None:
+    data = creds_file.read_bytes()
+    ranges = split_ranges(str(creds_file), parts)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(data)
+    assert len(ranges) <= parts
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+        assert data[start - 1 : start] == b"\n"
+
+
+@pytest.mark.parametrize("workers,deduplicate", [(2, False), (3, False), (3, True)])
+def test_parallel_output_matches_serial(
+    creds_file: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    workers: int,
+    deduplicate: bool,
+) -> None:
+    # Duplicates spread across the whole file, so they end up in different ranges
+    creds_file.write_text(creds_file.read_text() * 2)
+    # Small ranges so the test file is actually split between the workers
+    monkeypatch.setattr(parallel, "MIN_RANGE_SIZE", 256)
+    serial = ScriptGenerator(
+        "host1",
+        "host2",
+        destination=str(tmp_path / "serial"),
+        split=7,
+        deduplicate=deduplicate,
+    )
+    serial.process_file(str(creds_file))
+    concurrent = ScriptGenerator(
+        "host1",
+        "host2",
+        destination=str(tmp_path / "parallel"),
+        split=7,
+        workers=workers,
+        deduplicate=deduplicate,
+    )
+    concurrent.process_file(str(creds_file))
+
+    assert concurrent.file_count == serial.file_count
+    for index in range(serial.file_count):
+        assert (tmp_path / f"parallel_{index}.sh").read_bytes() == (
+            tmp_path / f"serial_{index}.sh"
+        ).read_bytes()
+    assert concurrent.domain_counts == serial.domain_counts
+    assert concurrent.domains == serial.domains
+    assert concurrent.duplicate_count == serial.duplicate_count
@@ -1,6 +1,8 @@
 from typing import Dict, Union
 import pytest
 from unittest.mock import patch, mock_open, call
+from core.domains import DomainRegistry
+from core.hosts import HostPatterns, get_host_matcher, validate_host_patterns
 from core.pymap_core import ScriptGenerator
 
 config_type = Dict[str, Union[list[list[str]], str]]
@@ -177,3 +179,83 @@ def test_match_domain_fail(mock_generator: ScriptGenerator) -> None:
     r2 = mock_generator.match_domain("user@example LR`T@example.rdfgha")
     assert r1 is None
     assert r2 is None
+
+
+def test_domain_counts(mock_generator: ScriptGenerator) -> None:
+    strings = [
+        "user1@example.com pass1",
+        "user2@example.org pass2",
+        "user3@example.com pass3",
+        "invalid",
+    ]
+    mock_generator.process_strings(strings)
+    assert mock_generator.domains == ["example.com", "example.org"]
+    assert mock_generator.domain_counts == {"example.com": 2, "example.org": 1}
+    assert mock_generator.domain_registry.summary() == (
+        "example.com (2), example.org (1)"
+    )
+
+
+def test_domain_registry_merge() -> None:
+    first = DomainRegistry()
+    first.add("example.com")
+    second = DomainRegistry()
+    second.add("example.org", 2)
+    second.add("example.com")
+    first.merge(second)
+    assert first.to_list() == ["example.com", "example.org"]
+    assert first.counts() == {"example.com": 2, "example.org": 2}
+    assert "example.org" in first
+    assert first.count("example.net") == 0
+
+
+def test_verify_host_user_patterns_take_precedence(mock_config: config_type) -> None:
+    generator = ScriptGenerator(
+        "sv01",
+        "vm2",
+        config=mock_config,
+        additional_known_hosts=[
+            ["^sv[0-9]+$", ".user.com"],
+            ["^(vm[0-9]*|vps)$", ".example.org"],
+        ],
+    )
+    assert generator.host1 == "sv01.user.com"
+    assert generator.host2 == "vm2.example.org"
+
+
+def test_verify_host_skips_invalid_patterns(mock_generator: ScriptGenerator) -> None:
+    mock_generator.additional_known_hosts = [["^(sv", ".broken.com"], "not a pair"]
+    assert mock_generator.verify_host("sv00") == "sv00.example.com"
+
+
+@pytest.mark.parametrize(
+    "patterns,combined",
+    [
+        ((("^sv[0-9]+$", ".a.com"), ("^(?P<name>vps)$", ".b.com")), True),
+        # Backreferences and global flags can't be safely combined
+        ((("^(sv)\\1$", ".a.com"), ("^vps$", ".b.com")), False),
+        ((("(?i)^sv$", ".a.com"), ("^vps$", ".b.com")), False),
+        ((("^(s)?(?(1)v|x)$", ".a.com"), ("^vps$", ".b.com")), False),
+        ((("^(?P<s>s)?(?(s)v|x)$", ".a.com"), ("^vps$", ".b.com")), False),
+    ],
+)
+def test_host_matcher(patterns: HostPatterns, combined: bool) -> None:
+    matcher = get_host_matcher(patterns)
+    assert get_host_matcher(patterns) is matcher
+    assert (matcher.combined is not None) == combined
+    assert matcher.match("vps") == patterns[1]
+    assert matcher.match("server") is None
+
+
+@pytest.mark.parametrize(
+    "patterns",
+    [
+        "^sv$",
+        [["^sv$"]],
+        [["^sv$", 1]],
+        [["^(sv", ".example.com"]],
+    ],
+)
+def test_validate_host_patterns(patterns: object) -> None:
+    with pytest.raises(ValueError):
+        validate_host_patterns(patterns)
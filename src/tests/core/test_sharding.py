@@ -0,0 +1,170 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pytest
+
+from core import parallel
+from core.pymap_core import ScriptGenerator
+from core.sharding import DomainShardWriter, ShardWriter
+from core.tokenizer import split_size_hint
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        ("user@example.com pass 1024", ("user@example.com pass", 1024)),
+        ("user@example.com pass\t2K\n", ("user@example.com pass", 2048)),
+        ("user@example.com pass | 1.5GiB", ("user@example.com pass", 1610612736)),
+        ("u@a.com p1 u@b.com p2,3mb", ("u@a.com p1 u@b.com p2", 3145728)),
+        ("user@example.com pass", ("user@example.com pass", None)),
+        ("user@example.com 1024", ("user@example.com", 1024)),
+        ("1024", ("1024", None)),
+        ("user@example.com pass 10X", ("user@example.com pass 10X", None)),
+    ],
+)
+def test_split_size_hint(line: str, expected: tuple[str, Optional[int]]) -> None:
+    assert split_size_hint(line) == expected
+
+
+@pytest.mark.parametrize(
+    "account,domain",
+    [
+        ("user@Example.COM", "example.com"),
+        ("user", "unknown"),
+        ("user@", "unknown"),
+        ("user@../../etc", ".._.._etc"),
+    ],
+)
+def test_domain_of(account: str, domain: str) -> None:
+    assert DomainShardWriter.domain_of(account) == domain
+
+
+def read_shards(directory: Path) -> Dict[str, List[str]]:
+    return {
+        path.name: path.read_text().splitlines()
+        for path in sorted(directory.glob("out_*.sh"))
+    }
+
+
+@pytest.fixture
+def creds_file(tmp_path: Path) -> Path:
+    path = tmp_path / "creds.txt"
+    path.write_text(
+        "a@one.com p1 a@new.com p1 40\n"
+        "b@two.com p2 b@new.com p2 10\n"
+        "c@one.com p3 c@old.com p3 30\n"
+        "d@two.com p4 d@new.com p4 20\n"
+        "e@one.com p5 e@old.com p5\n"
+        "\n"
+        "f@three.com p6 f@old.com p6 1K\n"
+    )
+    return path
+
+
+@pytest.mark.parametrize(
+    "shard_by,expected",
+    [
+        (
+            "source",
+            {
+                "out_one.com.sh": ["a@one.com", "c@one.com", "e@one.com"],
+                "out_three.com.sh": ["f@three.com"],
+                "out_two.com.sh": ["b@two.com", "d@two.com"],
+            },
+        ),
+        (
+            "destination",
+            {
+                "out_new.com.sh": ["a@one.com", "b@two.com", "d@two.com"],
+                "out_old.com.sh": ["c@one.com", "e@one.com", "f@three.com"],
+            },
+        ),
+    ],
+)
+def test_domain_sharding(
+    creds_file: Path, tmp_path: Path, shard_by: str, expected: Dict[str, List[str]]
+) -> None:
+    generator = ScriptGenerator(
+        "host1",
+        "host2",
+        destination=str(tmp_path / "out"),
+        shard_by=shard_by,
+        size_hint=True,
+    )
+    generator.process_file(str(creds_file))
+    shards = read_shards(tmp_path)
+    assert {
+        name: [line.split(" ")[4] for line in lines] for name, lines in shards.items()
+    } == expected
+    assert generator.file_count == len(expected)
+
+
+def test_size_sharding(creds_file: Path, tmp_path: Path) -> None:
+    generator = ScriptGenerator(
+        "host1",
+        "host2",
+        destination=str(tmp_path / "out"),
+        shard_by="size",
+        shards=2,
+        size_hint=True,
+    )
+    generator.process_file(str(creds_file))
+    shards = read_shards(tmp_path)
+    # e has no hint and counts as the average of the others: 1124 / 5 = 224
+    assert {
+        name: [line.split(" ")[4] for line in lines] for name, lines in shards.items()
+    } == {
+        "out_0.sh": ["f@three.com"],
+        "out_1.sh": ["e@one.com", "a@one.com", "c@one.com", "d@two.com", "b@two.com"],
+    }
+    # The size column is not part of the password
+    assert "--password1 'p1'" in shards["out_1.sh"][1]
+
+
+def test_sharding_parallel_matches_serial(
+    creds_file: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    creds_file.write_text(creds_file.read_text() * 20)
+    monkeypatch.setattr(parallel, "MIN_RANGE_SIZE", 256)
+    outputs = []
+    for workers in (1, 3):
+        directory = tmp_path / str(workers)
+        directory.mkdir()
+        ScriptGenerator(
+            "host1",
+            "host2",
+            destination=str(directory / "out"),
+            shard_by="destination",
+            size_hint=True,
+            workers=workers,
+        ).process_file(str(creds_file))
+        outputs.append(read_shards(directory))
+    assert outputs[0] == outputs[1]
+
+
+def test_shard_writer_reopens_evicted_handles(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(ShardWriter, "MAX_OPEN_HANDLES", 2)
+    generator = ScriptGenerator("host1", "host2", destination=str(tmp_path / "out"))
+    with DomainShardWriter(generator, destination=False) as writer:
+        for shard in ["a", "b", "c", "a", "b", "a"]:
+            writer.write(shard, shard)
+            assert len(writer.handles) <= 2
+    assert read_shards(tmp_path) == {
+        "out_a.sh": ["a", "a", "a"],
+        "out_b.sh": ["b", "b"],
+        "out_c.sh": ["c"],
+    }
+    assert generator.file_count == 3
+
+
+def test_shard_writer_is_abstract() -> None:
+    generator = ScriptGenerator("host1", "host2")
+    with pytest.raises(TypeError):
+        ShardWriter(generator)  # type: ignore[abstract]
+
+
+def test_unknown_shard_strategy() -> None:
+    with pytest.raises(ValueError):
+        ScriptGenerator("host1", "host2", shard_by="random")
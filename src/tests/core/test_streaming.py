@@ -0,0 +1,56 @@
+import asyncio
+from typing import AsyncGenerator, List
+
+import pytest
+
+from core.jobs import Job
+from core.pymap_core import ScriptGenerator
+from core.streaming import iter_lines
+from scripts.utils import generate_line_creds
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("", []),
+        ("a", ["a"]),
+        ("a\nb\n", ["a", "b"]),
+        ("a\r\nb\r\n\r\nc", ["a", "b", "", "c"]),
+        ("a\rb\n", ["a\rb"]),
+    ],
+)
+def test_iter_lines(text: str, expected: List[str]) -> None:
+    assert list(iter_lines(text)) == expected
+
+
+async def async_lines(lines: List[str]) -> AsyncGenerator[str, None]:
+    for line in lines:
+        await asyncio.sleep(0)
+        yield line
+
+
+async def collect_batches(
+    generator: ScriptGenerator, source: object, size: int
+) -> List[List[Job]]:
+    return [batch async for batch in generator.abatches(source, size)]  # type: ignore
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_abatches_match_process_jobs(asynchronous: bool) -> None:
+    lines = generate_line_creds(25) + ["", "invalid"] + generate_line_creds(10, "d")
+    lines += lines[:5]
+    expected = ScriptGenerator("host1", "host2", deduplicate=True).process_jobs(lines)
+
+    generator = ScriptGenerator("host1", "host2", deduplicate=True)
+    source = async_lines(lines) if asynchronous else iter(lines)
+    batches = asyncio.run(collect_batches(generator, source, 7))
+
+    assert [len(batch) for batch in batches] == [7, 7, 7, 7, 7]
+    assert [job for batch in batches for job in batch] == expected
+    assert generator.duplicate_count == 5
+    assert generator.domain_counts == {"example.com": 35}
+
+
+def test_abatches_empty_input() -> None:
+    generator = ScriptGenerator("host1", "host2")
+    assert asyncio.run(collect_batches(generator, iter_lines(""), 10)) == []
@@ -0,0 +1,76 @@
+import time
+from typing import Optional, Tuple
+import pytest
+from core.tokenizer import Credentials, tokenize_line
+from benchmarks.tokenizer import ADVERSARIAL_LINES, LEGACY_WHOLE_STRING_ID
+
+from tests import RANDOM_VALID_CREDS, RANDOM_VALID_CREDS_2
+
+
+@pytest.mark.parametrize(
+    "test_input,expected",
+    [
+        ("", None),
+        ("random.email@gmail.com", None),
+        ("user@example.com", None),
+        (" user@example.com pass", None),
+        ("user@example.com pass\nother", None),
+        ("user@example.com pass", ("user", "@example.com", "pass")),
+        ("user@example.com pass\n", ("user", "@example.com", "pass")),
+        ("user@example.com ", ("user", "@example.com", "")),
+        ("user@example.com,|\tpass word", ("user", "@example.com", "pass word")),
+        (
+            "u1@d1.com p1 u2@d2.com p2",
+            ("u1", "@d1.com", "p1", "u2", "@d2.com", "p2"),
+        ),
+        (
+            "u1@d1.com\tp 1|u2@d2.com,p 2\n",
+            ("u1", "@d1.com", "p 1", "u2", "@d2.com", "p 2"),
+        ),
+        (
+            "u1@d1.com p1 u2@d2.com  ",
+            ("u1", "@d1.com", "p1", "u2", "@d2.com", " "),
+        ),
+        ("u1@d1.com p1 u2@d2.com ", ("u1", "@d1.com", "p1 u2@d2.com ")),
+        ("u1@d1.com p1 u2@d2.com! p2", ("u1", "@d1.com", "p1 u2@d2.com! p2")),
+    ],
+)
+def test_tokenize_line(test_input: str, expected: Optional[Tuple[str, ...]]) -> None:
+    result = tokenize_line(test_input)
+    if expected is None:
+        assert result is None
+    else:
+        assert result == Credentials(*expected)
+
+
+@pytest.mark.parametrize(
+    "test_input",
+    RANDOM_VALID_CREDS
+    + RANDOM_VALID_CREDS_2
+    + [
+        "a@b.c  p@ss w0rd  c@d.e  p|a,s s",
+        "first.last-1@sub.domain.tld p'a\"ss c@d.e",
+        "user@example.com p1 x@y.z\tp2 u@v.w p3",
+        "úser@dómain.pt pässwörd",
+    ],
+)
+def test_tokenize_line_matches_legacy_expression(test_input: str) -> None:
+    has_match = LEGACY_WHOLE_STRING_ID.match(test_input)
+    assert has_match is not None
+    assert tokenize_line(test_input) == Credentials(
+        has_match.group("user1"),
+        has_match.group("domain1"),
+        has_match.group("pword1"),
+        has_match.group("user2"),
+        has_match.group("domain2"),
+        has_match.group("pword2"),
+    )
+
+
+@pytest.mark.parametrize("case", ADVERSARIAL_LINES.keys())
+def test_tokenize_line_bounded_latency(case: str) -> None:
+    # ~200k characters, the legacy expression takes minutes on some of these
+    line = ADVERSARIAL_LINES[case](20000)
+    start = time.perf_counter()
+    tokenize_line(line)
+    assert time.perf_counter() - start < 0.5
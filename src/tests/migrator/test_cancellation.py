@@ -0,0 +1,147 @@
+import os
+import socket
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from redis.exceptions import ConnectionError
+
+from migrator.utilites.cancellation import (
+    FALLBACK_INTERVAL,
+    CancellationWatcher,
+    cancel_key,
+    request_cancel,
+)
+from migrator.utilites.supervisor import ProcessSupervisor
+
+
+class FakePubSub:
+    def __init__(self, server: "FakeRedis") -> None:
+        self.server = server
+        self.messages: List[Dict[str, Any]] = []
+        self.connection = None
+
+    def subscribe(self, channel: str) -> None:
+        if self.server.down:
+            raise ConnectionError("down")
+        self.server.subscribers.setdefault(channel, []).append(self)
+        self.messages.append({"type": "subscribe", "channel": channel, "data": 1})
+
+    def get_message(self, timeout: float = 0.0) -> Optional[Dict[str, Any]]:
+        if self.server.down:
+            raise ConnectionError("down")
+        return self.messages.pop(0) if self.messages else None
+
+    def close(self) -> None:
+        for subscribers in self.server.subscribers.values():
+            if self in subscribers:
+                subscribers.remove(self)
+
+
+class FakeRedis:
+    """
+    Only what cancellation uses, the pipeline runs every command right away
+    """
+
+    def __init__(self) -> None:
+        self.keys: Dict[str, Any] = {}
+        self.subscribers: Dict[str, List[FakePubSub]] = {}
+        self.results: List[Any] = []
+        self.down = False
+
+    def pubsub(self) -> FakePubSub:
+        return FakePubSub(self)
+
+    def pipeline(self) -> "FakeRedis":
+        self.results = []
+        return self
+
+    def execute(self) -> List[Any]:
+        return self.results
+
+    def exists(self, key: str) -> int:
+        return int(key in self.keys)
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None) -> None:
+        self.keys[key] = value
+        self.results.append(True)
+
+    def publish(self, channel: str, data: str) -> None:
+        subscribers = self.subscribers.get(channel, [])
+        for pubsub in subscribers:
+            pubsub.messages.append(
+                {"type": "message", "channel": channel, "data": data}
+            )
+        self.results.append(len(subscribers))
+
+
+def test_cancel_reaches_subscribed_task() -> None:
+    client = FakeRedis()
+    watcher = CancellationWatcher(client, "task")
+    other = CancellationWatcher(client, "other")
+    assert not watcher.check()
+    assert request_cancel(client, "task") == 1
+    assert watcher.check()
+    assert not other.check()
+    watcher.close()
+    assert client.subscribers[cancel_key("task")] == []
+
+
+def test_cancel_before_subscribing() -> None:
+    client = FakeRedis()
+    assert request_cancel(client, "task") == 0
+    assert CancellationWatcher(client, "task").check()
+
+
+def test_fallback_when_redis_is_down() -> None:
+    client = FakeRedis()
+    client.down = True
+    now = [0.0]
+    calls: List[bool] = []
+
+    def fallback() -> bool:
+        calls.append(True)
+        return len(calls) > 1
+
+    watcher = CancellationWatcher(client, "task", fallback, clock=lambda: now[0])
+    assert watcher.pubsub is None
+    assert not watcher.check()
+    # The database is only read once per interval
+    assert not watcher.check()
+    assert len(calls) == 1
+    now[0] += FALLBACK_INTERVAL
+    assert watcher.check()
+    assert len(calls) == 2
+
+
+def test_fallback_after_losing_the_subscription() -> None:
+    client = FakeRedis()
+    watcher = CancellationWatcher(client, "task", lambda: True)
+    assert not watcher.check()
+    client.down = True
+    assert watcher.check()
+    assert watcher.pubsub is None
+
+
+def test_lost_subscription_is_unwatched() -> None:
+    client = FakeRedis()
+    watcher = CancellationWatcher(client, "task", lambda: False)
+    sock, peer = socket.socketpair()
+    watcher.pubsub.connection = SimpleNamespace(_sock=sock)
+    supervisor = ProcessSupervisor(use_pidfd=False)
+    try:
+        watcher.attach(supervisor)
+        fileno = sock.fileno()
+        assert fileno in supervisor.selector.get_map()
+        client.down = True
+        assert not watcher.check()
+        assert fileno not in supervisor.selector.get_map()
+        # The kernel reuses the number of the closed socket
+        sock.close()
+        read_end, write_end = os.pipe()
+        assert read_end == fileno
+        assert supervisor.watch(read_end)
+        os.close(read_end)
+        os.close(write_end)
+    finally:
+        supervisor.close()
+        peer.close()
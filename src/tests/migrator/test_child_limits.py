@@ -0,0 +1,91 @@
+import os
+import signal
+import sys
+
+from migrator.utilites.child_limits import (
+    LIMIT_CPU,
+    LIMIT_MEMORY,
+    LIMIT_OPEN_FILES,
+    ChildLimits,
+    parse_child_limits,
+    read_tail,
+)
+from migrator.utilites.resources import ResourceUsage
+from migrator.utilites.supervisor import ProcessSupervisor
+
+
+def test_parse_child_limits() -> None:
+    assert not parse_child_limits(None).enabled
+    assert not parse_child_limits([["MEMORY", 1]]).enabled
+    limits = parse_child_limits(
+        {"MEMORY": 256, "CPU_TIME": 60, "NICE": 5, "IONICE": "idle"}
+    )
+    assert limits == ChildLimits(
+        memory=256 * 1024 * 1024, cpu_time=60, nice=5, ionice_class=3
+    )
+    # Malformed entries are dropped, the rest is kept
+    limits = parse_child_limits(
+        {
+            "MEMORY": "1G",
+            "CPU_TIME": -1,
+            "OPEN_FILES": 64,
+            "NICE": 40,
+            "IONICE": ["idle"],
+            "IONICE_LEVEL": 9,
+        }
+    )
+    assert limits == ChildLimits(open_files=64)
+
+
+def test_exceeded() -> None:
+    limits = ChildLimits(memory=1024, cpu_time=10, open_files=64)
+    busy = ResourceUsage(9.0, 2.0, 100, "wait4")
+    assert limits.exceeded(0, busy, b"Out of memory!") is None
+    assert limits.exceeded(-signal.SIGXCPU, None) == LIMIT_CPU
+    assert limits.exceeded(-signal.SIGKILL, busy) == LIMIT_CPU
+    assert limits.exceeded(-signal.SIGKILL, busy._replace(user_cpu=1.0)) is None
+    assert limits.exceeded(1, None, b"...\nOut of memory!\n") == LIMIT_MEMORY
+    assert limits.exceeded(1, None, b"Too many open files") == LIMIT_OPEN_FILES
+    assert limits.exceeded(1, None, b"Authentication failed") is None
+    assert ChildLimits().exceeded(-signal.SIGXCPU, None, b"Out of memory!") is None
+
+
+def run(limits: ChildLimits, code: str) -> tuple:
+    supervisor = ProcessSupervisor()
+    options = limits.popen_options()
+    try:
+        supervisor.spawn("0", [sys.executable, "-c", code], **options)
+        exits = []
+        while not exits:
+            exits = supervisor.wait(timeout=30)
+        child = exits[0]
+        stderr = read_tail(options.get("stderr"))
+        return child.returncode, limits.exceeded(child.returncode, child.usage, stderr)
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+        if "stderr" in options:
+            options["stderr"].close()
+
+
+def test_limits_are_applied_to_the_child() -> None:
+    limits = ChildLimits(memory=512 * 1024 * 1024, open_files=32, nice=5)
+    code = (
+        "import os, resource, sys\n"
+        f"assert resource.getrlimit(resource.RLIMIT_AS)[0] == {limits.memory}\n"
+        "assert resource.getrlimit(resource.RLIMIT_NOFILE)[0] == 32\n"
+        f"assert os.nice(0) == min(19, {os.nice(0)} + 5)\n"
+    )
+    assert run(limits, code) == (0, None)
+
+
+def test_cpu_limit_hit() -> None:
+    returncode, limit = run(ChildLimits(cpu_time=1), "while True: pass")
+    assert returncode == -signal.SIGXCPU
+    assert limit == LIMIT_CPU
+
+
+def test_memory_limit_hit() -> None:
+    # Perl reports "Out of memory!" when imapsync can't allocate
+    code = "import sys; sys.stderr.write('Out of memory!\\n'); sys.exit(1)"
+    assert run(ChildLimits(memory=512 * 1024 * 1024), code) == (1, LIMIT_MEMORY)
@@ -0,0 +1,103 @@
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+from migrator.utilites.concurrency import COOLDOWN, ConcurrencyController, free_memory
+
+
+class Host:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.load: Optional[float] = 0.5
+        self.memory: Optional[float] = 0.5
+
+    def controller(self, **config: float) -> ConcurrencyController:
+        return ConcurrencyController(
+            config,
+            load=lambda: self.load,
+            memory=lambda: self.memory,
+            clock=lambda: self.now,
+        )
+
+
+def step(host: Host, controller: ConcurrencyController, exits: int) -> str:
+    controller.record_exit(exits)
+    host.now += controller.interval
+    decision = controller.update()
+    assert decision is not None
+    return str(decision["action"])
+
+
+def test_limits_from_config() -> None:
+    host = Host()
+    controller = host.controller(FLOOR=3, CEILING=4, INITIAL=10)
+    assert (controller.floor, controller.ceiling, controller.limit) == (3, 4, 4)
+    assert host.controller(FLOOR=0, CEILING=0).limit == 1
+
+
+def test_no_decision_before_interval() -> None:
+    host = Host()
+    controller = host.controller(INTERVAL=30)
+    host.now = 29
+    assert controller.update() is None
+    host.now = 30
+    assert controller.update() is not None
+
+
+def test_grows_up_to_ceiling() -> None:
+    host = Host()
+    controller = host.controller(INITIAL=5, CEILING=7)
+    actions = [step(host, controller, 10) for _ in range(4)]
+    assert actions == ["grow", "grow", "hold", "hold"]
+    assert controller.limit == 7
+
+
+@pytest.mark.parametrize(
+    "load,memory,reason",
+    [(2.0, 0.5, "load"), (0.5, 0.05, "memory"), (None, 0.05, "memory")],
+)
+def test_shrinks_on_pressure(
+    load: Optional[float], memory: Optional[float], reason: str
+) -> None:
+    host = Host()
+    controller = host.controller(INITIAL=12, FLOOR=2)
+    host.load, host.memory = load, memory
+    assert step(host, controller, 0) == "shrink"
+    assert controller.limit == 9
+    assert controller.history[-1]["reason"] == reason
+    for _ in range(10):
+        step(host, controller, 0)
+    assert controller.limit == 2
+
+
+def test_steps_back_when_throughput_drops() -> None:
+    host = Host()
+    controller = host.controller(INITIAL=5)
+    assert step(host, controller, 10) == "grow"
+    assert step(host, controller, 5) == "shrink"
+    assert controller.limit == 5
+    actions: List[str] = [step(host, controller, 5) for _ in range(COOLDOWN)]
+    assert actions == ["hold"] * COOLDOWN
+    assert step(host, controller, 5) == "grow"
+
+
+def test_meta() -> None:
+    host = Host()
+    controller = host.controller(INITIAL=5)
+    step(host, controller, 15)
+    meta = controller.meta()
+    assert meta["limit"] == 6
+    assert meta["decisions"][-1]["throughput"] == 30.0
+    assert meta["decisions"][-1]["per_child"] == 6.0
+
+
+def test_free_memory(tmp_path: Path) -> None:
+    meminfo = tmp_path / "meminfo"
+    meminfo.write_text(
+        "MemTotal:       1000 kB\nMemFree:         100 kB\nMemAvailable:    250 kB\n"
+    )
+    assert free_memory(str(meminfo)) == 0.25
+    meminfo.write_text("MemTotal:       1000 kB\n")
+    assert free_memory(str(meminfo)) is None
+    assert free_memory(str(tmp_path / "missing")) is None
@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+from typing import List
+
+import gevent
+
+from migrator.utilites.child_limits import LIMIT_MEMORY, ChildLimits, read_tail
+from migrator.utilites.cooperative import (
+    GeventSupervisor,
+    gevent_mode,
+    make_supervisor,
+    run_blocking,
+)
+from migrator.utilites.supervisor import ProcessSupervisor
+
+
+def sleeper(seconds: float, code: int = 0) -> List[str]:
+    return [
+        sys.executable,
+        "-c",
+        f"import sys, time; time.sleep({seconds}); sys.exit({code})",
+    ]
+
+
+def test_modes() -> None:
+    assert gevent_mode("gevent")
+    assert not gevent_mode("selectors")
+    # The tests don't monkey patch
+    assert not gevent_mode("auto")
+    assert not gevent_mode("threads")
+    assert isinstance(make_supervisor("gevent"), GeventSupervisor)
+    assert type(make_supervisor(None)) is ProcessSupervisor
+
+
+def test_run_blocking() -> None:
+    assert run_blocking(sum, [1, 2]) == 3
+    assert run_blocking(sum, [1, 2], cooperative=True) == 3
+
+
+def test_wait_returns_as_soon_as_a_child_exits() -> None:
+    supervisor = GeventSupervisor()
+    try:
+        supervisor.spawn("slow", sleeper(5))
+        supervisor.spawn("fast", sleeper(0.2, 3))
+        start = time.monotonic()
+        exits = supervisor.wait(timeout=4)
+        assert time.monotonic() - start < 2
+        assert [(child.key, child.returncode) for child in exits] == [("fast", 3)]
+        assert 0.1 < exits[0].duration < 2
+        assert len(supervisor) == 1
+        start = time.monotonic()
+        assert supervisor.wait(timeout=0.3) == []
+        assert 0.25 < time.monotonic() - start < 2
+        supervisor.terminate_all()
+        assert [child.key for child in supervisor.wait(timeout=4)] == ["slow"]
+        assert not supervisor
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+
+
+def test_output_and_usage() -> None:
+    supervisor = GeventSupervisor()
+    received: List[bytes] = []
+    code = (
+        "import time\n"
+        "data = bytearray(50 * 1024 * 1024)\n"
+        "print('x' * 100000, flush=True)\n"
+        "end = time.process_time() + 0.3\n"
+        "while time.process_time() < end: pass\n"
+        "time.sleep(0.3)\n"
+        "print('last')\n"
+    )
+    try:
+        supervisor.spawn("0", [sys.executable, "-c", code], output=received.append)
+        exits: List = []
+        while not exits:
+            exits = supervisor.wait(timeout=10)
+        assert b"".join(received) == b"x" * 100000 + b"\nlast\n"
+        usage = exits[0].usage
+        assert usage is not None and usage.source == "wait4"
+        assert usage.cpu >= 0.2
+        assert usage.max_rss > 40 * 1024
+    finally:
+        supervisor.close()
+
+
+def test_limits_are_applied_after_spawn() -> None:
+    supervisor = GeventSupervisor()
+    limits = ChildLimits(memory=512 * 1024 * 1024, open_files=32, nice=5)
+    options = limits.popen_options()
+    code = (
+        "import os, resource, sys\n"
+        f"assert resource.getrlimit(resource.RLIMIT_AS)[0] == {limits.memory}\n"
+        "assert resource.getrlimit(resource.RLIMIT_NOFILE)[0] == 32\n"
+        f"assert os.nice(0) == min(19, {os.nice(0)} + 5)\n"
+        "sys.stderr.write('Out of memory!\\n')\n"
+        "sys.exit(1)\n"
+    )
+    try:
+        supervisor.spawn("0", [sys.executable, "-c", code], **options)
+        exits: List = []
+        while not exits:
+            exits = supervisor.wait(timeout=10)
+        child = exits[0]
+        stderr = read_tail(options["stderr"])
+        assert child.returncode == 1, stderr
+        assert limits.exceeded(child.returncode, child.usage, stderr) == LIMIT_MEMORY
+    finally:
+        supervisor.close()
+        options["stderr"].close()
+
+
+def test_children_reaped_elsewhere() -> None:
+    supervisor = GeventSupervisor(use_pidfd=False)
+    try:
+        proc = supervisor.spawn("0", sleeper(0.1, 4))
+        # Like gevent's SIGCHLD handler, before the supervisor gets to it
+        os.waitpid(proc.pid, 0)
+        exits = supervisor.wait(timeout=4)
+        # gevent would know the status, nobody does here
+        assert [(child.key, child.returncode) for child in exits] == [("0", -1)]
+        assert exits[0].usage is None
+    finally:
+        supervisor.close()
+
+
+def test_waiting_doesnt_block_other_greenlets() -> None:
+    supervisor = GeventSupervisor()
+    ticks: List[float] = []
+
+    def ticker() -> None:
+        for _ in range(10):
+            gevent.sleep(0.05)
+            ticks.append(time.monotonic())
+
+    try:
+        supervisor.spawn("0", sleeper(0.8))
+        greenlet = gevent.spawn(ticker)
+        exits = supervisor.wait(timeout=5)
+        greenlet.join()
+        assert [child.key for child in exits] == ["0"]
+        # The ticker ran while the task waited
+        assert len(ticks) == 10
+        assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.3
+    finally:
+        supervisor.close()
+
+
+def test_watched_descriptor_wakes_wait() -> None:
+    supervisor = GeventSupervisor()
+    read_end, write_end = os.pipe()
+    try:
+        supervisor.spawn("slow", sleeper(5))
+        supervisor.watch(read_end)
+        gevent.spawn_later(0.2, os.write, write_end, b"x")
+        start = time.monotonic()
+        assert supervisor.wait(timeout=4) == []
+        assert time.monotonic() - start < 2
+        assert len(supervisor) == 1
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+        os.close(read_end)
+        os.close(write_end)
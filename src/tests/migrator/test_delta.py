@@ -0,0 +1,51 @@
+import shlex
+from datetime import datetime, timedelta, timezone
+
+from core.jobs import Job
+from migrator.utilites.delta import delta_job, delta_maxage, with_maxage
+
+START = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def test_delta_maxage() -> None:
+    assert delta_maxage(START, START + timedelta(hours=3)) == 2
+    assert delta_maxage(START, START + timedelta(days=1)) == 2
+    assert delta_maxage(START, START + timedelta(days=6, minutes=1)) == 8
+    assert delta_maxage(START, START + timedelta(days=2), margin=0) == 2
+    # Clocks that went backwards still copy the last day
+    assert delta_maxage(START, START - timedelta(hours=1), margin=0) == 1
+
+
+def test_with_maxage_replaces_the_previous_one() -> None:
+    argv = ["imapsync", "--host1", "a", "--maxage", "9", "--log"]
+    assert with_maxage(argv, 3) == [
+        "imapsync",
+        "--host1",
+        "a",
+        "--log",
+        "--maxage",
+        "3",
+    ]
+    assert with_maxage(["imapsync", "--maxage=9"], 3) == ["imapsync", "--maxage", "3"]
+    assert argv[-2:] == ["9", "--log"]
+
+
+def test_delta_job() -> None:
+    job = Job(["imapsync", "--password1", "p w", "--log"], "a.log", "u", "v", 10)
+    delta = delta_job(job.to_dict(), 2)
+    assert isinstance(delta, dict)
+    assert Job.from_dict(delta) == job._replace(argv=job.argv + ["--maxage", "2"])
+
+    line = "imapsync --password1 'p w' --maxage 5 --logdir=/var/log/pymap"
+    delta = delta_job(line, 2)
+    assert isinstance(delta, str)
+    assert shlex.split(delta) == [
+        "imapsync",
+        "--password1",
+        "p w",
+        "--logdir=/var/log/pymap",
+        "--maxage",
+        "2",
+    ]
+    assert delta_job("imapsync 'unclosed", 2) == "imapsync 'unclosed"
+    assert delta_job({"argv": "imapsync"}, 2) == {"argv": "imapsync"}
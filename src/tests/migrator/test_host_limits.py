@@ -0,0 +1,151 @@
+from typing import Any, Callable, List, Optional, Set
+
+from redis.exceptions import ConnectionError
+
+from migrator.utilites.host_limits import (
+    HostLimiter,
+    HostScheduler,
+    job_hosts,
+    parse_host_limits,
+)
+
+
+def argv(host1: str, host2: str) -> List[str]:
+    return ["imapsync", "--host1", host1, "--user1", "u", "--host2", host2, "--log"]
+
+
+def test_job_hosts() -> None:
+    assert job_hosts(argv("a.com", "b.com")) == ("a.com", "b.com")
+    assert job_hosts(["imapsync", "--host1"]) == (None, None)
+
+
+def test_parse_host_limits() -> None:
+    limits = parse_host_limits(
+        [["^a", 2], ["(", 1], ["^b", 0], ["^c", "3"], "d", ["^e", 4, 5], [".*", 9]]
+    )
+    assert [(pattern.pattern, limit) for pattern, limit in limits] == [
+        ("^a", 2),
+        (".*", 9),
+    ]
+    assert parse_host_limits(None) == []
+
+
+def test_limiter_without_limits_never_blocks() -> None:
+    limiter = HostLimiter(None, None, "task")
+    assert not limiter.enabled
+    assert limiter.acquire("0", argv("a.com", "b.com"))
+    assert limiter.limit_for("a.com") is None
+    limiter.release("0")
+
+
+class FlakyRedis:
+    """
+    Runs the acquire script while <up>, every other call fails
+    """
+
+    def __init__(self) -> None:
+        self.up = False
+        self.scripts = 0
+
+    def register_script(self, script: str) -> Callable[..., int]:
+        def run(keys: List[str], args: List[Any]) -> int:
+            self.scripts += 1
+            if not self.up:
+                raise ConnectionError("Connection refused")
+            return 1
+
+        return run
+
+    def pipeline(self) -> Any:
+        raise ConnectionError("Connection refused")
+
+
+def test_limiter_without_redis_does_not_enforce_limits() -> None:
+    client = FlakyRedis()
+    limiter = HostLimiter(client, [["^a", 1]], "task")
+    assert limiter.acquire("0", argv("a", "b"))
+    assert limiter.acquire("1", argv("a", "b"))
+    # Redis isn't tried again right away
+    assert client.scripts == 1
+    assert limiter.held == {}
+
+    client.up = True
+    limiter.unavailable_until = 0
+    assert limiter.acquire("2", argv("a", "b"))
+    assert list(limiter.held) == ["2"]
+    limiter.last_refresh = 0
+    limiter.refresh()
+    limiter.release("2")
+    assert limiter.held == {}
+    assert limiter.unavailable_until > 0
+
+
+class FakeLimiter(HostLimiter):
+    """
+    Hosts in <full> never have capacity
+    """
+
+    def __init__(self, full: Set[str]) -> None:
+        super().__init__(None, None, "task")
+        self.full = full
+
+    @property
+    def enabled(self) -> bool:
+        return True
+
+    def acquire(self, key: str, argv: List[str]) -> bool:
+        return not self.full.intersection(filter(None, job_hosts(argv)))
+
+
+def test_scheduler_skips_jobs_for_full_hosts() -> None:
+    jobs = [(str(i), argv(host, "z.com")) for i, host in enumerate("abacb")]
+    limiter = FakeLimiter({"a"})
+    scheduler = HostScheduler(jobs, limiter)
+    picked: List[Optional[str]] = []
+    while True:
+        job = scheduler.next_runnable()
+        if job is None:
+            break
+        picked.append(job[0])
+    assert picked == ["1", "3", "4"]
+    assert scheduler.blocked
+    assert not scheduler.done
+
+    limiter.full.clear()
+    assert scheduler.next_runnable() == ("0", argv("a", "z.com"))
+    assert scheduler.next_runnable() == ("2", argv("a", "z.com"))
+    assert scheduler.next_runnable() is None
+    assert not scheduler.blocked
+    assert scheduler.done
+
+
+def test_scheduler_without_limits_keeps_order() -> None:
+    jobs = [(str(i), argv("a", "b")) for i in range(3)]
+    scheduler = HostScheduler(iter(jobs), HostLimiter(None, None, "task"))
+    assert [scheduler.next_runnable() for _ in range(4)] == jobs + [None]
+    assert scheduler.done
+
+
+def test_scheduler_hands_out_deferred_jobs_when_due() -> None:
+    now = [100.0]
+    jobs = [(str(i), argv("a", "b")) for i in range(2)]
+    scheduler = HostScheduler(jobs, HostLimiter(None, None, "task"), lambda: now[0])
+    first = scheduler.next_runnable()
+    assert first == jobs[0]
+    scheduler.defer(first, 130.0)
+    assert scheduler.next_due() == 30.0
+    assert scheduler.next_runnable() == jobs[1]
+    assert scheduler.next_runnable() is None
+    assert not scheduler.blocked
+    assert not scheduler.done
+
+    now[0] = 130.0
+    assert scheduler.next_due() == 0.0
+    assert scheduler.next_runnable() == jobs[0]
+    assert scheduler.next_due() is None
+    assert scheduler.done
+
+    scheduler.defer(jobs[1], 200.0)
+    scheduler.defer(jobs[0], 150.0)
+    assert scheduler.drop_deferred() == [jobs[0], jobs[1]]
+    assert scheduler.done
@@ -0,0 +1,72 @@
+from migrator.utilites.output import LineBuffer, ImapsyncOutput
+
+OUTPUT = b"""Host1 Nb folders:                        2 folders
+Host1 Nb messages:                       4 messages
+Host1 Total size:                    10000 bytes (9.766 KiB)
+msg INBOX/1 {1000}      copied to INBOX/11    1.00 msgs/s  1.000 KiB/s 1.000 KiB copied  ETA: Mon Jun  3 14:02:18 2024  3 s  2/3 msgs left
+msg INBOX/2 {3000}      copied to INBOX/12    1.00 msgs/s  2.000 KiB/s 3.906 KiB copied  ETA: Mon Jun  3 14:02:18 2024  1 s  1/3 msgs left
+"""
+SUMMARY = b"""Messages transferred           : 3
+Total bytes transferred        : 6000 (5.859 KiB)
+"""
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_line_buffer_splits_chunks() -> None:
+    buffer = LineBuffer()
+    assert buffer.feed(b"one\r\ntw") == [b"one"]
+    assert buffer.feed(b"o") == []
+    assert buffer.feed(b"\nthree\nfo") == [b"two", b"three"]
+    assert buffer.feed(b"ur\n") == [b"four"]
+
+
+def test_line_buffer_is_bounded() -> None:
+    buffer = LineBuffer(max_line=8)
+    assert buffer.feed(b"0123456789") == []
+    assert len(buffer.partial) == 8
+    assert buffer.feed(b"abcdef\nnext\n") == [b"01234567", b"next"]
+
+
+def test_progress_is_parsed_incrementally() -> None:
+    clock = Clock()
+    output = ImapsyncOutput("a__b__u--u.log", clock=clock)
+    # Fed in small chunks like a pipe would
+    for start in range(0, len(OUTPUT), 7):
+        output.feed(OUTPUT[start : start + 7])
+    clock.now = 102.0
+    assert output.changed
+    snapshot = output.snapshot()
+    assert not output.changed
+    assert snapshot == {
+        "logfile": "a__b__u--u.log",
+        "messages": 2,
+        "total_messages": 4,
+        "bytes": 4000,
+        "total_bytes": 10000,
+        "messages_per_second": 1.0,
+        "bytes_per_second": 2000,
+        "percent": 66.7,
+        "eta": 1,
+        "last_line": OUTPUT.splitlines()[-1][:200].decode(),
+    }
+    output.feed(SUMMARY)
+    snapshot = output.snapshot()
+    assert (snapshot["messages"], snapshot["bytes"]) == (3, 6000)
+    assert (snapshot["percent"], snapshot["eta"]) == (100.0, 0)
+
+
+def test_percent_from_the_size_without_eta() -> None:
+    output = ImapsyncOutput()
+    assert output.percent is None
+    output.feed(
+        b"Host1 Total size:   8000 bytes\nmsg INBOX/1 {2000}  copied to INBOX/1\n"
+    )
+    assert output.percent == 25.0
+    assert list(output.tail)[-1] == "msg INBOX/1 {2000}  copied to INBOX/1"
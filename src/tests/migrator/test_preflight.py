@@ -0,0 +1,236 @@
+import socketserver
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+from migrator.utilites.preflight import (
+    LOGIN_OK,
+    LOGIN_REJECTED,
+    LOGIN_UNREACHABLE,
+    LOGIN_UNVERIFIED,
+    Login,
+    PreflightConfig,
+    check_login,
+    job_logins,
+    parse_preflight,
+    rejected_code,
+    verify_logins,
+)
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    Answers CAPABILITY, LOGIN and LOGOUT, logins take <delay> seconds
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, accounts: Dict[str, str], delay: float = 0.0) -> None:
+        super().__init__(("127.0.0.1", 0), FakeIMAPHandler)
+        self.accounts = accounts
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connected = 0
+        self.most_connected = 0
+        self.logins: List[str] = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    server: FakeIMAPServer
+
+    def send(self, line: str) -> None:
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self) -> None:
+        server = self.server
+        with server.lock:
+            server.connected += 1
+            server.most_connected = max(server.most_connected, server.connected)
+        connected = True
+
+        def disconnect() -> None:
+            nonlocal connected
+            if connected:
+                connected = False
+                with server.lock:
+                    server.connected -= 1
+
+        try:
+            self.send("* OK fake IMAP4rev1 ready")
+            for raw in self.rfile:
+                tag, command, *args = raw.decode().strip().split(" ")
+                command = command.upper()
+                if command == "CAPABILITY":
+                    self.send("* CAPABILITY IMAP4rev1 AUTH=PLAIN")
+                    self.send(f"{tag} OK CAPABILITY completed")
+                elif command == "LOGIN":
+                    user, password = (arg.strip('"') for arg in args)
+                    time.sleep(server.delay)
+                    with server.lock:
+                        server.logins.append(user)
+                    if server.accounts.get(user) == password:
+                        self.send(f"{tag} OK LOGIN completed")
+                    else:
+                        self.send(f"{tag} NO [AUTHENTICATIONFAILED] Invalid")
+                elif command == "LOGOUT":
+                    # Before the reply, the client may connect again right after it
+                    disconnect()
+                    self.send("* BYE logging out")
+                    self.send(f"{tag} OK LOGOUT completed")
+                    return
+                else:
+                    self.send(f"{tag} BAD unknown command")
+        finally:
+            disconnect()
+
+
+def serve(accounts: Dict[str, str], delay: float = 0.0) -> Iterator[FakeIMAPServer]:
+    server = FakeIMAPServer(accounts, delay)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def source() -> Iterator[FakeIMAPServer]:
+    yield from serve({f"user{i}": "secret" for i in range(12)}, delay=0.05)
+
+
+@pytest.fixture
+def destination() -> Iterator[FakeIMAPServer]:
+    yield from serve({f"user{i}": "secret" for i in range(12)})
+
+
+def imapsync(
+    host1: Tuple[str, int],
+    user1: str,
+    password1: str,
+    host2: Tuple[str, int],
+    user2: str,
+    password2: str,
+) -> List[str]:
+    return [
+        "imapsync",
+        "--host1",
+        host1[0],
+        "--port1",
+        str(host1[1]),
+        "--user1",
+        user1,
+        "--password1",
+        password1,
+        "--host2",
+        host2[0],
+        "--port2",
+        str(host2[1]),
+        "--user2",
+        user2,
+        "--password2",
+        password2,
+        "--log",
+        "--logdir=/tmp",
+    ]
+
+
+def test_job_logins() -> None:
+    argv = ["imapsync", "--host1", "a.com", "--user1", "u", "--password1", "p w"]
+    argv += ["--host2=b.com", "--user2", "v", "--password2", "q", "--tls2"]
+    assert job_logins(argv) == (
+        Login("a.com", 993, "u", "p w", True, False),
+        Login("b.com", 143, "v", "q", False, True),
+    )
+    assert job_logins(argv + ["--port1", "1143"])[0] == Login(
+        "a.com", 1143, "u", "p w", False, False
+    )
+    assert job_logins(argv + ["--port1", "1143", "--ssl1"])[0].ssl
+    assert job_logins(argv + ["--nossl1"])[0].port == 143
+    assert job_logins(argv + ["--passfile1", "/tmp/p"])[0] is None
+    assert job_logins(argv + ["--port1", "x"])[0] is None
+    assert job_logins(["imapsync", "--host1", "a.com"]) == (None, None)
+
+
+def test_parse_preflight() -> None:
+    assert parse_preflight(None) == PreflightConfig()
+    assert parse_preflight([1]) == PreflightConfig()
+    assert parse_preflight({"WORKERS": 4, "PER_HOST": 2, "TIMEOUT": 1.5}) == (
+        PreflightConfig(4, 2, 1.5)
+    )
+    assert parse_preflight({"WORKERS": 0, "PER_HOST": "2"}) == PreflightConfig()
+
+
+def test_check_login(source: FakeIMAPServer) -> None:
+    login = Login("127.0.0.1", source.port, "user1", "secret", False)
+    assert check_login(login, 5) == LOGIN_OK
+    assert check_login(login._replace(password="wrong"), 5) == LOGIN_REJECTED
+    assert check_login(login._replace(user="nobody"), 5) == LOGIN_REJECTED
+    # The fake server doesn't speak TLS, the connection is closed anyway
+    assert check_login(login._replace(starttls=True), 5) == LOGIN_UNREACHABLE
+    deadline = time.monotonic() + 2
+    while source.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert source.connected == 0
+    assert check_login(login._replace(ssl=True), 5) == LOGIN_UNREACHABLE
+    closed = FakeIMAPServer({})
+    port = closed.port
+    closed.server_close()
+    assert check_login(login._replace(port=port), 5) == LOGIN_UNREACHABLE
+
+
+def test_non_ascii_credentials_are_not_verified() -> None:
+    for server in serve({"user": "pässwörd"}):
+        login = Login("127.0.0.1", server.port, "user", "pässwörd", False)
+        assert check_login(login, 5) == LOGIN_UNVERIFIED
+        assert check_login(login._replace(user="üser"), 5) == LOGIN_UNVERIFIED
+
+    def broken(login: Login, timeout: float) -> str:
+        raise RuntimeError("unexpected")
+
+    outcomes = verify_logins(
+        [("0", imapsync(("a", 1), "u", "p", ("b", 2), "v", "q"))], check=broken
+    )
+    assert outcomes["0"] == (LOGIN_UNVERIFIED, LOGIN_UNVERIFIED)
+    assert rejected_code(outcomes["0"]) is None
+
+
+def test_verify_logins(source: FakeIMAPServer, destination: FakeIMAPServer) -> None:
+    host1 = ("127.0.0.1", source.port)
+    # A different name for the same machine is a different host
+    host2 = ("localhost", destination.port)
+    jobs = [
+        (str(i), imapsync(host1, f"user{i}", "secret", host2, f"user{i}", "secret"))
+        for i in range(10)
+    ]
+    jobs.append(("10", imapsync(host1, "user10", "wrong", host2, "user10", "secret")))
+    jobs.append(("11", imapsync(host1, "user11", "secret", host2, "user11", "wrong")))
+    # Same login as job 0, only tried once
+    jobs.append(("12", imapsync(host1, "user0", "secret", host2, "user0", "secret")))
+    jobs.append(("13", ["imapsync", "--host1", "a.com"]))
+    outcomes = verify_logins(jobs, PreflightConfig(workers=8, per_host=3, timeout=5))
+    assert outcomes["0"] == (LOGIN_OK, LOGIN_OK)
+    assert outcomes["10"] == (LOGIN_REJECTED, LOGIN_OK)
+    assert outcomes["11"] == (LOGIN_OK, LOGIN_REJECTED)
+    assert outcomes["12"] == outcomes["0"]
+    assert outcomes["13"] == (None, None)
+    assert sorted(source.logins) == sorted(f"user{i}" for i in range(12))
+    assert source.most_connected <= 3
+    assert destination.most_connected <= 3
+    # Up to PER_HOST logins of a host run at once
+    assert source.most_connected >= 2
+
+    codes: Dict[str, Optional[int]] = {
+        key: rejected_code(outcome) for key, outcome in outcomes.items()
+    }
+    assert {key: code for key, code in codes.items() if code} == {"10": 161, "11": 162}
+    assert rejected_code((LOGIN_REJECTED, LOGIN_REJECTED)) == 161
+    assert rejected_code((LOGIN_UNREACHABLE, None)) is None
@@ -0,0 +1,167 @@
+import json
+from typing import Any, Dict, List
+
+from redis.exceptions import ConnectionError
+
+from migrator.utilites.progress import (
+    ProgressPublisher,
+    ProgressState,
+    progress_key,
+    read_accounts,
+    read_progress,
+)
+
+
+class FakeRedis:
+    """
+    Lists only, the pipeline runs every command right away
+    """
+
+    def __init__(self) -> None:
+        self.lists: Dict[str, List[str]] = {}
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.down = False
+
+    def pipeline(self) -> "FakeRedis":
+        return self
+
+    def execute(self) -> None:
+        pass
+
+    def rpush(self, key: str, value: str) -> None:
+        if self.down:
+            raise ConnectionError("down")
+        self.lists.setdefault(key, []).append(value)
+
+    def expire(self, key: str, ttl: int) -> None:
+        pass
+
+    def hset(self, key: str, mapping: Dict[str, str]) -> None:
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        return self.hashes.get(key, {})
+
+    def lrange(self, key: str, start: int, end: int) -> List[str]:
+        return self.lists.get(key, [])[start:]
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_updates_are_coalesced() -> None:
+    client = FakeRedis()
+    clock = Clock()
+    progress = ProgressPublisher(client, "task", interval=2, clock=clock)
+    assert not progress.flush()
+    progress.add_jobs(3)
+    progress.started(2)
+    assert progress.flush()
+    progress.finished("0", 0, 10.0)
+    clock.now = 1
+    assert not progress.flush()
+    progress.finished("1", 11, 11.0)
+    clock.now = 2
+    assert progress.flush()
+    deltas = [json.loads(delta) for delta in client.lists[progress_key("task")]]
+    assert deltas == [
+        {"total": 3, "started": 2, "finished": {}, "status": None},
+        {
+            "total": 0,
+            "started": 0,
+            "finished": {"0": [0, 10.0], "1": [11, 11.0]},
+            "status": None,
+        },
+    ]
+    # Forced flushes ignore the interval but not an empty delta
+    assert not progress.flush(force=True)
+    progress.started()
+    assert progress.flush(force=True)
+    assert progress.flush(status="SUCCESS")
+
+
+def test_state_is_rebuilt_from_deltas() -> None:
+    client = FakeRedis()
+    parent = ProgressPublisher(client, "task", interval=0)
+    subtask = ProgressPublisher(client, "task", interval=0)
+    parent.add_jobs(4)
+    parent.flush()
+    subtask.started(2)
+    subtask.finished("0", 0, 1.0)
+    subtask.flush()
+    state = read_progress(client, "task")
+    assert (state.seq, state.total, state.processing) == (2, 4, 1)
+    subtask.finished("1", 1, 2.0)
+    subtask.flush()
+    parent.flush(status="SUCCESS")
+    # A kept state only reads the new deltas
+    assert read_progress(client, "task", state) is state
+    assert state.seq == 4
+    assert state.return_codes == {"0": 0, "1": 1}
+    assert state.exit_times == {"0": 1.0, "1": 2.0}
+    assert state.processing == 0
+    assert state.status == "SUCCESS"
+
+
+def test_changes_since_a_position() -> None:
+    client = FakeRedis()
+    progress = ProgressPublisher(client, "task", interval=0)
+    progress.add_jobs(2)
+    progress.started(2)
+    progress.flush()
+    progress.finished("0", 0, 1.0)
+    progress.flush()
+    first: Dict[str, Any] = read_progress(client, "task", since=0).to_dict()
+    assert first["seq"] == 2
+    progress.finished("1", 0, 2.0)
+    progress.flush()
+    changes = read_progress(client, "task", since=first["seq"]).to_dict()
+    assert changes == {
+        "seq": 3,
+        "total": 0,
+        "started": 0,
+        "return_codes": {"1": 0},
+        "exit_times": {"1": 2.0},
+        "status": None,
+    }
+    assert read_progress(client, "task", since=3).to_dict()["seq"] == 3
+
+
+def test_failed_publish_is_kept_for_the_next_one() -> None:
+    client = FakeRedis()
+    progress = ProgressPublisher(client, "task", interval=0)
+    progress.add_jobs(2)
+    client.down = True
+    assert not progress.flush()
+    progress.started()
+    client.down = False
+    assert progress.flush()
+    state = ProgressState()
+    read_progress(client, "task", state)
+    assert (state.seq, state.total, state.started) == (1, 2, 1)
+
+
+def test_accounts_are_not_deltas() -> None:
+    client = FakeRedis()
+    clock = Clock()
+    progress = ProgressPublisher(client, "task", interval=2, clock=clock)
+    progress.account("0", {"messages": 1})
+    progress.account("0", {"messages": 5})
+    progress.account("1", {"messages": 2})
+    assert progress.flush()
+    assert client.lists == {}
+    assert progress.published == 0
+    clock.now = 2
+    progress.account("1", {"messages": 7})
+    progress.finished("1", 0, 12.0)
+    assert progress.flush()
+    assert len(client.lists[progress_key("task")]) == 1
+    assert read_accounts(client, "task") == {
+        "0": {"messages": 5},
+        "1": {"messages": 7},
+    }
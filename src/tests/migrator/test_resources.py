@@ -0,0 +1,48 @@
+import os
+from pathlib import Path
+
+from migrator.utilites.resources import (
+    CLOCK_TICKS,
+    ResourceTotals,
+    ResourceUsage,
+    read_proc_usage,
+)
+
+
+def test_read_proc_usage(tmp_path: Path) -> None:
+    proc = tmp_path / "42"
+    proc.mkdir()
+    fields = ["S"] + ["0"] * 10 + [str(3 * CLOCK_TICKS), str(CLOCK_TICKS)] + ["0"] * 5
+    (proc / "stat").write_text(f"42 (imap sync (x)) {' '.join(fields)}\n")
+    (proc / "status").write_text(
+        "Name:\timapsync\nVmHWM:\t  2048 kB\nVmRSS:\t 1024 kB\n"
+    )
+    assert read_proc_usage(42, str(tmp_path)) == ResourceUsage(3.0, 1.0, 2048, "proc")
+    assert read_proc_usage(43, str(tmp_path)) is None
+
+
+def test_read_own_usage() -> None:
+    if not os.path.exists(f"/proc/{os.getpid()}/stat"):
+        return
+    usage = read_proc_usage(os.getpid())
+    assert usage is not None
+    assert usage.max_rss > 0
+
+
+def test_totals() -> None:
+    totals = ResourceTotals()
+    totals.add("0", ResourceUsage(1.0, 0.5, 100, "wait4"), 10.0)
+    totals.add("1", ResourceUsage(2.0, 0.5, 300, "proc"), 20.0)
+    totals.add("2", None, 1.0)
+    other = ResourceTotals()
+    other.add("3", ResourceUsage(1.0, 1.0, 200, "wait4"), 5.0)
+    totals.merge(other.to_dict())
+    assert totals.to_dict() == {
+        "accounts": 4,
+        "unmeasured": 1,
+        "user_cpu": 4.0,
+        "system_cpu": 2.0,
+        "wall_time": 36.0,
+        "max_rss": 300,
+        "max_rss_key": "1",
+    }
@@ -0,0 +1,58 @@
+from migrator.utilites.retries import (
+    DEFAULT_CODES,
+    AttemptHistory,
+    RetryPolicy,
+    parse_retry_policy,
+)
+
+
+def test_parse_retry_policy() -> None:
+    assert parse_retry_policy(None) == RetryPolicy()
+    assert parse_retry_policy([1]) == RetryPolicy()
+    policy = parse_retry_policy(
+        {"CODES": [10, 16], "MAX_ATTEMPTS": 5, "BASE_DELAY": 2, "MAX_DELAY": 60}
+    )
+    assert policy == RetryPolicy(frozenset({10, 16}), 5, 2.0, 60.0)
+    policy = parse_retry_policy(
+        {"CODES": "10", "MAX_ATTEMPTS": 0, "BASE_DELAY": -1, "MAX_DELAY": True}
+    )
+    assert policy == RetryPolicy()
+    # The cap can't be under the first delay
+    assert parse_retry_policy({"BASE_DELAY": 90, "MAX_DELAY": 10}).max_delay == 90.0
+
+
+def test_should_retry() -> None:
+    policy = RetryPolicy(max_attempts=3)
+    assert 10 in DEFAULT_CODES
+    assert policy.should_retry(10, 1)
+    assert policy.should_retry(102, 2)
+    assert not policy.should_retry(10, 3)
+    assert not policy.should_retry(0, 1)
+    assert not policy.should_retry(16, 1)
+    assert not RetryPolicy(max_attempts=1).should_retry(10, 1)
+
+
+def test_delay_backs_off_with_jitter() -> None:
+    policy = RetryPolicy(base_delay=10, max_delay=35)
+    assert policy.delay(1, lambda: 0.0) == 5.0
+    assert policy.delay(1, lambda: 1.0) == 10.0
+    assert policy.delay(2, lambda: 0.5) == 15.0
+    assert policy.delay(3, lambda: 1.0) == 35.0
+    assert policy.delay(10, lambda: 0.0) == 17.5
+    assert all(5.0 <= policy.delay(1) <= 10.0 for _ in range(100))
+
+
+def test_attempt_history() -> None:
+    history = AttemptHistory()
+    assert history.count("0") == 0
+    assert history.last("0") is None
+    assert history.add("0", 10, 1.0, 2.0, 30.1234) == 1
+    assert history.add("0", 0, 32.0, 40.0) == 2
+    assert history.add("1", 0, 1.0, 5.0) == 1
+    assert history.last("0").returncode == 0
+    assert history.retried() == {
+        "0": [
+            {"returncode": 10, "started_at": 1.0, "exited_at": 2.0, "retry_in": 30.123},
+            {"returncode": 0, "started_at": 32.0, "exited_at": 40.0, "retry_in": None},
+        ]
+    }
@@ -0,0 +1,107 @@
+from typing import Iterator, List
+
+import pytest
+
+from migrator.utilites.scheduling import (
+    DEFAULT_BYTES_PER_SECOND,
+    DEFAULT_DURATION,
+    DurationEstimator,
+    logfile_domain,
+    longest_first,
+    makespan_report,
+    predict_makespan,
+    windows,
+)
+
+LOGFILE = "imap.src.com__imap.dst.com__User@Example.COM--user@example.org.log"
+
+
+def test_logfile_domain() -> None:
+    assert logfile_domain(LOGFILE) == "example.com"
+    assert logfile_domain("src__dst__user--user.log") is None
+    assert logfile_domain("user@example.com.log") is None
+
+
+def test_estimate_precedence() -> None:
+    estimator = DurationEstimator(
+        pairs={LOGFILE: [10.0, 30.0, 20.0]},
+        domains={"example.com": 40.0},
+        bytes_per_second=100.0,
+        average=50.0,
+    )
+    other = LOGFILE.replace("User@", "other@")
+    assert estimator.estimate(LOGFILE, 1000) == (20.0, "history")
+    assert estimator.estimate(other, 1000) == (10.0, "size")
+    assert estimator.estimate(other, None) == (40.0, "domain")
+    assert estimator.estimate("a__b__x@other.com--y.log", None) == (50.0, "average")
+    assert estimator.estimate(None, None) == (50.0, "average")
+
+
+def test_estimate_without_history() -> None:
+    estimator = DurationEstimator()
+    assert estimator.estimate(LOGFILE, None) == (DEFAULT_DURATION, "default")
+    assert estimator.estimate(LOGFILE, int(DEFAULT_BYTES_PER_SECOND * 3)) == (
+        3.0,
+        "size",
+    )
+
+
+def test_longest_first_is_stable() -> None:
+    jobs = [("a", 1.0), ("b", 5.0), ("c", 1.0), ("d", 3.0)]
+    ordered = longest_first(jobs, lambda job: job[1])
+    assert [name for name, _ in ordered] == ["b", "d", "a", "c"]
+
+
+def test_windows_are_read_lazily() -> None:
+    read: List[int] = []
+
+    def jobs() -> Iterator[int]:
+        for job in range(5):
+            read.append(job)
+            yield job
+
+    chunks = windows(jobs(), 2)
+    assert next(chunks) == [0, 1]
+    # The first window is handed out before the rest is read
+    assert read == [0, 1]
+    assert list(chunks) == [[2, 3], [4]]
+    assert list(windows([], 3)) == []
+
+
+@pytest.mark.parametrize(
+    "durations, slots, makespan",
+    [
+        ([], 2, 0.0),
+        ([5.0, 3.0, 2.0], 1, 10.0),
+        # Longest first fills both slots evenly
+        ([5.0, 3.0, 2.0], 2, 5.0),
+        # The long job starting last keeps the task running alone
+        ([2.0, 3.0, 5.0], 2, 7.0),
+        ([4.0], 0, 4.0),
+    ],
+)
+def test_predict_makespan(durations: list, slots: int, makespan: float) -> None:
+    assert predict_makespan(durations, slots) == makespan
+
+
+def test_makespan_report() -> None:
+    predicted = {"0": 5.0, "1": 3.0, "2": 2.0, "3": 9.0}
+    sources = {"0": "history", "1": "history", "2": "size"}
+    started = {"0": 100.0, "1": 100.0, "2": 103.5}
+    exited = {"0": 106.0, "1": 103.5, "2": 105.0, "4": 90.0}
+    report = makespan_report(predicted, started, exited, 2, sources)
+    assert report == {
+        "jobs": 3,
+        "slots": 2,
+        "predicted_makespan": 5.0,
+        "actual_makespan": 6.0,
+        "mean_absolute_error": 0.7,
+        "sources": {"history": 2, "size": 1},
+    }
+
+
+def test_makespan_report_without_jobs() -> None:
+    report = makespan_report({"0": 1.0}, {}, {"0": 5.0}, 4)
+    assert report["jobs"] == 0
+    assert report["actual_makespan"] is None
+    assert report["predicted_makespan"] == 0.0
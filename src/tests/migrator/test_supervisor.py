@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+import time
+from typing import List
+
+import pytest
+
+from migrator.utilites.supervisor import ProcessSupervisor, pidfd_supported
+
+MODES = [
+    pytest.param(
+        True,
+        marks=pytest.mark.skipif(not pidfd_supported(), reason="no pidfd_open"),
+        id="pidfd",
+    ),
+    pytest.param(False, id="polling"),
+]
+
+
+def sleeper(seconds: float, code: int = 0) -> List[str]:
+    return [
+        sys.executable,
+        "-c",
+        f"import sys, time; time.sleep({seconds}); sys.exit({code})",
+    ]
+
+
+@pytest.mark.parametrize("use_pidfd", MODES)
+def test_wait_returns_as_soon_as_a_child_exits(use_pidfd: bool) -> None:
+    supervisor = ProcessSupervisor(use_pidfd=use_pidfd)
+    try:
+        supervisor.spawn("slow", sleeper(5))
+        supervisor.spawn("fast", sleeper(0.2, 3))
+        start = time.monotonic()
+        exits = supervisor.wait(timeout=4)
+        elapsed = time.monotonic() - start
+        assert [(child.key, child.returncode) for child in exits] == [("fast", 3)]
+        assert elapsed < 2
+        assert exits[0].exited_at >= exits[0].started_at
+        assert 0.1 < exits[0].duration < 2
+        assert len(supervisor) == 1
+        supervisor.terminate_all()
+        exits = supervisor.wait(timeout=4)
+        assert [child.key for child in exits] == ["slow"]
+        assert not supervisor
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+
+
+@pytest.mark.parametrize("use_pidfd", MODES)
+def test_wait_timeout(use_pidfd: bool) -> None:
+    supervisor = ProcessSupervisor(use_pidfd=use_pidfd)
+    try:
+        supervisor.spawn("slow", sleeper(5))
+        start = time.monotonic()
+        assert supervisor.wait(timeout=0.3) == []
+        assert 0.25 < time.monotonic() - start < 2
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+
+
+def test_wait_without_children() -> None:
+    supervisor = ProcessSupervisor()
+    assert supervisor.wait() == []
+    supervisor.close()
+
+
+def test_already_exited_child_is_reaped() -> None:
+    supervisor = ProcessSupervisor()
+    supervisor.spawn("0", [sys.executable, "-c", "pass"])
+    time.sleep(0.5)
+    exits = supervisor.wait(timeout=2)
+    assert [(child.key, child.returncode) for child in exits] == [("0", 0)]
+    supervisor.close()
+
+
+@pytest.mark.parametrize("use_pidfd", MODES)
+def test_watched_descriptor_wakes_wait(use_pidfd: bool) -> None:
+    supervisor = ProcessSupervisor(use_pidfd=use_pidfd)
+    read_end, write_end = os.pipe()
+    try:
+        supervisor.spawn("slow", sleeper(5))
+        supervisor.watch(read_end)
+        threading.Timer(0.2, os.write, (write_end, b"x")).start()
+        start = time.monotonic()
+        assert supervisor.wait(timeout=4) == []
+        assert time.monotonic() - start < 2
+        assert len(supervisor) == 1
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+        os.close(read_end)
+        os.close(write_end)
+
+
+def worker(seconds: float) -> List[str]:
+    # Burns CPU for <seconds> with ~50MB resident, then sleeps as long
+    return [
+        sys.executable,
+        "-c",
+        "import time\n"
+        "data = bytearray(50 * 1024 * 1024)\n"
+        f"end = time.process_time() + {seconds}\n"
+        "while time.process_time() < end: pass\n"
+        f"time.sleep({seconds})",
+    ]
+
+
+@pytest.mark.parametrize("use_pidfd", MODES)
+def test_usage_from_wait4(use_pidfd: bool) -> None:
+    supervisor = ProcessSupervisor(use_pidfd=use_pidfd, sample_proc=False)
+    try:
+        supervisor.spawn("0", worker(0.3))
+        exits = supervisor.wait(timeout=10)
+        assert [child.key for child in exits] == ["0"]
+        usage = exits[0].usage
+        assert usage is not None and usage.source == "wait4"
+        assert usage.user_cpu + usage.system_cpu >= 0.25
+        assert usage.max_rss > 40 * 1024
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+
+
+def test_usage_sampled_from_proc() -> None:
+    if not os.path.exists(f"/proc/{os.getpid()}/stat"):
+        pytest.skip("no /proc")
+    supervisor = ProcessSupervisor(sample_proc=True)
+    supervisor.SAMPLE_INTERVAL = 0.05
+    try:
+        supervisor.spawn("0", worker(0.5))
+        exits: List = []
+        while not exits:
+            exits = supervisor.wait(timeout=10)
+        usage = exits[0].usage
+        assert usage is not None and usage.source == "proc"
+        assert usage.user_cpu + usage.system_cpu >= 0.4
+        assert usage.max_rss > 40 * 1024
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()
+
+
+@pytest.mark.parametrize("use_pidfd", MODES)
+def test_output_is_read_while_the_child_runs(use_pidfd: bool) -> None:
+    supervisor = ProcessSupervisor(use_pidfd=use_pidfd)
+    received: List[bytes] = []
+    code = (
+        "import sys, time\n"
+        "print('first', flush=True)\n"
+        "time.sleep(0.5)\n"
+        "sys.stdout.write('x' * 200000 + '\\nlast\\n')\n"
+    )
+    try:
+        supervisor.spawn("0", [sys.executable, "-c", code], output=received.append)
+        # Returns on timeout, the output doesn't wake the caller
+        assert supervisor.wait(timeout=0.3) == []
+        assert b"".join(received) == b"first\n"
+        exits: List = []
+        while not exits:
+            exits = supervisor.wait(timeout=10)
+        data = b"".join(received)
+        assert len(data) == len("first\n") + 200000 + len("\nlast\n")
+        assert data.endswith(b"\nlast\n")
+    finally:
+        supervisor.terminate_all()
+        supervisor.close()